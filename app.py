@@ -1,78 +1,315 @@
-from flask import Flask, render_template, request, jsonify, send_file
+from flask import Flask, render_template, request, jsonify, send_file, g
+from flask.json.provider import DefaultJSONProvider
+import gzip
+import hashlib
+import hmac
+import io
 import json
+import math
 import os
-from datetime import datetime, date
-from utils.analisador import AnalisadorFinanceiro
-from utils.relatorio_pdf import GeradorRelatorio
+import re
+import threading
+import time
+from datetime import datetime
+from utils.armazenamento import ArmazenamentoGastos, BYTES_LIDOS, CATEGORIAS_PADRAO, escrever_json_atomico
+from utils.cache import CacheLRU, assinatura_arquivos
+from utils.fila_relatorios import FilaRelatorios, FilaCheia
+from utils.frota import AnaliseFrota, contexto_processos
+from utils import metricas
+from utils.metricas import registro, medir, fase
 
 app = Flask(__name__)
 
 # Configuração para dados offline
-DATA_DIR = 'data'
+DATA_DIR = os.environ.get('WALLETCARE_DATA_DIR', 'data')
 FINANCAS_FILE = os.path.join(DATA_DIR, 'financas.json')
 CONFIG_FILE = os.path.join(DATA_DIR, 'config.json')
 
+# Cache em memória de gastos/configurações por dispositivo
+CACHE_MAX_ITENS = int(os.environ.get('WALLETCARE_CACHE_ITENS', 2000))
+CACHE_MAX_BYTES = int(os.environ.get('WALLETCARE_CACHE_MB', 64)) * 1024 * 1024
+
+cache_dados = CacheLRU(max_itens=CACHE_MAX_ITENS, max_bytes=CACHE_MAX_BYTES)
+armazenamento = ArmazenamentoGastos(DATA_DIR, cache=cache_dados)
+
+# O analisador não guarda estado por mensagem: uma instância atende todas as requisições.
+# É criado no primeiro uso, para não pesar na inicialização do servidor.
+_analisador = None
+_analisador_lock = threading.Lock()
+
+# Dispositivos cujos arquivos já existem: pulam as verificações de inicialização
+dispositivos_inicializados = set()
+
+# PDFs prontos por (dispositivo, versão dos dados, versão da config, período)
+RELATORIOS_MAX_ITENS = int(os.environ.get('WALLETCARE_RELATORIOS_ITENS', 200))
+RELATORIOS_MAX_BYTES = int(os.environ.get('WALLETCARE_RELATORIOS_MB', 32)) * 1024 * 1024
+
+cache_relatorios = CacheLRU(max_itens=RELATORIOS_MAX_ITENS, max_bytes=RELATORIOS_MAX_BYTES)
+
+# Geração de PDF em processos separados, para o ReportLab não travar as outras requisições
+RELATORIOS_PROCESSOS = int(os.environ.get('WALLETCARE_RELATORIOS_PROCESSOS', 2))
+RELATORIOS_FILA = int(os.environ.get('WALLETCARE_RELATORIOS_FILA', 20))
+RELATORIOS_VALIDADE = int(os.environ.get('WALLETCARE_RELATORIOS_VALIDADE', 600))
+RELATORIOS_ESPERA = int(os.environ.get('WALLETCARE_RELATORIOS_ESPERA', 120))
+
+# Status e PDFs dos trabalhos ficam em disco: com vários workers, qualquer um consulta e entrega
+fila_relatorios = FilaRelatorios(max_processos=RELATORIOS_PROCESSOS, max_pendentes=RELATORIOS_FILA,
+                                 validade=RELATORIOS_VALIDADE,
+                                 diretorio=os.path.join(DATA_DIR, '.relatorios'),
+                                 contexto=contexto_processos())
+
+# Agregados de todos os dispositivos em /api/admin/frota, só com o token de administração
+ADMIN_TOKEN = os.environ.get('WALLETCARE_ADMIN_TOKEN')
+# O servidor é multithread: o pool da frota não pode usar fork
+analise_frota = AnaliseFrota(DATA_DIR, processos=int(os.environ.get('WALLETCARE_FROTA_PROCESSOS', 0)) or None,
+                             contexto=contexto_processos())
+
+# Respostas JSON acima deste tamanho vão comprimidas com gzip (se o cliente aceitar)
+COMPRESSAO_MINIMA = int(os.environ.get('WALLETCARE_GZIP_MINIMO', 1024))
+COMPRESSAO_NIVEL = 6
+
+# Dashboard resumido: quantos gastos recentes acompanham as séries
+DASHBOARD_RECENTES = 5
+DASHBOARD_RECENTES_MAXIMO = 100
+
+# Métricas expostas em /metrics; requisições acima de WALLETCARE_LENTO_MS são logadas por fase
+LIMITE_LENTO_MS = float(os.environ.get('WALLETCARE_LENTO_MS', 0))
+
+DURACAO_REQUISICAO = registro.histograma('walletcare_http_requisicao_segundos',
+                                         'Duração das requisições por rota', ('metodo', 'rota'))
+REQUISICOES = registro.contador('walletcare_http_requisicoes_total',
+                                'Requisições por rota e status', ('metodo', 'rota', 'status'))
+DURACAO_ARMAZENAMENTO = registro.histograma('walletcare_armazenamento_segundos',
+                                            'Duração das leituras e escritas de dados', ('operacao',))
+DURACAO_ANALISADOR = registro.histograma('walletcare_analisador_segundos',
+                                         'Duração de processar_mensagem por mensagem',
+                                         buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.05))
+registro.medidor('walletcare_cache_itens', 'Entradas no cache de dados',
+                 lambda: cache_dados.estatisticas()['itens'])
+registro.medidor('walletcare_cache_bytes', 'Bytes ocupados pelo cache de dados',
+                 lambda: cache_dados.estatisticas()['bytes'])
+registro.medidor('walletcare_cache_taxa_acerto', 'Fração de consultas atendidas pelo cache de dados',
+                 lambda: cache_dados.estatisticas()['taxa_acerto'])
+registro.medidor('walletcare_relatorios_pendentes', 'Relatórios na fila ou em processamento',
+                 lambda: sum(fila_relatorios.estatisticas()[s] for s in ('na_fila', 'processando')))
+
+class ProvedorJSON(DefaultJSONProvider):
+    """Serialização do jsonify contada na fase 'serializar' da requisição"""
+    
+    def dumps(self, obj, **kwargs):
+        with fase('serializar'):
+            return super().dumps(obj, **kwargs)
+
+app.json = ProvedorJSON(app)
+
+@app.before_request
+def iniciar_medicao():
+    g.inicio_requisicao = time.perf_counter()
+    metricas.iniciar_fases()
+
+@app.after_request
+def registrar_medicao(resposta):
+    duracao = time.perf_counter() - g.inicio_requisicao
+    rota = request.url_rule.rule if request.url_rule else 'desconhecida'
+    DURACAO_REQUISICAO.observar(duracao, request.method, rota)
+    REQUISICOES.incrementar(1, request.method, rota, str(resposta.status_code))
+    
+    fases = metricas.encerrar_fases()
+    if LIMITE_LENTO_MS and duracao * 1000 >= LIMITE_LENTO_MS:
+        fases['outros'] = duracao - sum(fases.values())
+        detalhes = ' '.join(f"{nome}={tempo * 1000:.1f}ms" for nome, tempo in fases.items())
+        app.logger.warning("requisição lenta: %s %s %d %.1fms (%s)", request.method,
+                           request.path, resposta.status_code, duracao * 1000, detalhes)
+    return resposta
+
+@app.after_request
+def comprimir_resposta(resposta):
+    # Registrado depois da medição: roda antes dela, então a compressão entra no tempo da rota
+    if (resposta.status_code != 200 or resposta.direct_passthrough or resposta.mimetype != 'application/json'
+            or 'Content-Encoding' in resposta.headers or 'gzip' not in request.accept_encodings):
+        return resposta
+    
+    corpo = resposta.get_data()
+    if len(corpo) < COMPRESSAO_MINIMA:
+        return resposta
+    
+    resposta.set_data(gzip.compress(corpo, compresslevel=COMPRESSAO_NIVEL))
+    resposta.headers['Content-Encoding'] = 'gzip'
+    resposta.vary.add('Accept-Encoding')
+    # Mesmo conteúdo em outra codificação: o ETag passa a ser fraco
+    etag, fraco = resposta.get_etag()
+    if etag and not fraco:
+        resposta.set_etag(etag, weak=True)
+    return resposta
+
+def obter_analisador():
+    """Analisador compartilhado, criado (e importado) no primeiro uso"""
+    global _analisador
+    if _analisador is None:
+        with _analisador_lock:
+            if _analisador is None:
+                from utils.analisador import AnalisadorFinanceiro
+                _analisador = AnalisadorFinanceiro()
+    return _analisador
+
 def get_device_files(device_id):
     """Retorna os caminhos dos arquivos específicos do dispositivo"""
     device_dir = os.path.join(DATA_DIR, device_id)
-    if not os.path.exists(device_dir):
-        os.makedirs(device_dir)
-    
-    financas_file = os.path.join(device_dir, 'financas.json')
     config_file = os.path.join(device_dir, 'config.json')
     
-    return financas_file, config_file
+    return device_dir, config_file
 
 def inicializar_dados_dispositivo(device_id):
     """Inicializa os arquivos de dados para um dispositivo específico"""
-    financas_file, config_file = get_device_files(device_id)
+    # Já inicializado por este processo: nenhuma chamada ao sistema de arquivos
+    if device_id in dispositivos_inicializados:
+        return
     
-    if not os.path.exists(financas_file):
-        dados_iniciais = {
-            "gastos": [],
-            "categorias": ["alimentacao", "jogos", "bebidas", "entretenimento", "outros", "nao_essencial"]
-        }
-        with open(financas_file, 'w', encoding='utf-8') as f:
-            json.dump(dados_iniciais, f, ensure_ascii=False, indent=2)
+    device_dir, config_file = get_device_files(device_id)
+    os.makedirs(device_dir, exist_ok=True)
+    
+    # Cria os gastos (ou migra o financas.json antigo)
+    armazenamento.inicializar(device_id)
     
     if not os.path.exists(config_file):
-        config_inicial = {
-            "renda_mensal": 0,
-            "primeiro_acesso": True,
-            "tema": "claro",
-            "meta_mensal": 0
-        }
-        with open(config_file, 'w', encoding='utf-8') as f:
-            json.dump(config_inicial, f, ensure_ascii=False, indent=2)
+        with armazenamento.bloqueio(device_id):
+            if not os.path.exists(config_file):
+                config_inicial = {
+                    "renda_mensal": 0,
+                    "primeiro_acesso": True,
+                    "tema": "claro",
+                    "meta_mensal": 0
+                }
+                escrever_json_atomico(config_file, config_inicial)
+    
+    dispositivos_inicializados.add(device_id)
 
 def inicializar_dados():
     """Inicializa o diretório de dados"""
     if not os.path.exists(DATA_DIR):
         os.makedirs(DATA_DIR)
 
-def carregar_dados(device_id):
-    """Carrega dados do arquivo JSON do dispositivo"""
-    financas_file, _ = get_device_files(device_id)
-    with open(financas_file, 'r', encoding='utf-8') as f:
-        return json.load(f)
+def carregar_dados(device_id, inicio=None, fim=None):
+    """Carrega os dados de gastos do dispositivo (opcionalmente só de um período)"""
+    with medir(DURACAO_ARMAZENAMENTO, 'carregar_dados', fase_requisicao='carregar'):
+        return armazenamento.carregar(device_id, inicio, fim)
+
+def carregar_registros(device_id, inicio=None, fim=None):
+    """Gastos como registros Gasto (sem converter para dict), para filtrar antes de serializar"""
+    with medir(DURACAO_ARMAZENAMENTO, 'carregar_registros', fase_requisicao='carregar'):
+        return armazenamento.carregar_registros(device_id, inicio, fim)
 
 def salvar_dados(dados, device_id):
-    """Salva dados no arquivo JSON do dispositivo"""
-    financas_file, _ = get_device_files(device_id)
-    with open(financas_file, 'w', encoding='utf-8') as f:
-        json.dump(dados, f, ensure_ascii=False, indent=2)
+    """Reescreve todos os dados de gastos do dispositivo"""
+    with medir(DURACAO_ARMAZENAMENTO, 'salvar_dados', fase_requisicao='gravar'):
+        armazenamento.salvar(dados, device_id)
+
+def adicionar_gastos(gastos, device_id):
+    """Anexa novos gastos sem reescrever o histórico do dispositivo"""
+    with medir(DURACAO_ARMAZENAMENTO, 'adicionar_gastos', fase_requisicao='gravar'):
+        return armazenamento.adicionar_gastos(gastos, device_id)
+
+def resumo_mes(device_id, ano, mes):
+    """Totais materializados de um mês"""
+    with medir(DURACAO_ARMAZENAMENTO, 'resumo_mes', fase_requisicao='carregar'):
+        return armazenamento.resumo_mes(device_id, ano, mes)
+
+def processar_mensagem(mensagem):
+    with medir(DURACAO_ANALISADOR, fase_requisicao='calcular'):
+        return obter_analisador().processar_mensagem(mensagem)
 
 def carregar_config(device_id):
     """Carrega configurações do dispositivo"""
-    _, config_file = get_device_files(device_id)
-    with open(config_file, 'r', encoding='utf-8') as f:
-        return json.load(f)
+    with medir(DURACAO_ARMAZENAMENTO, 'carregar_config', fase_requisicao='carregar'):
+        _, config_file = get_device_files(device_id)
+        assinatura = assinatura_arquivos(config_file)
+        config = cache_dados.obter((device_id, 'config'), assinatura)
+        
+        if config is None:
+            with open(config_file, 'r', encoding='utf-8') as f:
+                config = json.load(f)
+            BYTES_LIDOS.incrementar(assinatura[0][1])
+            cache_dados.guardar((device_id, 'config'), config, assinatura, assinatura[0][1])
+        
+        return dict(config)
 
 def salvar_config(config, device_id):
     """Salva configurações do dispositivo"""
     _, config_file = get_device_files(device_id)
-    with open(config_file, 'w', encoding='utf-8') as f:
-        json.dump(config, f, ensure_ascii=False, indent=2)
+    cache_dados.invalidar((device_id, 'config'))
+    escrever_json_atomico(config_file, config)
+
+def normalizar_valor(gasto):
+    """Converte gasto['valor'] (número ou texto numérico) para float; ValueError se inválido"""
+    valor = gasto.get('valor')
+    if isinstance(valor, str):
+        try:
+            valor = float(valor.strip().replace(',', '.'))
+        except ValueError:
+            raise ValueError("valor must be a number")
+    if isinstance(valor, bool) or not isinstance(valor, (int, float)) or not math.isfinite(valor):
+        raise ValueError("valor must be a number")
+    gasto['valor'] = valor
+
+def filtrar_gastos(gastos, categoria=None, impulsivo=None, ordenar=None, ordem='desc',
+                   limite=None, depois_de=None):
+    """Filtra, ordena e pagina registros Gasto; retorna (página, cursor da próxima página ou None)"""
+    if categoria:
+        gastos = [g for g in gastos if g.categoria == categoria]
+    if impulsivo is not None:
+        gastos = [g for g in gastos if g.impulsivo == impulsivo]
+    
+    # Sem ordenação nem paginação mantém a ordem de armazenamento
+    if ordenar or limite is not None or depois_de is not None:
+        if ordem not in ('asc', 'desc'):
+            raise ValueError("ordem must be 'asc' or 'desc'")
+        if ordenar == 'id':
+            chave = lambda g: g.id or 0
+        elif ordenar in (None, 'data'):
+            if all(g.timestamp is not None for g in gastos):
+                # Mesma ordem das datas ISO, sem montar a string de cada gasto
+                chave = lambda g: (g.timestamp, g.id or 0)
+            else:
+                chave = lambda g: (str(g.data or ''), g.id or 0)
+        else:
+            raise ValueError("ordenar must be 'data' or 'id'")
+        gastos = sorted(gastos, key=chave, reverse=(ordem == 'desc'))
+    
+    if depois_de is not None:
+        # O cursor é o ID do último gasto da página anterior
+        posicao = next((i for i, g in enumerate(gastos) if g.id == depois_de), None)
+        if posicao is None:
+            raise ValueError("after_id not found")
+        gastos = gastos[posicao + 1:]
+    
+    proximo = None
+    if limite is not None:
+        if limite <= 0:
+            raise ValueError("limit must be positive")
+        if len(gastos) > limite:
+            proximo = gastos[limite - 1].id
+        gastos = gastos[:limite]
+    
+    return gastos, proximo
+
+def etag_consulta(device_id, *extras):
+    """ETag forte: versão dos dados do dispositivo + parâmetros da consulta (+ extras)"""
+    parametros = (sorted(request.args.items(multi=True)),) + extras
+    return f"{armazenamento.versao(device_id)}-{hashlib.sha1(repr(parametros).encode()).hexdigest()[:16]}"
+
+def nao_modificado(etag):
+    """Resposta 304 se o cliente já tem a versão do ETag; None caso contrário"""
+    # Comparação fraca: a cópia comprimida (ETag W/) vale tanto quanto a original
+    if not request.if_none_match.contains_weak(etag):
+        return None
+    return com_etag(app.response_class(status=304), etag)
+
+def com_etag(resposta, etag):
+    # no-cache: o cliente (e o service worker) sempre revalida antes de confiar na cópia
+    resposta.set_etag(etag)
+    resposta.headers['Cache-Control'] = 'no-cache'
+    resposta.headers['X-Versao-Dados'] = etag.split('-', 1)[0]
+    return resposta
 
 @app.route('/')
 def index():
@@ -89,7 +326,9 @@ def api_config():
             return jsonify({"error": "device_id required"}), 400
         
         inicializar_dados_dispositivo(device_id)
-        return jsonify(carregar_config(device_id))
+        # Toda escrita da config avança a versão dos dados
+        etag = etag_consulta(device_id)
+        return nao_modificado(etag) or com_etag(jsonify(carregar_config(device_id)), etag)
     
     elif request.method == 'POST':
         dados = request.json
@@ -99,18 +338,23 @@ def api_config():
             return jsonify({"error": "device_id required"}), 400
         
         inicializar_dados_dispositivo(device_id)
-        config = carregar_config(device_id)
-        
-        if 'renda_mensal' in dados:
-            config['renda_mensal'] = float(dados['renda_mensal'])
-        if 'primeiro_acesso' in dados:
-            config['primeiro_acesso'] = dados['primeiro_acesso']
-        if 'tema' in dados:
-            config['tema'] = dados['tema']
-        if 'meta_mensal' in dados:
-            config['meta_mensal'] = float(dados['meta_mensal'])
         
-        salvar_config(config, device_id)
+        # Leitura-modificação-escrita serializada por dispositivo
+        with armazenamento.bloqueio(device_id):
+            config = carregar_config(device_id)
+            
+            if 'renda_mensal' in dados:
+                config['renda_mensal'] = float(dados['renda_mensal'])
+            if 'primeiro_acesso' in dados:
+                config['primeiro_acesso'] = dados['primeiro_acesso']
+            if 'tema' in dados:
+                config['tema'] = dados['tema']
+            if 'meta_mensal' in dados:
+                config['meta_mensal'] = float(dados['meta_mensal'])
+            
+            salvar_config(config, device_id)
+            # Avança a versão: a próxima sincronização dos clientes traz a config nova
+            armazenamento.registrar_alteracao(device_id, 'config')
         return jsonify({"status": "success", "config": config})
 
 @app.route('/api/gastos', methods=['GET', 'POST'])
@@ -122,8 +366,35 @@ def api_gastos():
             return jsonify({"error": "device_id required"}), 400
         
         inicializar_dados_dispositivo(device_id)
-        dados = carregar_dados(device_id)
-        return jsonify(dados['gastos'])
+        
+        # Se nada mudou, responde 304 sem ler os gastos
+        etag = etag_consulta(device_id)
+        resposta = nao_modificado(etag)
+        if resposta is not None:
+            return resposta
+        
+        try:
+            limite = request.args.get('limit', type=int)
+            depois_de = request.args.get('after_id', type=int)
+            impulsivo = request.args.get('impulsivo')
+            with fase('calcular'):
+                gastos, proximo = filtrar_gastos(
+                    carregar_registros(device_id, request.args.get('inicio'), request.args.get('fim')),
+                    categoria=request.args.get('categoria'),
+                    impulsivo=None if impulsivo is None else impulsivo.lower() in ('1', 'true', 'sim'),
+                    ordenar=request.args.get('ordenar'),
+                    ordem=request.args.get('ordem', 'desc'),
+                    limite=limite,
+                    depois_de=depois_de
+                )
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        
+        # Só a página pedida volta a ser dict
+        resposta = com_etag(jsonify([gasto.para_dict() for gasto in gastos]), etag)
+        if proximo is not None:
+            resposta.headers['X-Proximo-Cursor'] = str(proximo)
+        return resposta
     
     elif request.method == 'POST':
         novo_gasto = request.json
@@ -133,75 +404,235 @@ def api_gastos():
             return jsonify({"error": "device_id required"}), 400
         
         inicializar_dados_dispositivo(device_id)
-        dados = carregar_dados(device_id)
         
         # Remove device_id do gasto antes de salvar
         novo_gasto.pop('device_id', None)
         
+        try:
+            normalizar_valor(novo_gasto)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        
         # Adiciona timestamp se não existir
         if 'data' not in novo_gasto:
             novo_gasto['data'] = datetime.now().isoformat()
         
-        # Adiciona ID único
-        novo_gasto['id'] = len(dados['gastos']) + 1
-        
-        dados['gastos'].append(novo_gasto)
-        salvar_dados(dados, device_id)
+        # Anexa o gasto (o ID único é atribuído pelo armazenamento)
+        adicionar_gastos([novo_gasto], device_id)
         
         return jsonify({"status": "success", "gasto": novo_gasto})
 
+@app.route('/api/sync', methods=['GET', 'POST'])
+def api_sync():
+    """Sincronização incremental do cliente offline.
+    
+    GET ?since=<versao>: gastos adicionados desde a versão devolvida na
+    sincronização anterior (ou todos, com completo=true) e a config se ela
+    mudou. POST {"gastos": [...]}: grava em lote os gastos criados offline,
+    cada um com client_id; reenvios do mesmo client_id não duplicam. Itens
+    inválidos voltam em 'rejeitados' (client_id e erro) sem impedir os outros.
+    """
+    if request.method == 'GET':
+        device_id = request.args.get('device_id')
+        if not device_id:
+            return jsonify({"error": "device_id required"}), 400
+        
+        desde = request.args.get('since')
+        if desde is not None:
+            try:
+                desde = int(desde)
+            except ValueError:
+                return jsonify({"error": "since must be an integer version"}), 400
+        
+        inicializar_dados_dispositivo(device_id)
+        with medir(DURACAO_ARMAZENAMENTO, 'alteracoes_desde', fase_requisicao='carregar'):
+            alteracoes = armazenamento.alteracoes_desde(device_id, desde)
+        
+        resposta = {
+            "versao": alteracoes['versao'],
+            "completo": alteracoes['completo'],
+            "gastos": alteracoes['gastos']
+        }
+        if alteracoes['completo'] or 'config' in alteracoes['operacoes']:
+            resposta['config'] = carregar_config(device_id)
+        return jsonify(resposta)
+    
+    dados = request.get_json(silent=True) or {}
+    device_id = dados.get('device_id')
+    gastos = dados.get('gastos')
+    
+    if not device_id:
+        return jsonify({"error": "device_id required"}), 400
+    if not isinstance(gastos, list):
+        return jsonify({"error": "gastos must be a list"}), 400
+    
+    # Um item inválido nunca vai ser aceito: é recusado sozinho, o resto do lote é gravado
+    aceitos, rejeitados = [], []
+    for posicao, gasto in enumerate(gastos):
+        if not isinstance(gasto, dict) or not gasto.get('client_id'):
+            rejeitados.append({"posicao": posicao, "client_id": None, "erro": "client_id required"})
+            continue
+        try:
+            normalizar_valor(gasto)
+        except ValueError as e:
+            rejeitados.append({"posicao": posicao, "client_id": gasto['client_id'], "erro": str(e)})
+            continue
+        aceitos.append(gasto)
+    
+    inicializar_dados_dispositivo(device_id)
+    agora = datetime.now().isoformat()
+    for gasto in aceitos:
+        gasto.pop('device_id', None)
+        gasto.pop('id', None)
+        gasto.setdefault('data', agora)
+    
+    # Os repetidos voltam preenchidos com o gasto já gravado
+    novos = adicionar_gastos(aceitos, device_id) if aceitos else []
+    
+    return jsonify({
+        "status": "success",
+        "gravados": len(novos),
+        "repetidos": len(aceitos) - len(novos),
+        "gastos": aceitos,
+        "rejeitados": rejeitados
+    })
+
 @app.route('/api/chat', methods=['POST'])
 def api_chat():
     """API para processar mensagens do chat"""
     dados_chat = request.json
     mensagem = dados_chat.get('mensagem', '')
+    device_id = dados_chat.get('device_id')
+    
+    if not device_id:
+        return jsonify({"error": "device_id required"}), 400
     
-    analisador = AnalisadorFinanceiro()
-    resposta = analisador.processar_mensagem(mensagem)
+    resposta = processar_mensagem(mensagem)
     
     # Se a mensagem contém um gasto, salva automaticamente
     if resposta.get('gasto_detectado'):
-        dados = carregar_dados()
+        inicializar_dados_dispositivo(device_id)
         gasto = resposta['gasto']
-        gasto['id'] = len(dados['gastos']) + 1
         gasto['data'] = datetime.now().isoformat()
-        dados['gastos'].append(gasto)
-        salvar_dados(dados)
+        adicionar_gastos([gasto], device_id)
     
     return jsonify(resposta)
 
+@app.route('/api/chat/batch', methods=['POST'])
+def api_chat_batch():
+    """API para processar várias mensagens do chat de uma vez"""
+    dados_chat = request.json or {}
+    mensagens = dados_chat.get('mensagens')
+    device_id = dados_chat.get('device_id')
+    
+    if not device_id:
+        return jsonify({"error": "device_id required"}), 400
+    if not isinstance(mensagens, list):
+        return jsonify({"error": "mensagens must be a list"}), 400
+    
+    resultados = []
+    gastos = []
+    agora = datetime.now().isoformat()
+    
+    # Erros em uma mensagem não interrompem o lote
+    for mensagem in mensagens:
+        try:
+            if not isinstance(mensagem, str):
+                raise ValueError("mensagem deve ser texto")
+            resposta = processar_mensagem(mensagem)
+        except Exception as e:
+            resultados.append({"gasto_detectado": False, "erro": str(e)})
+            continue
+        
+        if resposta.get('gasto_detectado'):
+            resposta['gasto']['data'] = agora
+            gastos.append(resposta['gasto'])
+        resultados.append(resposta)
+    
+    # Todos os gastos detectados são gravados em uma única escrita
+    if gastos:
+        inicializar_dados_dispositivo(device_id)
+        adicionar_gastos(gastos, device_id)
+    
+    return jsonify({
+        "status": "success",
+        "gastos_registrados": len(gastos),
+        "resultados": resultados
+    })
+
+@app.route('/api/importar', methods=['POST'])
+def api_importar():
+    """API para importar extrato bancário (CSV ou OFX) enviado como arquivo"""
+    device_id = request.form.get('device_id')
+    arquivo = request.files.get('arquivo')
+    
+    if not device_id:
+        return jsonify({"error": "device_id required"}), 400
+    if arquivo is None:
+        return jsonify({"error": "arquivo required"}), 400
+    
+    # O importador (csv, OFX) só é carregado por quem importa
+    import csv
+    from utils.importador import ImportadorExtrato, abrir_texto, detectar_formato
+    
+    inicializar_dados_dispositivo(device_id)
+    formato = request.form.get('formato') or detectar_formato(arquivo.filename or '')
+    incluir_positivos = request.form.get('incluir_positivos') in ('1', 'true', 'on')
+    
+    def registrar_progresso(estatisticas):
+        app.logger.info("Importação %s: %s", device_id, estatisticas)
+    
+    importador = ImportadorExtrato(armazenamento, obter_analisador())
+    try:
+        estatisticas = importador.importar(
+            device_id,
+            abrir_texto(arquivo.stream, request.form.get('encoding', 'utf-8-sig')),
+            formato,
+            incluir_positivos=incluir_positivos,
+            progresso=registrar_progresso
+        )
+    except (ValueError, csv.Error) as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    
+    return jsonify({"status": "success", **estatisticas})
+
 @app.route('/api/dashboard')
 def api_dashboard():
     """API para dados do dashboard"""
-    dados = carregar_dados()
-    config = carregar_config()
-    
-    # Filtrar gastos do mês atual
-    mes_atual = datetime.now().month
-    ano_atual = datetime.now().year
-    
-    gastos_mes = []
-    for gasto in dados['gastos']:
-        data_gasto = datetime.fromisoformat(gasto['data'])
-        if data_gasto.month == mes_atual and data_gasto.year == ano_atual:
-            gastos_mes.append(gasto)
-    
-    # Calcular totais por categoria
-    totais_categoria = {}
-    total_gasto = 0
-    gastos_nao_essenciais = 0
-    
-    for gasto in gastos_mes:
-        categoria = gasto.get('categoria', 'outros')
-        valor = float(gasto.get('valor', 0))
-        
-        if categoria not in totais_categoria:
-            totais_categoria[categoria] = 0
-        totais_categoria[categoria] += valor
-        total_gasto += valor
-        
-        if categoria == 'nao_essencial':
-            gastos_nao_essenciais += valor
+    device_id = request.args.get('device_id')
+    if not device_id:
+        return jsonify({"error": "device_id required"}), 400
+    
+    inicializar_dados_dispositivo(device_id)
+    
+    # O dashboard é do mês atual: a virada do mês também muda o ETag
+    agora = datetime.now()
+    etag = etag_consulta(device_id, agora.strftime('%Y-%m'))
+    resposta = nao_modificado(etag)
+    if resposta is not None:
+        return resposta
+    
+    modo = request.args.get('modo', 'completo')
+    if modo not in ('completo', 'resumido'):
+        return jsonify({"error": "modo must be 'completo' or 'resumido'"}), 400
+    try:
+        # Convertido aqui: com type=int, um 'top' não numérico viraria o padrão em silêncio
+        recentes = int(request.args.get('top', DASHBOARD_RECENTES))
+        if not 0 <= recentes <= DASHBOARD_RECENTES_MAXIMO:
+            raise ValueError
+    except (TypeError, ValueError):
+        return jsonify({"error": f"top must be between 0 and {DASHBOARD_RECENTES_MAXIMO}"}), 400
+    
+    config = carregar_config(device_id)
+    
+    # Totais do mês atual vêm do resumo mensal materializado
+    resumo = resumo_mes(device_id, agora.year, agora.month)
+    
+    totais_categoria = {
+        categoria: valores['total'] for categoria, valores in resumo['categorias'].items()
+    }
+    total_gasto = resumo['total']
+    gastos_nao_essenciais = resumo['categorias'].get('nao_essencial', {}).get('total', 0)
     
     # Calcular potencial de economia
     economia_potencial = gastos_nao_essenciais
@@ -211,27 +642,59 @@ def api_dashboard():
         "total_gasto": total_gasto,
         "gastos_categoria": totais_categoria,
         "economia_potencial": economia_potencial,
-        "gastos_mes": gastos_mes,
         "renda_mensal": config.get('renda_mensal', 0)
     }
     
-    return jsonify(dashboard_data)
+    mes_atual = agora.strftime('%Y-%m')
+    if modo == 'resumido':
+        # Séries prontas e só os últimos gastos; a lista inteira fica em /api/gastos
+        registros = carregar_registros(device_id, inicio=mes_atual, fim=mes_atual)
+        with fase('calcular'):
+            dashboard_data.update(series_gastos(registros))
+            dashboard_data['quantidade'] = resumo['quantidade']
+            dashboard_data['recentes'] = [gasto.para_dict() for gasto in mais_recentes(registros, recentes)]
+    else:
+        # Gastos do mês atual (para a lista e o gráfico de evolução)
+        dashboard_data['gastos_mes'] = carregar_dados(device_id, inicio=mes_atual, fim=mes_atual)['gastos']
+    
+    return com_etag(jsonify(dashboard_data), etag)
+
+def series_gastos(gastos):
+    """Totais por dia e por semana (a partir da segunda-feira), em ordem cronológica"""
+    # Importado no primeiro uso, como no analisador: o NumPy não pesa no início do servidor
+    from utils.agregacao import TabelaGastos
+    tabela = TabelaGastos([gasto.para_dict() for gasto in gastos])
+    return {
+        "serie_diaria": [{"dia": dia, "total": total} for dia, total in tabela.por_periodo('D').items()],
+        "serie_semanal": [{"semana": semana, "total": total}
+                          for semana, total in tabela.por_periodo('W').items()]
+    }
+
+def mais_recentes(gastos, quantidade):
+    """Os `quantidade` gastos mais recentes, do mais novo para o mais antigo"""
+    if quantidade == 0:
+        return []
+    gastos, _ = filtrar_gastos(gastos, ordenar='data', ordem='desc', limite=quantidade)
+    return gastos
 
 @app.route('/api/investimentos')
 def api_investimentos():
     """API para sugestões de investimento"""
-    dados = carregar_dados()
-    config = carregar_config()
+    device_id = request.args.get('device_id')
+    if not device_id:
+        return jsonify({"error": "device_id required"}), 400
     
-    # Calcular gastos do mês
-    mes_atual = datetime.now().month
-    ano_atual = datetime.now().year
+    inicializar_dados_dispositivo(device_id)
     
-    total_gastos = 0
-    for gasto in dados['gastos']:
-        data_gasto = datetime.fromisoformat(gasto['data'])
-        if data_gasto.month == mes_atual and data_gasto.year == ano_atual:
-            total_gastos += float(gasto.get('valor', 0))
+    agora = datetime.now()
+    etag = etag_consulta(device_id, agora.strftime('%Y-%m'))
+    resposta = nao_modificado(etag)
+    if resposta is not None:
+        return resposta
+    config = carregar_config(device_id)
+    
+    # Calcular gastos do mês
+    total_gastos = resumo_mes(device_id, agora.year, agora.month)['total']
     
     renda = config.get('renda_mensal', 0)
     sobra = renda - total_gastos
@@ -252,18 +715,150 @@ def api_investimentos():
         ]
     }
     
-    return jsonify(investimentos_data)
+    return com_etag(jsonify(investimentos_data), etag)
+
+NOMES_MESES = ['Janeiro', 'Fevereiro', 'Março', 'Abril', 'Maio', 'Junho', 'Julho',
+               'Agosto', 'Setembro', 'Outubro', 'Novembro', 'Dezembro']
+
+def ler_periodo_relatorio(args):
+    """Lê periodo (mes/intervalo/tudo) da query; retorna (inicio, fim, rótulo)"""
+    periodo = args.get('periodo', 'tudo')
+    
+    if periodo == 'tudo':
+        return None, None, None
+    
+    if periodo == 'mes':
+        mes = args.get('mes') or datetime.now().strftime('%Y-%m')
+        referencia = datetime.strptime(mes, '%Y-%m')
+        return mes, mes, f"{NOMES_MESES[referencia.month - 1]}/{referencia.year}"
+    
+    if periodo == 'intervalo':
+        inicio, fim = args.get('inicio'), args.get('fim')
+        if not inicio or not fim:
+            raise ValueError("inicio and fim required for periodo=intervalo")
+        for limite in (inicio, fim):
+            datetime.strptime(limite, '%Y-%m-%d' if len(limite) > 7 else '%Y-%m')
+        return inicio, fim, f"{inicio} a {fim}"
+    
+    raise ValueError("periodo must be 'mes', 'intervalo' or 'tudo'")
+
+def preparar_relatorio(device_id, args):
+    """Valida período/modo; retorna (chave do relatório, inicio, fim, rótulo, modo)"""
+    inicio, fim, rotulo = ler_periodo_relatorio(args)
+    
+    modo = args.get('modo', 'completo')
+    if modo not in ('completo', 'resumo'):
+        raise ValueError("modo must be 'completo' or 'resumo'")
+    
+    inicializar_dados_dispositivo(device_id)
+    _, config_file = get_device_files(device_id)
+    chave = (device_id, armazenamento.versao(device_id), assinatura_arquivos(config_file), inicio, fim, modo)
+    return chave, inicio, fim, rotulo, modo
+
+def submeter_relatorio(device_id, chave, inicio, fim, rotulo, modo):
+    """Enfileira o relatório (ou reaproveita o trabalho com a mesma chave)"""
+    # Um pedido repetido não relê o período inteiro só para descobrir que o trabalho já existe
+    existente = fila_relatorios.existente(chave)
+    if existente is not None:
+        return existente
+    return fila_relatorios.submeter(
+        chave, device_id, carregar_dados(device_id, inicio, fim), carregar_config(device_id),
+        periodo=rotulo, incluir_detalhes=(modo == 'completo')
+    )
+
+def enviar_pdf(pdf):
+    return send_file(io.BytesIO(pdf), mimetype='application/pdf', as_attachment=True,
+                     download_name='relatorio_walletcare.pdf')
 
 @app.route('/api/relatorio/pdf')
 def gerar_relatorio_pdf():
-    """Gera relatório em PDF"""
-    dados = carregar_dados()
-    config = carregar_config()
+    """Gera relatório em PDF (período: mes/intervalo/tudo; modo: completo/resumo)"""
+    device_id = request.args.get('device_id')
+    if not device_id:
+        return jsonify({"error": "device_id required"}), 400
+    
+    # Só a validação dos parâmetros e a fila viram erro do cliente
+    try:
+        relatorio = preparar_relatorio(device_id, request.args)
+        chave = relatorio[0]
+        
+        # Downloads repetidos sem mudança nos dados reaproveitam o PDF pronto
+        pdf = cache_relatorios.obter(chave)
+        if pdf is not None:
+            return enviar_pdf(pdf)
+        
+        # Mesmo no modo síncrono o PDF é gerado no pool: esta thread só espera
+        trabalho = submeter_relatorio(device_id, *relatorio)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except FilaCheia:
+        return jsonify({"error": "report queue is full, try again later"}), 503, {"Retry-After": "5"}
+    
+    try:
+        with fase('calcular'):
+            pdf = fila_relatorios.resultado(trabalho['job_id'], device_id, espera=RELATORIOS_ESPERA)
+    except TimeoutError:
+        # Continua na fila: o cliente pode acompanhar pelo job_id
+        return jsonify(trabalho), 504
+    except Exception as e:
+        # Falha do trabalhador (ex.: gasto gravado com valor inválido): erro do servidor,
+        # com a mesma descrição que /api/relatorio/jobs/<id> mostra em 'erro'
+        app.logger.exception("Relatório %s de %s falhou", trabalho['job_id'], device_id)
+        return jsonify({"error": "report generation failed", "job_id": trabalho['job_id'],
+                        "erro": str(e)}), 500
     
-    gerador = GeradorRelatorio()
-    arquivo_pdf = gerador.gerar_relatorio_completo(dados, config)
+    cache_relatorios.guardar(chave, pdf, tamanho=len(pdf))
+    return enviar_pdf(pdf)
+
+@app.route('/api/relatorio/jobs', methods=['POST'])
+def api_relatorio_jobs():
+    """Enfileira um relatório PDF; o cliente acompanha pelo job_id e baixa quando concluir"""
+    dados = request.get_json(silent=True) or {}
+    device_id = dados.get('device_id')
+    if not device_id:
+        return jsonify({"error": "device_id required"}), 400
+    
+    try:
+        trabalho = submeter_relatorio(device_id, *preparar_relatorio(device_id, dados))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except FilaCheia:
+        return jsonify({"error": "report queue is full, try again later"}), 503, {"Retry-After": "5"}
     
-    return send_file(arquivo_pdf, as_attachment=True, download_name='relatorio_walletcare.pdf')
+    return jsonify(trabalho), 200 if trabalho['status'] == 'concluido' else 202
+
+@app.route('/api/relatorio/jobs/<job_id>')
+def api_relatorio_job_status(job_id):
+    """Status de um trabalho: na_fila, processando, concluido ou erro"""
+    device_id = request.args.get('device_id')
+    if not device_id:
+        return jsonify({"error": "device_id required"}), 400
+    
+    trabalho = fila_relatorios.consultar(job_id, device_id)
+    if trabalho is None:
+        return jsonify({"error": "job not found or expired"}), 404
+    return jsonify(trabalho)
+
+@app.route('/api/relatorio/jobs/<job_id>/pdf')
+def api_relatorio_job_pdf(job_id):
+    """Baixa o PDF de um trabalho concluído"""
+    device_id = request.args.get('device_id')
+    if not device_id:
+        return jsonify({"error": "device_id required"}), 400
+    
+    trabalho = fila_relatorios.consultar(job_id, device_id)
+    if trabalho is None:
+        return jsonify({"error": "job not found or expired"}), 404
+    if trabalho['status'] == 'erro':
+        return jsonify(trabalho), 500
+    if trabalho['status'] != 'concluido':
+        return jsonify(trabalho), 409
+    
+    # O PDF publicado pode expirar (ou sumir) entre a consulta e a leitura
+    pdf = fila_relatorios.resultado(job_id, device_id)
+    if pdf is None:
+        return jsonify({"error": "job not found or expired"}), 404
+    return enviar_pdf(pdf)
 
 @app.route('/api/reset-gastos', methods=['POST'])
 def reset_gastos():
@@ -275,10 +870,11 @@ def reset_gastos():
         if not device_id:
             return jsonify({"error": "device_id required"}), 400
         
-        # Reinicializa o arquivo de gastos do dispositivo
+        # Reinicializa os gastos do dispositivo
+        inicializar_dados_dispositivo(device_id)
         dados_iniciais = {
             "gastos": [],
-            "categorias": ["alimentacao", "jogos", "bebidas", "entretenimento", "outros", "nao_essencial"]
+            "categorias": list(CATEGORIAS_PADRAO)
         }
         salvar_dados(dados_iniciais, device_id)
         
@@ -286,6 +882,45 @@ def reset_gastos():
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
 
+@app.route('/api/cache')
+def api_cache():
+    """Estatísticas dos caches de dados e de relatórios (acertos, faltas, ocupação)"""
+    return jsonify({
+        **cache_dados.estatisticas(),
+        "relatorios": cache_relatorios.estatisticas(),
+        "fila_relatorios": fila_relatorios.estatisticas()
+    })
+
+@app.route('/api/admin/frota')
+def api_admin_frota():
+    """Gasto por mês e categoria, impulsivos e dispositivos ativos somados em todos os dispositivos"""
+    if not ADMIN_TOKEN:
+        return jsonify({"error": "admin endpoints disabled (set WALLETCARE_ADMIN_TOKEN)"}), 403
+    if not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {ADMIN_TOKEN}'):
+        return jsonify({"error": "invalid admin token"}), 401
+    
+    inicio, fim = request.args.get('inicio'), request.args.get('fim')
+    for mes in (inicio, fim):
+        if mes is not None and not re.fullmatch(r'\d{4}-\d{2}', mes):
+            return jsonify({"error": "inicio and fim must be AAAA-MM"}), 400
+    
+    # Só os dispositivos alterados desde a última consulta são relidos
+    with fase('calcular'):
+        return jsonify(analise_frota.calcular(inicio, fim))
+
+@app.route('/metrics')
+def metrics():
+    """Métricas no formato texto do Prometheus"""
+    return registro.exportar(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+@app.route('/sw.js')
+def service_worker():
+    """Service Worker servido na raiz: o escopo dele cobre a página e a API"""
+    resposta = send_file(os.path.join(app.static_folder, 'sw.js'), mimetype='application/javascript')
+    # Sempre revalidado, para uma versão nova do SW chegar logo aos clientes
+    resposta.headers['Cache-Control'] = 'no-cache'
+    return resposta
+
 @app.route('/manifest.json')
 def manifest():
     """Manifest do PWA"""
@@ -313,5 +948,6 @@ def manifest():
 
 if __name__ == '__main__':
     inicializar_dados()
+    # Servidor de desenvolvimento (um processo); em produção: gunicorn -c gunicorn.conf.py wsgi:app
     # Configuração para aceitar conexões de qualquer IP na rede local
     app.run(debug=True, host='0.0.0.0', port=5000, threaded=True)
@@ -0,0 +1,86 @@
+"""Benchmark do AnalisadorFinanceiro: mensagens/s antes e depois da regex compilada.
+
+Uso: python -m benchmarks.bench_analisador [--mensagens 20000]
+
+A implementação de referência abaixo é a versão anterior (laços de
+substring e cinco re.search em sequência); o benchmark também confere
+que as duas produzem exatamente os mesmos resultados.
+"""
+import argparse
+import re
+import time
+
+from benchmarks.dados import gerar_mensagens
+from utils.analisador import AnalisadorFinanceiro
+
+
+class AnalisadorReferencia(AnalisadorFinanceiro):
+    """Versão anterior da extração de valor/categoria, mantida só para comparação"""
+
+    def extrair_valor(self, texto):
+        texto = texto.lower()
+        for padrao in self.padroes_valor:
+            match = re.search(padrao, texto)
+            if match:
+                try:
+                    return float(match.group(1).replace(',', '.'))
+                except ValueError:
+                    continue
+        return None
+
+    def identificar_categoria(self, texto):
+        texto = texto.lower()
+        for categoria, palavras in self.categorias.items():
+            for palavra in palavras:
+                if palavra in texto:
+                    return categoria
+        return 'outros'
+
+    def detectar_gasto_impulsivo(self, texto):
+        texto = texto.lower()
+        return any(palavra in texto for palavra in self.palavras_impulsivas)
+
+    def processar_mensagem(self, mensagem):
+        valor = self.extrair_valor(mensagem)
+        if valor is None:
+            return {"gasto_detectado": False, "resposta": ""}
+        categoria = self.identificar_categoria(mensagem)
+        eh_impulsivo = self.detectar_gasto_impulsivo(mensagem)
+        if eh_impulsivo:
+            categoria = 'nao_essencial'
+        gasto = {"valor": valor, "categoria": categoria, "descricao": mensagem.strip(), "eh_impulsivo": eh_impulsivo}
+        return {"gasto_detectado": True, "gasto": gasto, "resposta": self.gerar_resposta_motivacional(gasto)}
+
+
+def resumo(resultado):
+    if not resultado['gasto_detectado']:
+        return (False,)
+    gasto = resultado['gasto']
+    return (True, gasto['valor'], gasto['categoria'], gasto['eh_impulsivo'])
+
+
+def medir(analisador, mensagens):
+    inicio = time.perf_counter()
+    resultados = [analisador.processar_mensagem(m) for m in mensagens]
+    duracao = time.perf_counter() - inicio
+    return len(mensagens) / duracao, [resumo(r) for r in resultados]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--mensagens', type=int, default=20000)
+    args = parser.parse_args()
+
+    mensagens = gerar_mensagens(args.mensagens)
+    taxa_ref, resultados_ref = medir(AnalisadorReferencia(), mensagens)
+    taxa_nova, resultados_novos = medir(AnalisadorFinanceiro(), mensagens)
+
+    divergencias = sum(1 for a, b in zip(resultados_ref, resultados_novos) if a != b)
+    print(f"referência: {taxa_ref:,.0f} mensagens/s")
+    print(f"compilado:  {taxa_nova:,.0f} mensagens/s ({taxa_nova / taxa_ref:.2f}x)")
+    print(f"divergências: {divergencias}")
+    return 1 if divergencias else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,114 @@
+"""Benchmark de inicialização: importação do app e tempo até a primeira resposta.
+
+Uso:
+    python -m benchmarks.bench_inicio [--repeticoes 5] [--workers 0]
+
+Cada repetição usa processos novos e um diretório de dados vazio:
+  - importacao: tempo de `import app` em um interpretador limpo, e quais
+    módulos pesados (numpy, reportlab) já vieram junto
+  - primeira_resposta: do início do processo do servidor até o primeiro
+    GET /api/config respondido (inclui a inicialização do dispositivo)
+  - config_quente: o mesmo GET repetido, já com o dispositivo inicializado
+  - primeiro_chat: o primeiro POST /api/chat (carrega o analisador)
+
+São impressos mediana, mínimo e máximo de cada medida, em ms.
+"""
+import argparse
+import http.client
+import json
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.carga import RAIZ, ambiente_app, porta_livre, subir_servidor
+
+MODULOS_PESADOS = ('numpy', 'reportlab', 'utils.analisador', 'utils.importador')
+
+CODIGO_IMPORTACAO = f"""
+import json, sys, time
+inicio = time.perf_counter()
+import app
+duracao = time.perf_counter() - inicio
+print(json.dumps({{"ms": duracao * 1000, "modulos": [m for m in {MODULOS_PESADOS!r} if m in sys.modules]}}))
+"""
+
+
+def medir_importacao(data_dir):
+    saida = subprocess.run([sys.executable, '-c', CODIGO_IMPORTACAO], cwd=RAIZ, env=ambiente_app(data_dir),
+                           capture_output=True, text=True, check=True).stdout
+    return json.loads(saida.strip().splitlines()[-1])
+
+
+def requisitar(porta, metodo, caminho, corpo=None):
+    """(status, duração em s) de uma requisição em uma conexão nova"""
+    conexao = http.client.HTTPConnection('127.0.0.1', porta, timeout=30)
+    inicio = time.perf_counter()
+    try:
+        cabecalhos = {'Content-Type': 'application/json'} if corpo is not None else {}
+        conexao.request(metodo, caminho, body=None if corpo is None else json.dumps(corpo), headers=cabecalhos)
+        resposta = conexao.getresponse()
+        resposta.read()
+        return resposta.status, time.perf_counter() - inicio
+    finally:
+        conexao.close()
+
+
+def medir_servidor(data_dir, workers):
+    porta = porta_livre()
+    inicio = time.perf_counter()
+    processo = subir_servidor(porta, data_dir, workers)
+    try:
+        limite = time.monotonic() + 30
+        while True:
+            if processo.poll() is not None:
+                raise RuntimeError("o servidor terminou durante a inicialização")
+            if time.monotonic() > limite:
+                raise RuntimeError("o servidor não respondeu em 30 s")
+            try:
+                status, _ = requisitar(porta, 'GET', '/api/config?device_id=inicio')
+            except OSError:
+                time.sleep(0.005)
+                continue
+            if status != 200:
+                raise RuntimeError(f"GET /api/config respondeu {status}")
+            break
+        primeira = time.perf_counter() - inicio
+
+        _, quente = requisitar(porta, 'GET', '/api/config?device_id=inicio')
+        _, chat = requisitar(porta, 'POST', '/api/chat',
+                             {"device_id": "inicio", "mensagem": "gastei 25 reais no lanche"})
+        return {"primeira_resposta": primeira * 1000, "config_quente": quente * 1000, "primeiro_chat": chat * 1000}
+    finally:
+        processo.terminate()
+        processo.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeticoes', type=int, default=5)
+    parser.add_argument('--workers', type=int, default=0,
+                        help="mede o gunicorn com N processos em vez do servidor de desenvolvimento")
+    args = parser.parse_args()
+
+    medidas = {"importacao": [], "primeira_resposta": [], "config_quente": [], "primeiro_chat": []}
+    modulos = set()
+    for _ in range(args.repeticoes):
+        with tempfile.TemporaryDirectory() as data_dir:
+            importacao = medir_importacao(data_dir)
+            medidas['importacao'].append(importacao['ms'])
+            modulos.update(importacao['modulos'])
+        with tempfile.TemporaryDirectory() as data_dir:
+            for nome, valor in medir_servidor(data_dir, args.workers).items():
+                medidas[nome].append(valor)
+
+    print(f"{'medida':<20} {'mediana':>10} {'mínimo':>10} {'máximo':>10}")
+    for nome, valores in medidas.items():
+        print(f"{nome:<20} {statistics.median(valores):>8.1f}ms {min(valores):>8.1f}ms {max(valores):>8.1f}ms")
+    print(f"\nmódulos pesados carregados por `import app`: {', '.join(sorted(modulos)) or 'nenhum'}")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,45 @@
+"""Memória ocupada por gastos carregados: dicts do JSON contra registros Gasto.
+
+Uso: python -m benchmarks.bench_memoria [--gastos 100000]
+
+Os dicts passam por json.dumps/json.loads para ter a mesma forma de quando
+são lidos das partições (uma string nova por data e por categoria).
+"""
+import argparse
+import gc
+import json
+import tracemalloc
+
+from benchmarks.dados import gerar_gastos
+from utils.gasto import Gasto
+
+
+def medir(construir):
+    gc.collect()
+    tracemalloc.start()
+    objetos = construir()
+    atual, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return objetos, atual
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--gastos', type=int, default=100000)
+    args = parser.parse_args()
+
+    texto = json.dumps(gerar_gastos(args.gastos), ensure_ascii=False)
+    dicts, bytes_dicts = medir(lambda: json.loads(texto))
+    # Registros montados de uma leitura própria: as descrições não são compartilhadas com os dicts
+    registros, bytes_registros = medir(lambda: [Gasto.de_dict(gasto) for gasto in json.loads(texto)])
+
+    divergencias = sum(1 for gasto, registro in zip(dicts, registros) if registro.para_dict() != gasto)
+    print(f"dicts:    {bytes_dicts / 1024 / 1024:7.1f} MB ({bytes_dicts / args.gastos:5.0f} bytes/gasto)")
+    print(f"Gasto:    {bytes_registros / 1024 / 1024:7.1f} MB ({bytes_registros / args.gastos:5.0f} bytes/gasto)")
+    print(f"redução:  {1 - bytes_registros / bytes_dicts:.0%}")
+    print(f"divergências na volta para dict: {divergencias}")
+    return 1 if divergencias else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
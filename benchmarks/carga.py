@@ -0,0 +1,300 @@
+"""Teste de carga de ponta a ponta com detecção de escritas perdidas.
+
+Uso:
+    python -m benchmarks.carga [--dispositivos 20] [--operacoes 50] [--url http://host:porta]
+                               [--workers 4] [--clientes-por-dispositivo 3]
+
+Sem --url, sobe o app em um subprocesso com um diretório de dados
+temporário: o servidor de desenvolvimento ou, com --workers, o gunicorn
+com essa quantidade de processos (gunicorn.conf.py). Cada dispositivo
+simulado tem vários clientes concorrentes (uma thread e uma conexão cada,
+como o app aberto em duas abas e a fila offline subindo ao mesmo tempo):
+as escritas de um mesmo dispositivo se sobrepõem, que é onde um lock
+faltando perderia gastos ou repetiria IDs. Os clientes misturam POST /api/gastos,
+/api/chat, /api/dashboard, lotes offline em /api/sync (cada lote é
+enviado duas vezes, como depois de uma resposta perdida) e downloads de
+PDF. No fim são
+impressas latências (p50/p95/p99) e requisições/s por rota, e cada
+dispositivo tem o conjunto de IDs gravados conferido contra os gastos
+confirmados pelo servidor: qualquer gasto perdido, duplicado ou inesperado
+faz o comando terminar com código 1.
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+from urllib.parse import urlencode, urlsplit
+
+from benchmarks.dados import gerar_mensagens
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Peso de cada operação na mistura de um dispositivo
+MISTURA = {
+    'POST /api/gastos': 35,
+    'POST /api/chat': 30,
+    'GET /api/dashboard': 20,
+    'POST /api/sync': 5,
+    'GET /api/relatorio/pdf': 10,
+}
+
+
+class Cliente:
+    """Conexão HTTP persistente de um dispositivo, registrando a latência de cada chamada"""
+
+    def __init__(self, host, porta, registrar):
+        self.conexao = http.client.HTTPConnection(host, porta, timeout=120)
+        self.registrar = registrar
+
+    def chamar(self, rota, metodo, caminho, corpo=None):
+        cabecalhos = {}
+        if corpo is not None:
+            corpo = json.dumps(corpo)
+            cabecalhos['Content-Type'] = 'application/json'
+
+        inicio = time.perf_counter()
+        try:
+            self.conexao.request(metodo, caminho, body=corpo, headers=cabecalhos)
+            resposta = self.conexao.getresponse()
+            conteudo = resposta.read()
+            status = resposta.status
+        except (OSError, http.client.HTTPException):
+            self.conexao.close()
+            conteudo, status = b'', 0
+        self.registrar(rota, time.perf_counter() - inicio, status)
+
+        if status == 200 and resposta.getheader('Content-Type', '').startswith('application/json'):
+            return status, json.loads(conteudo)
+        return status, None
+
+    def fechar(self):
+        self.conexao.close()
+
+
+def simular_dispositivo(host, porta, device_id, operacoes, semente, registrar, cliente_id=None):
+    """Executa a mistura de operações de um cliente do dispositivo; retorna os IDs confirmados pelo servidor"""
+    aleatorio = random.Random(semente)
+    mensagens = gerar_mensagens(operacoes, semente)
+    rotas, pesos = list(MISTURA), list(MISTURA.values())
+    cliente = Cliente(host, porta, registrar)
+    confirmados = []
+    device = urlencode({"device_id": device_id})
+
+    for indice in range(operacoes):
+        rota = aleatorio.choices(rotas, pesos)[0]
+        if rota == 'POST /api/gastos':
+            status, resposta = cliente.chamar(rota, 'POST', '/api/gastos', {
+                "device_id": device_id,
+                "valor": round(aleatorio.uniform(1, 300), 2),
+                "categoria": aleatorio.choice(['alimentacao', 'bebidas', 'entretenimento', 'outros']),
+                "descricao": f"carga {indice}",
+                "eh_impulsivo": aleatorio.random() < 0.1
+            })
+            if resposta:
+                confirmados.append(resposta['gasto']['id'])
+        elif rota == 'POST /api/chat':
+            status, resposta = cliente.chamar(rota, 'POST', '/api/chat', {
+                "device_id": device_id, "mensagem": mensagens[indice]
+            })
+            if resposta and resposta.get('gasto_detectado'):
+                confirmados.append(resposta['gasto']['id'])
+        elif rota == 'POST /api/sync':
+            lote = {"device_id": device_id, "gastos": [{
+                "client_id": f"{cliente_id or device_id}-{indice}-{n}",
+                "valor": round(aleatorio.uniform(1, 100), 2),
+                "categoria": 'alimentacao',
+                "descricao": f"offline {indice}",
+                "data": datetime.now().isoformat(timespec='seconds')
+            } for n in range(2)]}
+            status, resposta = cliente.chamar(rota, 'POST', '/api/sync', lote)
+            if resposta:
+                confirmados.extend(gasto['id'] for gasto in resposta['gastos'])
+                # Reenvio idempotente: um gasto duplicado aparece na verificação como inesperado
+                cliente.chamar(rota, 'POST', '/api/sync', lote)
+        elif rota == 'GET /api/dashboard':
+            cliente.chamar(rota, 'GET', f'/api/dashboard?{device}')
+        else:
+            cliente.chamar(rota, 'GET', f'/api/relatorio/pdf?{device}&periodo=mes&modo=resumo')
+
+    cliente.fechar()
+    return confirmados
+
+
+def verificar(host, porta, confirmados):
+    """Confere os IDs gravados de cada dispositivo; retorna a lista de problemas"""
+    problemas = []
+    cliente = Cliente(host, porta, lambda *_: None)
+    for device_id, ids in sorted(confirmados.items()):
+        status, gastos = cliente.chamar('verificacao', 'GET', f'/api/gastos?{urlencode({"device_id": device_id})}')
+        if status != 200:
+            problemas.append(f"{device_id}: GET /api/gastos respondeu {status}")
+            continue
+
+        gravados = [gasto.get('id') for gasto in gastos]
+        esperados = set(ids)
+        if len(ids) != len(esperados):
+            problemas.append(f"{device_id}: IDs confirmados repetidos")
+        if len(gravados) != len(set(gravados)):
+            problemas.append(f"{device_id}: IDs gravados duplicados")
+        perdidos = esperados - set(gravados)
+        inesperados = set(gravados) - esperados
+        if perdidos:
+            problemas.append(f"{device_id}: {len(perdidos)} gasto(s) confirmado(s) não gravado(s): {sorted(perdidos)[:10]}")
+        if inesperados:
+            problemas.append(f"{device_id}: {len(inesperados)} gasto(s) não confirmado(s) gravado(s): {sorted(inesperados)[:10]}")
+    cliente.fechar()
+    return problemas
+
+
+def porta_livre():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def ambiente_app(data_dir, **variaveis):
+    """Variáveis de ambiente para rodar o app da raiz do repositório com outro diretório de dados"""
+    return dict(os.environ, WALLETCARE_DATA_DIR=data_dir, **variaveis,
+                PYTHONPATH=os.pathsep.join(filter(None, [RAIZ, os.environ.get('PYTHONPATH')])))
+
+
+def subir_servidor(porta, data_dir, workers=0):
+    """Inicia o app (servidor de desenvolvimento ou gunicorn) sem esperar por ele"""
+    if workers:
+        ambiente = ambiente_app(data_dir, WALLETCARE_BIND=f'127.0.0.1:{porta}', WALLETCARE_WORKERS=str(workers))
+        comando = [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'wsgi:app']
+    else:
+        ambiente = ambiente_app(data_dir)
+        codigo = f"from app import app; app.run(host='127.0.0.1', port={porta}, threaded=True)"
+        comando = [sys.executable, '-c', codigo]
+    return subprocess.Popen(comando, cwd=RAIZ, env=ambiente,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def iniciar_servidor(porta, data_dir, workers=0):
+    """Sobe o app e espera aceitar conexões"""
+    processo = subir_servidor(porta, data_dir, workers)
+
+    limite = time.monotonic() + 30
+    while time.monotonic() < limite:
+        if processo.poll() is not None:
+            raise RuntimeError("o servidor terminou durante a inicialização")
+        try:
+            socket.create_connection(('127.0.0.1', porta), timeout=0.5).close()
+            return processo
+        except OSError:
+            time.sleep(0.1)
+    processo.terminate()
+    raise RuntimeError("o servidor não respondeu em 30 s")
+
+
+def percentil(ordenados, p):
+    if len(ordenados) == 1:
+        return ordenados[0]
+    return statistics.quantiles(ordenados, n=100, method='inclusive')[p - 1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--dispositivos', type=int, default=20)
+    parser.add_argument('--operacoes', type=int, default=50, help="requisições por dispositivo")
+    parser.add_argument('--url', help="servidor já em execução (ex.: http://127.0.0.1:5000)")
+    parser.add_argument('--workers', type=int, default=0,
+                        help="sobe o gunicorn com N processos em vez do servidor de desenvolvimento")
+    parser.add_argument('--clientes-por-dispositivo', type=int, default=3,
+                        help="clientes concorrentes em cada dispositivo (as --operacoes são divididas entre eles)")
+    parser.add_argument('--semente', type=int, default=42)
+    args = parser.parse_args()
+
+    processo = None
+    temporario = None
+    if args.url:
+        destino = urlsplit(args.url)
+        host, porta = destino.hostname, destino.port or 80
+    else:
+        temporario = tempfile.TemporaryDirectory()
+        host, porta = '127.0.0.1', porta_livre()
+        processo = iniciar_servidor(porta, temporario.name, args.workers)
+
+    latencias = defaultdict(list)
+    status_por_rota = defaultdict(lambda: defaultdict(int))
+    lock = threading.Lock()
+
+    def registrar(rota, duracao, status):
+        with lock:
+            latencias[rota].append(duracao)
+            status_por_rota[rota][status] += 1
+
+    # IDs de dispositivo únicos por execução: rodar contra um servidor existente não mistura dados
+    execucao = f"carga-{os.getpid()}-{int(time.time())}"
+    confirmados = defaultdict(list)
+    clientes = max(1, args.clientes_por_dispositivo)
+
+    def rodar(indice, cliente):
+        device_id = f"{execucao}-{indice}"
+        # As operações do dispositivo divididas entre os clientes (o resto fica com os primeiros)
+        operacoes = args.operacoes // clientes + (cliente < args.operacoes % clientes)
+        ids = simular_dispositivo(
+            host, porta, device_id, operacoes, args.semente + indice * clientes + cliente, registrar,
+            cliente_id=f"{device_id}-c{cliente}"
+        )
+        with lock:
+            confirmados[device_id].extend(ids)
+
+    try:
+        threads = [threading.Thread(target=rodar, args=(i, c))
+                   for i in range(args.dispositivos) for c in range(clientes)]
+        inicio = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        duracao = time.perf_counter() - inicio
+
+        print(f"{args.dispositivos} dispositivos ({clientes} clientes cada) x {args.operacoes} operações "
+              f"em {duracao:.2f} s\n")
+        print(f"{'rota':<24} {'req':>6} {'req/s':>8} {'p50':>9} {'p95':>9} {'p99':>9}  status")
+        for rota in MISTURA:
+            tempos = sorted(latencias.get(rota, []))
+            if not tempos:
+                continue
+            status = ' '.join(f"{codigo}:{quantidade}" for codigo, quantidade in sorted(status_por_rota[rota].items()))
+            print(f"{rota:<24} {len(tempos):>6} {len(tempos) / duracao:>8.1f} "
+                  f"{percentil(tempos, 50) * 1000:>7.1f}ms {percentil(tempos, 95) * 1000:>7.1f}ms "
+                  f"{percentil(tempos, 99) * 1000:>7.1f}ms  {status}")
+        total = sum(len(t) for t in latencias.values())
+        print(f"{'total':<24} {total:>6} {total / duracao:>8.1f}")
+
+        problemas = verificar(host, porta, confirmados)
+    finally:
+        if processo is not None:
+            processo.terminate()
+            processo.wait()
+        if temporario is not None:
+            temporario.cleanup()
+
+    escritas = sum(len(ids) for ids in confirmados.values())
+    falhas = sum(quantidade for rota in status_por_rota.values()
+                 for codigo, quantidade in rota.items() if codigo != 200)
+    print(f"\n{escritas} escritas confirmadas, {falhas} requisições com erro")
+    if problemas:
+        print("\nINCONSISTÊNCIAS:", file=sys.stderr)
+        for problema in problemas:
+            print(f"  {problema}", file=sys.stderr)
+        return 1
+    print("IDs gravados conferem com as escritas confirmadas")
+    return 1 if falhas else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,71 @@
+"""Geradores de dados sintéticos para os benchmarks (determinísticos pela semente)"""
+import random
+from datetime import datetime, timedelta
+
+MODELOS = [
+    "Acabei de comprar um {item}, R$ {valor}",
+    "Gastei {valor} reais no {item}",
+    "comprei {item} por {valor}",
+    "gastei {valor} com {item} sem precisar",
+    "{valor} r$ de {item} por impulso",
+    "Paguei o {item} hoje, foram {valor} reais, que besteira",
+    "Hoje fui ao {item} com a família e gastei R$ {valor} no total",
+    "Nada de gastos hoje, só passei no {item}",
+]
+
+ITENS = [
+    'lanche', 'restaurante', 'mercado', 'cinema', 'bar', 'uber', 'jogo na steam',
+    'netflix', 'farmacia', 'show', 'café da padaria', 'cerveja', 'app de delivery',
+    'sapato novo', 'teatro', 'supermercado', 'xbox', 'presente'
+]
+
+# Categoria de cada item e peso aproximado no volume de gastos de um usuário típico
+CATEGORIAS_ITENS = {
+    'alimentacao': (['lanche', 'restaurante', 'mercado', 'supermercado', 'café da padaria', 'app de delivery'], 45),
+    'entretenimento': (['cinema', 'show', 'teatro', 'netflix'], 15),
+    'bebidas': (['bar', 'cerveja'], 10),
+    'jogos': (['jogo na steam', 'xbox'], 5),
+    'outros': (['uber', 'farmacia', 'presente'], 15),
+    'nao_essencial': (['sapato novo', 'app de delivery', 'jogo na steam'], 10),
+}
+
+# Data final fixa: a mesma semente gera sempre os mesmos gastos
+REFERENCIA = datetime(2026, 6, 30, 23, 0, 0)
+
+
+def gerar_mensagens(quantidade, semente=42):
+    """Mensagens sintéticas de chat em português"""
+    aleatorio = random.Random(semente)
+    mensagens = []
+    for _ in range(quantidade):
+        valor = aleatorio.choice([
+            str(aleatorio.randint(1, 500)),
+            f"{aleatorio.randint(1, 500)},{aleatorio.randint(0, 99):02d}"
+        ])
+        modelo = aleatorio.choice(MODELOS)
+        mensagens.append(modelo.format(item=aleatorio.choice(ITENS), valor=valor))
+    return mensagens
+
+
+def gerar_gastos(quantidade, semente=42, meses=24, ate=REFERENCIA):
+    """Gastos no formato gravado pela API, espalhados pelos últimos `meses` meses"""
+    aleatorio = random.Random(semente)
+    categorias = list(CATEGORIAS_ITENS)
+    pesos = [peso for _, peso in CATEGORIAS_ITENS.values()]
+    janela = int(timedelta(days=30 * meses).total_seconds())
+
+    gastos = []
+    for indice, categoria in enumerate(aleatorio.choices(categorias, pesos, k=quantidade), start=1):
+        item = aleatorio.choice(CATEGORIAS_ITENS[categoria][0])
+        valor = round(aleatorio.lognormvariate(3.3, 0.9), 2)
+        eh_impulsivo = categoria == 'nao_essencial' or aleatorio.random() < 0.05
+        data = ate - timedelta(seconds=aleatorio.randrange(janela))
+        gastos.append({
+            "valor": valor,
+            "categoria": categoria,
+            "descricao": aleatorio.choice(MODELOS).format(item=item, valor=f"{valor:.2f}".replace('.', ',')),
+            "eh_impulsivo": eh_impulsivo,
+            "data": data.isoformat(),
+            "id": indice
+        })
+    return gastos
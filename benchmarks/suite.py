@@ -0,0 +1,233 @@
+"""Suíte de microbenchmarks dos caminhos quentes: analisador, agregações e relatório.
+
+Uso:
+    python -m benchmarks.suite [--tamanhos 100,10000,100000] [--casos analisador,relatorio]
+                               [--salvar base.json] [--comparar base.json] [--tolerancia 10]
+
+Cada caso roda com dispositivos sintéticos de N gastos (benchmarks.dados) e
+informa vazão (itens/s), latência por execução (p50/p95/p99) e pico de
+memória alocada (tracemalloc). --salvar grava os resultados como linha de
+base; --comparar mostra a variação em relação a uma base salva e termina com
+código 1 se algum caso ficou mais lento que a tolerância (em %).
+"""
+import argparse
+import gc
+import itertools
+import json
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+
+from benchmarks.dados import gerar_gastos, gerar_mensagens
+from utils.analisador import AnalisadorFinanceiro
+from utils.agregacao import TabelaGastos
+from utils.armazenamento import ArmazenamentoGastos, CATEGORIAS_PADRAO
+from utils.gasto import Gasto
+
+CONFIG = {"renda_mensal": 5000, "meta_economia": 500}
+
+CASOS = {}
+
+
+def caso(nome, maximo=None):
+    """Registra um caso: um context manager que recebe (tamanho, gastos) e
+    entrega (executar, itens processados por execução)"""
+    def registrar(funcao):
+        CASOS[nome] = (contextmanager(funcao), maximo)
+        return funcao
+    return registrar
+
+
+@caso('analisador.mensagem', maximo=100000)
+def caso_mensagem(tamanho, gastos):
+    # Latência por mensagem: cada execução processa a próxima do conjunto
+    analisador = AnalisadorFinanceiro()
+    mensagens = itertools.cycle(gerar_mensagens(tamanho))
+    yield (lambda: analisador.processar_mensagem(next(mensagens))), 1
+
+
+@caso('analisador.padrao')
+def caso_padrao(tamanho, gastos):
+    analisador = AnalisadorFinanceiro()
+    yield (lambda: analisador.analisar_padrao_gastos(gastos)), tamanho
+
+
+@caso('agregacao.resumos')
+def caso_resumos(tamanho, gastos):
+    # Reconstrução dos resumos mensais (mesmo caminho do armazenamento)
+    yield (lambda: TabelaGastos(gastos).resumos_mensais()), tamanho
+
+
+@caso('agregacao.filtro')
+def caso_filtro(tamanho, gastos):
+    # Primeira página de GET /api/gastos?categoria=alimentacao&limit=50
+    from app import filtrar_gastos
+    registros = [Gasto.de_dict(gasto) for gasto in gastos]
+    yield (lambda: filtrar_gastos(registros, categoria='alimentacao', limite=50)), tamanho
+
+
+@caso('armazenamento.carregar')
+def caso_carregar(tamanho, gastos):
+    # Sem cache: mede a leitura e o parse das partições em disco
+    with tempfile.TemporaryDirectory() as diretorio:
+        armazenamento = ArmazenamentoGastos(diretorio)
+        armazenamento.salvar({"gastos": gastos, "categorias": list(CATEGORIAS_PADRAO)}, 'bench')
+        yield (lambda: armazenamento.carregar('bench')), tamanho
+
+
+@caso('armazenamento.carregar_mes')
+def caso_carregar_mes(tamanho, gastos):
+    with tempfile.TemporaryDirectory() as diretorio:
+        armazenamento = ArmazenamentoGastos(diretorio)
+        armazenamento.salvar({"gastos": gastos, "categorias": list(CATEGORIAS_PADRAO)}, 'bench')
+        mes = max(armazenamento.particoes('bench'))
+        yield (lambda: armazenamento.carregar('bench', inicio=mes, fim=mes)), tamanho
+
+
+@caso('relatorio.estatisticas')
+def caso_estatisticas(tamanho, gastos):
+    from utils.relatorio_pdf import GeradorRelatorio
+    gerador = GeradorRelatorio()
+    yield (lambda: gerador.calcular_estatisticas(gastos, CONFIG)), tamanho
+
+
+@caso('relatorio.pdf', maximo=10000)
+def caso_pdf(tamanho, gastos):
+    from utils.relatorio_pdf import GeradorRelatorio
+    gerador = GeradorRelatorio()
+    dados = {"gastos": gastos, "categorias": list(CATEGORIAS_PADRAO)}
+    yield (lambda: gerador.gerar_relatorio_completo(dados, CONFIG)), tamanho
+
+
+@caso('relatorio.pdf_resumo')
+def caso_pdf_resumo(tamanho, gastos):
+    from utils.relatorio_pdf import GeradorRelatorio
+    gerador = GeradorRelatorio()
+    dados = {"gastos": gastos, "categorias": list(CATEGORIAS_PADRAO)}
+    yield (lambda: gerador.gerar_relatorio_completo(dados, CONFIG, incluir_detalhes=False)), tamanho
+
+
+def percentil(ordenados, p):
+    if len(ordenados) == 1:
+        return ordenados[0]
+    return statistics.quantiles(ordenados, n=100, method='inclusive')[p - 1]
+
+
+def medir(executar, itens, tempo_minimo, repeticoes_minimas, repeticoes_maximas):
+    """Executa até somar tempo_minimo segundos; retorna as métricas do caso"""
+    executar()  # aquecimento (caches, imports, regex compiladas)
+
+    gc.collect()
+    duracoes = []
+    total = 0.0
+    while len(duracoes) < repeticoes_maximas and (len(duracoes) < repeticoes_minimas or total < tempo_minimo):
+        inicio = time.perf_counter()
+        executar()
+        duracao = time.perf_counter() - inicio
+        duracoes.append(duracao)
+        total += duracao
+
+    # Memória medida em uma execução à parte: o tracemalloc distorce os tempos
+    gc.collect()
+    tracemalloc.start()
+    executar()
+    _, pico = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    duracoes.sort()
+    media = total / len(duracoes)
+    return {
+        "itens_por_s": itens / media if media else 0,
+        "media_ms": media * 1000,
+        "p50_ms": percentil(duracoes, 50) * 1000,
+        "p95_ms": percentil(duracoes, 95) * 1000,
+        "p99_ms": percentil(duracoes, 99) * 1000,
+        "amostras": len(duracoes),
+        "pico_memoria_kb": pico / 1024
+    }
+
+
+def comparar(resultados, base, tolerancia):
+    """Imprime a variação em relação à base; retorna os casos que pioraram"""
+    regressoes = []
+    print(f"\n{'caso':<36} {'p50 base':>10} {'p50 atual':>10} {'variação':>9} {'memória':>9}")
+    for chave, atual in resultados.items():
+        anterior = base.get(chave)
+        if anterior is None:
+            print(f"{chave:<36} {'-':>10} {atual['p50_ms']:>9.3f}ms {'novo':>9}")
+            continue
+
+        variacao = (atual['p50_ms'] / anterior['p50_ms'] - 1) * 100 if anterior['p50_ms'] else 0
+        memoria = (atual['pico_memoria_kb'] / anterior['pico_memoria_kb'] - 1) * 100 if anterior['pico_memoria_kb'] else 0
+        marca = ' <-' if variacao > tolerancia else ''
+        print(f"{chave:<36} {anterior['p50_ms']:>9.3f}ms {atual['p50_ms']:>9.3f}ms "
+              f"{variacao:>+8.1f}% {memoria:>+8.1f}%{marca}")
+        if variacao > tolerancia:
+            regressoes.append(chave)
+    return regressoes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--tamanhos', default='100,10000,100000',
+                        help="quantidades de gastos por dispositivo, separadas por vírgula (até 1000000)")
+    parser.add_argument('--casos', default='',
+                        help="prefixos dos casos a rodar (ex.: analisador,relatorio); padrão: todos")
+    parser.add_argument('--tempo', type=float, default=1.0, help="segundos mínimos medidos por caso")
+    parser.add_argument('--repeticoes', type=int, default=5, help="execuções mínimas por caso")
+    parser.add_argument('--max-repeticoes', type=int, default=100000)
+    parser.add_argument('--semente', type=int, default=42)
+    parser.add_argument('--salvar', help="grava os resultados como linha de base (JSON)")
+    parser.add_argument('--comparar', help="compara com uma linha de base salva")
+    parser.add_argument('--tolerancia', type=float, default=10.0,
+                        help="piora máxima aceita no p50, em %% (com --comparar)")
+    args = parser.parse_args()
+
+    tamanhos = [int(t) for t in args.tamanhos.split(',') if t]
+    prefixos = tuple(p for p in args.casos.split(',') if p)
+    selecionados = {nome: c for nome, c in CASOS.items() if not prefixos or nome.startswith(prefixos)}
+
+    resultados = {}
+    print(f"{'caso':<36} {'itens/s':>12} {'p50':>10} {'p95':>10} {'p99':>10} {'memória':>10}")
+    for tamanho in tamanhos:
+        gastos = gerar_gastos(tamanho, semente=args.semente)
+        for nome, (contexto, maximo) in selecionados.items():
+            if maximo is not None and tamanho > maximo:
+                continue
+            with contexto(tamanho, gastos) as (executar, itens):
+                metricas = medir(executar, itens, args.tempo, args.repeticoes, args.max_repeticoes)
+            chave = f"{nome}@{tamanho}"
+            resultados[chave] = metricas
+            print(f"{chave:<36} {metricas['itens_por_s']:>12,.0f} {metricas['p50_ms']:>8.3f}ms "
+                  f"{metricas['p95_ms']:>8.3f}ms {metricas['p99_ms']:>8.3f}ms "
+                  f"{metricas['pico_memoria_kb']:>8,.0f}KB")
+        del gastos
+
+    if args.salvar:
+        with open(args.salvar, 'w', encoding='utf-8') as f:
+            json.dump({
+                "criado_em": datetime.now().isoformat(timespec='seconds'),
+                "python": platform.python_version(),
+                "plataforma": platform.platform(),
+                "resultados": resultados
+            }, f, ensure_ascii=False, indent=2)
+        print(f"\nlinha de base salva em {args.salvar}")
+
+    if args.comparar:
+        with open(args.comparar, encoding='utf-8') as f:
+            base = json.load(f)['resultados']
+        regressoes = comparar(resultados, base, args.tolerancia)
+        if regressoes:
+            print(f"\n{len(regressoes)} caso(s) mais lento(s) que a tolerância de {args.tolerancia:.0f}%",
+                  file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
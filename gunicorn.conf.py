@@ -0,0 +1,26 @@
+"""Configuração do gunicorn para servir o WalletCare com vários processos.
+
+Variáveis de ambiente:
+    WALLETCARE_BIND      endereço de escuta (padrão 0.0.0.0:5000)
+    WALLETCARE_WORKERS   processos workers (padrão: número de CPUs)
+    WALLETCARE_THREADS   threads por worker (padrão 4)
+    WALLETCARE_TIMEOUT   segundos até um worker travado ser reiniciado (padrão 120)
+"""
+import multiprocessing
+import os
+
+bind = os.environ.get('WALLETCARE_BIND', '0.0.0.0:5000')
+workers = int(os.environ.get('WALLETCARE_WORKERS', multiprocessing.cpu_count()))
+threads = int(os.environ.get('WALLETCARE_THREADS', 4))
+worker_class = 'gthread'
+timeout = int(os.environ.get('WALLETCARE_TIMEOUT', 120))
+
+# O app (Flask, NumPy, regex do analisador) é importado uma vez no processo
+# mestre e compartilhado com os workers. Nada que não sobreviva ao fork é
+# criado na importação: os arquivos de lock e os pools de processos (PDFs e
+# frota) são abertos sob demanda, já dentro de cada worker. Os pools usam
+# forkserver (ou spawn), não fork: o worker é multithread e um filho criado
+# por fork herdaria locks seguros por outras threads.
+preload_app = True
+
+accesslog = '-'
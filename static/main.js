@@ -9,6 +9,14 @@ class WalletCare {
         this.isRecording = false;
         this.deviceId = this.getOrCreateDeviceId();
         
+        // Cópia local dos dados (versão da última sincronização) e fila de gastos criados offline
+        this.replica = this.lerLocal('replica', { versao: null, gastos: [], config: null });
+        this.fila = this.lerLocal('fila', []);
+        // Gastos da fila recusados pelo servidor (client_id → erro), até o aviso ser mostrado
+        this.recusados = new Map();
+        this.gastos = [...this.replica.gastos, ...this.fila];
+        this.sincronizando = null;
+        
         this.init();
     }
     
@@ -27,6 +35,21 @@ class WalletCare {
     }
     
     async init() {
+        window.addEventListener('online', async () => {
+            if (await this.sincronizar()) {
+                this.loadTabData(this.currentTab);
+            }
+        });
+        
+        if ('serviceWorker' in navigator) {
+            // O service worker responde com a última cópia e avisa quando a revalidação traz dados novos
+            navigator.serviceWorker.addEventListener('message', (event) => {
+                if (event.data && event.data.tipo === 'api-atualizada') {
+                    this.atualizarTela(event.data.url);
+                }
+            });
+        }
+        
         await this.loadConfig();
         
         // Verifica se é o primeiro acesso
@@ -49,6 +72,18 @@ class WalletCare {
         console.log('WalletCare inicializado com sucesso!');
     }
     
+    atualizarTela(url) {
+        // Redesenha só a aba visível que depende da resposta atualizada
+        const caminho = new URL(url).pathname;
+        if (caminho === '/api/dashboard' && this.currentTab === 'dashboard') {
+            this.loadDashboard();
+        } else if (caminho === '/api/gastos' && this.currentTab === 'relatorios') {
+            this.updateReportsTable();
+        } else if (caminho === '/api/investimentos' && this.currentTab === 'investimentos') {
+            this.loadInvestments();
+        }
+    }
+    
     async waitForChart() {
         // Aguarda até 3 segundos para Chart.js carregar
         let attempts = 0;
@@ -64,15 +99,118 @@ class WalletCare {
         }
     }
     
-    // Configuração e dados
-    async loadConfig() {
+    // Sincronização offline
+    lerLocal(nome, padrao) {
+        try {
+            const valor = localStorage.getItem(`walletcare_${nome}_${this.deviceId}`);
+            return valor ? JSON.parse(valor) : padrao;
+        } catch (error) {
+            return padrao;
+        }
+    }
+    
+    gravarLocal(nome, valor) {
+        try {
+            localStorage.setItem(`walletcare_${nome}_${this.deviceId}`, JSON.stringify(valor));
+        } catch (error) {
+            // Sem espaço: sem a cópia local, a próxima sincronização baixa tudo de novo
+            console.warn('Não foi possível salvar os dados locais:', error);
+            localStorage.removeItem(`walletcare_${nome}_${this.deviceId}`);
+        }
+    }
+    
+    novoClientId() {
+        if (window.crypto && crypto.randomUUID) {
+            return crypto.randomUUID();
+        }
+        return Date.now().toString(36) + '-' + Math.random().toString(36).substr(2, 12);
+    }
+    
+    dataLocalISO(data = new Date()) {
+        const dois = (n) => String(n).padStart(2, '0');
+        return `${data.getFullYear()}-${dois(data.getMonth() + 1)}-${dois(data.getDate())}` +
+            `T${dois(data.getHours())}:${dois(data.getMinutes())}:${dois(data.getSeconds())}`;
+    }
+    
+    async sincronizar() {
+        // Uma sincronização por vez: chamadas simultâneas aguardam a mesma
+        if (!this.sincronizando) {
+            this.sincronizando = this.executarSincronizacao().finally(() => {
+                this.sincronizando = null;
+            });
+        }
+        return this.sincronizando;
+    }
+    
+    async executarSincronizacao() {
         try {
-            const response = await fetch(`/api/config?device_id=${this.deviceId}`);
-            this.config = await response.json();
+            await this.enviarFila();
+            
+            // Só o que mudou desde a última versão recebida
+            const params = new URLSearchParams({ device_id: this.deviceId });
+            if (this.replica.versao !== null) {
+                params.set('since', this.replica.versao);
+            }
+            const response = await fetch(`/api/sync?${params}`);
+            if (!response.ok) {
+                throw new Error(`HTTP ${response.status}`);
+            }
+            const delta = await response.json();
+            
+            if (delta.completo) {
+                this.replica.gastos = delta.gastos;
+            } else {
+                const conhecidos = new Set(this.replica.gastos.map(g => g.id));
+                delta.gastos.forEach(gasto => {
+                    if (!conhecidos.has(gasto.id)) {
+                        this.replica.gastos.push(gasto);
+                    }
+                });
+            }
+            if (delta.config) {
+                this.replica.config = delta.config;
+            }
+            this.replica.versao = delta.versao;
+            this.gravarLocal('replica', this.replica);
+            return true;
         } catch (error) {
-            console.error('Erro ao carregar configuração:', error);
-            this.config = { primeiro_acesso: false, tema: 'claro', renda_mensal: 0 };
+            console.warn('Servidor indisponível, usando dados locais:', error);
+            return false;
+        } finally {
+            this.gastos = [...this.replica.gastos, ...this.fila];
+        }
+    }
+    
+    async enviarFila() {
+        if (this.fila.length === 0) return;
+        
+        const response = await fetch('/api/sync', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ device_id: this.deviceId, gastos: this.fila })
+        });
+        if (!response.ok) {
+            throw new Error(`HTTP ${response.status}`);
         }
+        
+        // Sai da fila o que o servidor confirmou (gravado agora ou em um envio anterior)
+        // e o que ele recusou: um item inválido nunca vai ser aceito, os outros seguem
+        const result = await response.json();
+        const confirmados = new Set(result.gastos.map(g => g.client_id));
+        (result.rejeitados || []).forEach((rejeitado) => {
+            console.error('Gasto recusado pelo servidor:', rejeitado);
+            if (rejeitado.client_id) {
+                this.recusados.set(rejeitado.client_id, rejeitado.erro);
+            }
+        });
+        this.fila = this.fila.filter(g => !confirmados.has(g.client_id) && !this.recusados.has(g.client_id));
+        this.gravarLocal('fila', this.fila);
+    }
+    
+    // Configuração e dados
+    async loadConfig() {
+        await this.sincronizar();
+        this.config = this.replica.config || { primeiro_acesso: false, tema: 'claro', renda_mensal: 0 };
     }
     
     async saveConfig(newConfig) {
@@ -86,6 +224,8 @@ class WalletCare {
             const result = await response.json();
             if (result.status === 'success') {
                 this.config = result.config;
+                this.replica.config = result.config;
+                this.gravarLocal('replica', this.replica);
                 this.showToast('Configuração salva com sucesso!', 'success');
                 return true;
             }
@@ -97,36 +237,32 @@ class WalletCare {
     }
     
     async loadGastos() {
-        try {
-            const response = await fetch(`/api/gastos?device_id=${this.deviceId}`);
-            this.gastos = await response.json();
-            return this.gastos;
-        } catch (error) {
-            console.error('Erro ao carregar gastos:', error);
-            return [];
-        }
+        // Baixa só o que mudou; sem conexão, fica com a cópia local
+        await this.sincronizar();
+        return this.gastos;
     }
     
     async saveGasto(gasto) {
-        try {
-            const response = await fetch('/api/gastos', {
-                method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({ ...gasto, device_id: this.deviceId })
-            });
-            
-            const result = await response.json();
-            if (result.status === 'success') {
-                this.gastos.push(result.gasto);
-                this.showToast('Gasto registrado com sucesso!', 'success');
-                await this.loadDashboard();
-                return true;
-            }
-        } catch (error) {
-            console.error('Erro ao salvar gasto:', error);
-            this.showToast('Erro ao salvar gasto', 'error');
+        // Entra na fila com um client_id: reenviar depois de uma falha não duplica o gasto
+        const pendente = { ...gasto, client_id: this.novoClientId(), data: this.dataLocalISO() };
+        this.fila.push(pendente);
+        this.gravarLocal('fila', this.fila);
+        this.gastos.push(pendente);
+        
+        const online = await this.sincronizar();
+        const recusa = this.recusados.get(pendente.client_id);
+        if (recusa !== undefined) {
+            this.recusados.delete(pendente.client_id);
+            this.showToast(`Gasto não registrado: ${recusa}`, 'error');
+            return false;
         }
-        return false;
+        if (online && !this.fila.some(g => g.client_id === pendente.client_id)) {
+            this.showToast('Gasto registrado com sucesso!', 'success');
+            await this.loadDashboard();
+        } else {
+            this.showToast('Sem conexão: o gasto será enviado quando a conexão voltar', 'warning');
+        }
+        return true;
     }
     
     // Event Listeners
@@ -322,12 +458,13 @@ class WalletCare {
         this.showLoading();
         
         try {
-            const response = await fetch('/api/dashboard');
+            // Séries e totais já calculados no servidor, sem a lista de gastos do mês
+            const response = await fetch(`/api/dashboard?device_id=${this.deviceId}&modo=resumido`);
             const data = await response.json();
             
             this.updateDashboardCards(data);
             this.updateCharts(data);
-            this.updateRecentExpenses(data.gastos_mes);
+            this.updateRecentExpenses(data.recentes);
             
         } catch (error) {
             console.error('Erro ao carregar dashboard:', error);
@@ -345,7 +482,7 @@ class WalletCare {
     
     updateCharts(data) {
         this.updateCategoryChart(data.gastos_categoria);
-        this.updateEvolutionChart(data.gastos_mes);
+        this.updateEvolutionChart(data.serie_diaria);
     }
     
     updateCategoryChart(gastos_categoria) {
@@ -434,11 +571,11 @@ class WalletCare {
         }
     }
     
-    updateEvolutionChart(gastos_mes) {
+    updateEvolutionChart(serieDiaria) {
         // Verifica se Chart.js está disponível
         if (typeof Chart === 'undefined') {
             console.error('Chart.js não está carregado');
-            this.createFallbackEvolutionChart(gastos_mes);
+            this.createFallbackEvolutionChart(serieDiaria);
             return;
         }
         const ctx = document.getElementById('graficoEvolucao').getContext('2d');
@@ -448,7 +585,7 @@ class WalletCare {
         }
         
         // Se não há dados, mostra mensagem
-        if (!gastos_mes || gastos_mes.length === 0) {
+        if (!serieDiaria || serieDiaria.length === 0) {
             ctx.clearRect(0, 0, ctx.canvas.width, ctx.canvas.height);
             ctx.font = '16px Arial';
             ctx.fillStyle = '#666';
@@ -457,18 +594,9 @@ class WalletCare {
             return;
         }
         
-        // Agrupa gastos por dia
-        const gastosPorDia = {};
-        gastos_mes.forEach(gasto => {
-            const data = new Date(gasto.data).toLocaleDateString('pt-BR');
-            if (!gastosPorDia[data]) {
-                gastosPorDia[data] = 0;
-            }
-            gastosPorDia[data] += parseFloat(gasto.valor);
-        });
-        
-        const labels = Object.keys(gastosPorDia).sort();
-        const values = labels.map(label => gastosPorDia[label]);
+        // A série chega somada por dia e em ordem cronológica
+        const labels = serieDiaria.map(ponto => this.formatarDia(ponto.dia, true));
+        const values = serieDiaria.map(ponto => ponto.total);
         
         // Define tamanho do canvas
         ctx.canvas.width = 400;
@@ -546,9 +674,8 @@ class WalletCare {
             return;
         }
         
-        const gastosRecentes = gastos.slice(-5).reverse();
-        
-        gastosRecentes.forEach(gasto => {
+        // Já vêm do mais novo para o mais antigo
+        gastos.forEach(gasto => {
             const item = document.createElement('div');
             item.className = 'expense-item';
             
@@ -666,7 +793,7 @@ class WalletCare {
             const response = await fetch('/api/chat', {
                 method: 'POST',
                 headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({ mensagem: message })
+                body: JSON.stringify({ mensagem: message, device_id: this.deviceId })
             });
             
             const result = await response.json();
@@ -703,43 +830,41 @@ class WalletCare {
     // Relatórios
     async loadReports() {
         await this.loadGastos();
-        this.updateReportsTable();
+        await this.updateReportsTable();
         this.updateReportsStats();
     }
     
-    updateReportsTable() {
+    async updateReportsTable() {
         const tbody = document.getElementById('corpoTabelaGastos');
-        tbody.innerHTML = '';
         
-        let gastosFiltrados = [...this.gastos];
+        // Filtros aplicados no servidor (período, categoria e ordenação)
+        const params = new URLSearchParams({ device_id: this.deviceId, ordenar: 'data', ordem: 'desc' });
         
-        // Filtro por mês
         const filtroMes = document.getElementById('filtroMes').value;
         if (filtroMes !== 'todos') {
             const hoje = new Date();
-            const mesAtual = hoje.getMonth();
-            const anoAtual = hoje.getFullYear();
-            
-            gastosFiltrados = gastosFiltrados.filter(gasto => {
-                const dataGasto = new Date(gasto.data);
-                if (filtroMes === 'atual') {
-                    return dataGasto.getMonth() === mesAtual && dataGasto.getFullYear() === anoAtual;
-                } else if (filtroMes === 'anterior') {
-                    const mesAnterior = mesAtual === 0 ? 11 : mesAtual - 1;
-                    const anoAnterior = mesAtual === 0 ? anoAtual - 1 : anoAtual;
-                    return dataGasto.getMonth() === mesAnterior && dataGasto.getFullYear() === anoAnterior;
-                }
-            });
+            const referencia = filtroMes === 'anterior'
+                ? new Date(hoje.getFullYear(), hoje.getMonth() - 1, 1)
+                : hoje;
+            const mes = `${referencia.getFullYear()}-${String(referencia.getMonth() + 1).padStart(2, '0')}`;
+            params.set('inicio', mes);
+            params.set('fim', mes);
         }
         
-        // Filtro por categoria
         const filtroCategoria = document.getElementById('filtroCategoria').value;
         if (filtroCategoria !== 'todas') {
-            gastosFiltrados = gastosFiltrados.filter(gasto => gasto.categoria === filtroCategoria);
+            params.set('categoria', filtroCategoria);
         }
         
-        // Ordena por data (mais recente primeiro)
-        gastosFiltrados.sort((a, b) => new Date(b.data) - new Date(a.data));
+        let gastosFiltrados = [];
+        try {
+            const response = await fetch(`/api/gastos?${params}`);
+            gastosFiltrados = await response.json();
+        } catch (error) {
+            console.error('Erro ao filtrar gastos:', error);
+        }
+        
+        tbody.innerHTML = '';
         
         gastosFiltrados.forEach(gasto => {
             const row = document.createElement('tr');
@@ -790,7 +915,38 @@ class WalletCare {
         this.showLoading();
         
         try {
-            const response = await fetch('/api/relatorio/pdf');
+            // O relatório segue o filtro de mês da tela de relatórios
+            const pedido = { device_id: this.deviceId, periodo: 'tudo' };
+            const filtroMes = document.getElementById('filtroMes').value;
+            if (filtroMes !== 'todos') {
+                const hoje = new Date();
+                const referencia = filtroMes === 'anterior'
+                    ? new Date(hoje.getFullYear(), hoje.getMonth() - 1, 1)
+                    : hoje;
+                pedido.periodo = 'mes';
+                pedido.mes = `${referencia.getFullYear()}-${String(referencia.getMonth() + 1).padStart(2, '0')}`;
+            }
+            
+            // O PDF é gerado em segundo plano: enfileira, acompanha o status e baixa quando ficar pronto
+            const envio = await fetch('/api/relatorio/jobs', {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify(pedido)
+            });
+            let job = await envio.json();
+            if (!envio.ok) throw new Error(job.error);
+            
+            const device = encodeURIComponent(this.deviceId);
+            while (job.status === 'na_fila' || job.status === 'processando') {
+                await new Promise(resolve => setTimeout(resolve, 1000));
+                const status = await fetch(`/api/relatorio/jobs/${job.job_id}?device_id=${device}`);
+                job = await status.json();
+                if (!status.ok) throw new Error(job.error);
+            }
+            if (job.status !== 'concluido') throw new Error(job.erro || 'falha ao gerar relatório');
+            
+            const response = await fetch(`/api/relatorio/jobs/${job.job_id}/pdf?device_id=${device}`);
+            if (!response.ok) throw new Error('falha ao baixar relatório');
             const blob = await response.blob();
             
             const url = window.URL.createObjectURL(blob);
@@ -816,7 +972,7 @@ class WalletCare {
         this.showLoading();
         
         try {
-            const response = await fetch('/api/investimentos');
+            const response = await fetch(`/api/investimentos?device_id=${this.deviceId}`);
             const data = await response.json();
             
             document.getElementById('capacidadeInvestimento').textContent = 
@@ -866,6 +1022,12 @@ class WalletCare {
     }
     
     // Utilitários
+    formatarDia(dia, comAno) {
+        // 'AAAA-MM-DD' → 'DD/MM[/AAAA]' sem passar por Date (que leria a data em UTC)
+        const [ano, mes, diaDoMes] = dia.split('-');
+        return comAno ? `${diaDoMes}/${mes}/${ano}` : `${diaDoMes}/${mes}`;
+    }
+    
     formatCurrency(value) {
         return new Intl.NumberFormat('pt-BR', {
             style: 'currency',
@@ -958,29 +1120,22 @@ class WalletCare {
         container.innerHTML = html;
     }
     
-    createFallbackEvolutionChart(gastos_mes) {
+    createFallbackEvolutionChart(serieDiaria) {
         const container = document.getElementById('graficoEvolucao').parentElement.parentElement;
         
-        if (!gastos_mes || gastos_mes.length === 0) {
+        if (!serieDiaria || serieDiaria.length === 0) {
             container.innerHTML = '<h3>Evolução Diária</h3><p style="text-align: center; padding: 40px; color: #666;">Nenhum gasto registrado ainda</p>';
             return;
         }
         
-        // Agrupa gastos por dia
-        const gastosPorDia = {};
-        gastos_mes.forEach(gasto => {
-            const data = new Date(gasto.data).toLocaleDateString('pt-BR', { day: '2-digit', month: '2-digit' });
-            if (!gastosPorDia[data]) {
-                gastosPorDia[data] = 0;
-            }
-            gastosPorDia[data] += parseFloat(gasto.valor);
-        });
-        
-        const maxValue = Math.max(...Object.values(gastosPorDia));
+        const ultimos = serieDiaria.slice(-7);
+        const maxValue = Math.max(...ultimos.map(ponto => ponto.total));
         
         let html = '<h3>Evolução Diária</h3><div style="padding: 20px;">';
         
-        Object.entries(gastosPorDia).slice(-7).forEach(([data, valor]) => {
+        ultimos.forEach(ponto => {
+            const data = this.formatarDia(ponto.dia, false);
+            const valor = ponto.total;
             const height = (valor / maxValue) * 100;
             
             html += `
@@ -1086,6 +1241,11 @@ class WalletCare {
             const result = await response.json();
             
             if (result.status === 'success') {
+                // O reset reescreve o histórico: a próxima sincronização é completa
+                this.fila = [];
+                this.gravarLocal('fila', this.fila);
+                this.replica = { versao: null, gastos: [], config: this.replica.config };
+                this.gravarLocal('replica', this.replica);
                 this.gastos = [];
                 this.hideModal('modalConfirmReset');
                 document.getElementById('confirmText').value = '';
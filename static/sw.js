@@ -1,5 +1,6 @@
 // Service Worker para WalletCare PWA
-const CACHE_NAME = 'walletcare-v1';
+const CACHE_NAME = 'walletcare-v2';
+const CACHE_API = 'walletcare-api-v1';
 const urlsToCache = [
     '/',
     '/static/style.css',
@@ -11,6 +12,19 @@ const urlsToCache = [
     'https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.0.0/css/all.min.css'
 ];
 
+// Leituras da API servidas da última resposta e revalidadas em segundo plano
+const API_REVALIDADA = ['/api/dashboard', '/api/gastos', '/api/config', '/api/investimentos'];
+
+// Escritas que mudam os dados: as respostas guardadas da API deixam de valer
+const API_ESCRITA = ['/api/gastos', '/api/chat', '/api/chat/batch', '/api/importar',
+                     '/api/config', '/api/reset-gastos', '/api/sync'];
+
+// Revalidações em andamento por URL: vários pedidos iguais disparam uma só
+const revalidando = new Map();
+
+// Muda a cada limpeza: uma revalidação iniciada antes da escrita não regrava dados antigos
+let geracao = 0;
+
 // Instala o Service Worker
 self.addEventListener('install', (event) => {
     event.waitUntil(
@@ -22,8 +36,125 @@ self.addEventListener('install', (event) => {
     );
 });
 
+function versaoDados(response) {
+    const versao = response && response.headers.get('X-Versao-Dados');
+    return versao === null || versao === undefined ? null : Number(versao);
+}
+
+async function limparApi() {
+    geracao += 1;
+    revalidando.clear();
+    await caches.delete(CACHE_API);
+}
+
+// Descarta as respostas guardadas do dispositivo com versão anterior à recebida
+async function descartarVersoesAntigas(cache, url, versao) {
+    const deviceId = url.searchParams.get('device_id');
+    const requests = await cache.keys();
+    await Promise.all(requests.map(async (request) => {
+        if (request.url === url.href || new URL(request.url).searchParams.get('device_id') !== deviceId) {
+            return;
+        }
+        const guardada = await cache.match(request);
+        const anterior = versaoDados(guardada);
+        if (anterior !== null && anterior < versao) {
+            await cache.delete(request);
+        }
+    }));
+}
+
+async function avisarClientes(url) {
+    const clientes = await self.clients.matchAll({ type: 'window' });
+    clientes.forEach((cliente) => cliente.postMessage({ tipo: 'api-atualizada', url }));
+}
+
+// Busca na rede (condicional ao ETag guardado) e atualiza o cache; resolve com a resposta atual
+function revalidar(request, guardada) {
+    const url = new URL(request.url);
+    if (revalidando.has(url.href)) {
+        return revalidando.get(url.href);
+    }
+
+    const headers = new Headers(request.headers);
+    const etag = guardada && guardada.headers.get('ETag');
+    if (etag) {
+        headers.set('If-None-Match', etag);
+    }
+
+    const inicio = geracao;
+    const promessa = fetch(url.href, { headers, cache: 'no-store', credentials: 'same-origin' })
+        .then(async (response) => {
+            if (response.status === 304 && guardada) {
+                return guardada;
+            }
+            if (response.status !== 200 || inicio !== geracao) {
+                return response;
+            }
+
+            const cache = await caches.open(CACHE_API);
+            await cache.put(url.href, response.clone());
+            const versao = versaoDados(response);
+            if (versao !== null) {
+                await descartarVersoesAntigas(cache, url, versao);
+            }
+            // A página mostrou a cópia antiga: avisa para redesenhar com a nova
+            if (guardada) {
+                await avisarClientes(url.href);
+            }
+            return response;
+        })
+        .finally(() => {
+            if (revalidando.get(url.href) === promessa) {
+                revalidando.delete(url.href);
+            }
+        });
+
+    revalidando.set(url.href, promessa);
+    return promessa;
+}
+
+// Stale-while-revalidate: responde com a cópia guardada na hora e revalida em segundo plano
+async function responderApi(event) {
+    const cache = await caches.open(CACHE_API);
+    const guardada = await cache.match(event.request.url);
+    const atual = revalidar(event.request, guardada);
+
+    if (guardada) {
+        // Sem conexão, a cópia guardada continua valendo
+        event.waitUntil(atual.catch(() => undefined));
+        return guardada;
+    }
+    return atual.then((response) => response.clone());
+}
+
+// Repassa a escrita e, se ela deu certo, descarta as leituras guardadas antes de responder
+async function responderEscrita(request) {
+    const response = await fetch(request);
+    if (response.ok) {
+        await limparApi();
+    }
+    return response;
+}
+
 // Intercepta requisições
 self.addEventListener('fetch', (event) => {
+    const url = new URL(event.request.url);
+    const mesmaOrigem = url.origin === self.location.origin;
+
+    if (mesmaOrigem && url.pathname.startsWith('/api/')) {
+        if (event.request.method === 'GET' && API_REVALIDADA.includes(url.pathname)) {
+            event.respondWith(responderApi(event));
+        } else if (event.request.method === 'POST' && API_ESCRITA.includes(url.pathname)) {
+            event.respondWith(responderEscrita(event.request));
+        }
+        // O resto da API (sincronização, relatórios...) vai direto à rede
+        return;
+    }
+
+    if (event.request.method !== 'GET' || (mesmaOrigem && url.pathname === '/metrics')) {
+        return;
+    }
+
     event.respondWith(
         caches.match(event.request)
             .then((response) => {
@@ -31,22 +162,22 @@ self.addEventListener('fetch', (event) => {
                 if (response) {
                     return response;
                 }
-                
+
                 return fetch(event.request).then(
                     (response) => {
                         // Verifica se recebemos uma resposta válida
                         if (!response || response.status !== 200 || response.type !== 'basic') {
                             return response;
                         }
-                        
+
                         // IMPORTANTE: Clone a resposta. Um stream só pode ser usado uma vez
                         const responseToCache = response.clone();
-                        
+
                         caches.open(CACHE_NAME)
                             .then((cache) => {
                                 cache.put(event.request, responseToCache);
                             });
-                        
+
                         return response;
                     }
                 );
@@ -56,8 +187,8 @@ self.addEventListener('fetch', (event) => {
 
 // Atualiza o Service Worker
 self.addEventListener('activate', (event) => {
-    const cacheWhitelist = [CACHE_NAME];
-    
+    const cacheWhitelist = [CACHE_NAME, CACHE_API];
+
     event.waitUntil(
         caches.keys().then((cacheNames) => {
             return Promise.all(
@@ -0,0 +1,176 @@
+"""Agregações de gastos em colunas NumPy.
+
+Os gastos (lista de dicts) são convertidos uma vez em colunas: valores
+float64, datas datetime64[D], categorias codificadas em inteiros e a marca
+de impulsivo. Totais, somas por categoria e séries por mês/dia saem de
+np.bincount sobre os valores em centavos inteiros (exatos em float64), e só
+o resultado é dividido por 100: o total não acumula erro de arredondamento,
+e bate com somar_no_resumo, que soma em centavos do mesmo jeito.
+"""
+import warnings
+from functools import cached_property
+
+import numpy as np
+
+
+class TabelaGastos:
+    """Gastos em formato colunar, prontos para agrupamentos vetorizados"""
+
+    def __init__(self, gastos):
+        # Cada coluna é montada só quando algum cálculo precisa dela
+        self._gastos = gastos
+        self.quantidade = len(gastos)
+
+    @cached_property
+    def valores(self):
+        valores = [g.get('valor', 0) for g in self._gastos]
+        try:
+            return np.array(valores, dtype=np.float64)
+        except (TypeError, ValueError):
+            # Valores em formatos que o NumPy não converte: mesma regra (e erros) de float()
+            return np.array([float(v) for v in valores], dtype=np.float64)
+
+    @cached_property
+    def centavos(self):
+        """Valores em centavos inteiros (como float64, exato até 2**53)"""
+        return np.round(self.valores * 100)
+
+    @cached_property
+    def impulsivos(self):
+        return np.array([bool(g.get('eh_impulsivo', False)) for g in self._gastos], dtype=bool)
+
+    @cached_property
+    def _codificacao(self):
+        nomes = [g.get('categoria', 'outros') for g in self._gastos]
+        # Ordem da primeira aparição: a mesma dos dicts montados pelos laços
+        unicos = list(dict.fromkeys(nomes))
+        codigos = {nome: codigo for codigo, nome in enumerate(unicos)}
+        return unicos, np.fromiter(map(codigos.__getitem__, nomes), dtype=np.intp, count=self.quantidade)
+
+    @property
+    def nomes_categorias(self):
+        return self._codificacao[0]
+
+    @property
+    def categorias(self):
+        """Código (índice em nomes_categorias) da categoria de cada gasto"""
+        return self._codificacao[1]
+
+    @cached_property
+    def datas(self):
+        return self._converter_datas([g.get('data') for g in self._gastos])
+
+    @staticmethod
+    def _converter_datas(datas):
+        """ISO 'AAAA-MM-DD[THH:MM:SS]' → datetime64[D]; ausentes ou inválidas viram NaT"""
+        try:
+            # Caminho rápido: o NumPy interpreta as strings ISO completas de uma vez.
+            # Fuso horário vira aviso (e conversão para UTC): nesse caso vale o prefixo da data
+            with warnings.catch_warnings():
+                warnings.simplefilter('error')
+                return np.array(datas, dtype='datetime64[s]').astype('datetime64[D]')
+        except (ValueError, TypeError, UserWarning, DeprecationWarning):
+            pass
+
+        textos = [d[:10] if isinstance(d, str) else '' for d in datas]
+        try:
+            return np.array(textos, dtype='datetime64[D]')
+        except ValueError:
+            return np.array([TabelaGastos._converter_data(t) for t in textos], dtype='datetime64[D]')
+
+    @staticmethod
+    def _converter_data(texto):
+        try:
+            return np.datetime64(texto, 'D')
+        except ValueError:
+            return np.datetime64('NaT', 'D')
+
+    def __len__(self):
+        return self.quantidade
+
+    def _somar(self, mascara=None):
+        if mascara is None:
+            return float(self.centavos.sum()) / 100
+        if not mascara.any():
+            return 0
+        return float(self.centavos[mascara].sum()) / 100
+
+    def nao_essenciais(self):
+        """Máscara dos gastos impulsivos ou na categoria nao_essencial"""
+        mascara = self.impulsivos.copy()
+        if 'nao_essencial' in self.nomes_categorias:
+            mascara |= self.categorias == self.nomes_categorias.index('nao_essencial')
+        return mascara
+
+    def total(self):
+        return self._somar() if self.quantidade else 0
+
+    def total_impulsivo(self, incluir_nao_essencial=False):
+        """Soma dos gastos marcados como impulsivos (e, opcionalmente, dos nao_essencial)"""
+        return self._somar(self.nao_essenciais() if incluir_nao_essencial else self.impulsivos)
+
+    def por_categoria(self):
+        """{categoria: total}, na ordem em que cada categoria aparece pela primeira vez"""
+        somas = np.bincount(self.categorias, self.centavos, minlength=len(self.nomes_categorias)) / 100
+        return dict(zip(self.nomes_categorias, somas.tolist()))
+
+    def _grupos(self, unidade):
+        """(rótulos, código do grupo por gasto, máscara de gastos com data) para 'M', 'W' ou 'D'"""
+        validas = ~np.isnat(self.datas)
+        if unidade == 'W':
+            # datetime64[W] conta semanas a partir de uma quinta (1970-01-01): a
+            # semana aqui começa na segunda, rotulada pelo dia
+            dias = self.datas[validas]
+            periodos = dias - (dias.astype(np.int64) + 3) % 7
+            unidade = 'D'
+        else:
+            periodos = self.datas[validas].astype(f'datetime64[{unidade}]')
+        unicos, codigos = np.unique(periodos, return_inverse=True)
+        return np.datetime_as_string(unicos, unit=unidade).tolist(), codigos.reshape(-1), validas
+
+    def por_periodo(self, unidade='M'):
+        """{rótulo: total}, em ordem cronológica.
+
+        O rótulo é 'AAAA-MM' na unidade 'M', o dia 'AAAA-MM-DD' na 'D' e, na
+        'W', o dia da segunda-feira da semana.
+        """
+        rotulos, codigos, validas = self._grupos(unidade)
+        somas = np.bincount(codigos, self.centavos[validas], minlength=len(rotulos)) / 100
+        return dict(zip(rotulos, somas.tolist()))
+
+    def resumos_mensais(self):
+        """Mesmo formato de somar_no_resumo: {mes: {total, quantidade, impulsivo, categorias}}"""
+        rotulos, codigos, validas = self._grupos('M')
+        if not rotulos:
+            return {}
+
+        centavos = self.centavos[validas]
+        categorias = self.categorias[validas]
+        nao_essenciais = self.nao_essenciais()[validas]
+        quantidade_grupos = len(rotulos)
+        quantidade_categorias = len(self.nomes_categorias)
+
+        totais = (np.bincount(codigos, centavos, minlength=quantidade_grupos) / 100).tolist()
+        quantidades = np.bincount(codigos, minlength=quantidade_grupos).tolist()
+        impulsivos = (np.bincount(codigos[nao_essenciais], centavos[nao_essenciais], minlength=quantidade_grupos) / 100).tolist()
+        tem_impulsivo = np.bincount(codigos[nao_essenciais], minlength=quantidade_grupos).tolist()
+
+        combinados = codigos * quantidade_categorias + categorias
+        tamanho = quantidade_grupos * quantidade_categorias
+        totais_categoria = (np.bincount(combinados, centavos, minlength=tamanho) / 100).tolist()
+        quantidades_categoria = np.bincount(combinados, minlength=tamanho).tolist()
+
+        resumos = {}
+        for grupo, mes in enumerate(rotulos):
+            base = grupo * quantidade_categorias
+            resumos[mes] = {
+                "total": totais[grupo],
+                "quantidade": quantidades[grupo],
+                "impulsivo": impulsivos[grupo] if tem_impulsivo[grupo] else 0,
+                "categorias": {
+                    nome: {"total": totais_categoria[base + codigo], "quantidade": quantidades_categoria[base + codigo]}
+                    for codigo, nome in enumerate(self.nomes_categorias)
+                    if quantidades_categoria[base + codigo]
+                }
+            }
+        return resumos
@@ -20,51 +20,109 @@ class AnalisadorFinanceiro:
             r'gastei\s+(\d+(?:,\d{2})?)',  # gastei 25
             r'comprei.*?(\d+(?:,\d{2})?)',  # comprei por 25
         ]
+        
+        self.palavras_impulsivas = [
+            'impulso', 'vontade', 'desejo', 'capricho', 'besteira',
+            'desnecessario', 'bobagem', 'sem precisar', 'por impulso'
+        ]
+        
+        self._compilar_padroes()
+    
+    def _compilar_padroes(self):
+        """Pré-compila os padrões de valor e une todas as palavras-chave em uma única regex"""
+        # Valores: compilados uma vez e testados em ordem de prioridade. Uma
+        # alternação única sairia mais lenta, porque o re perde a busca rápida
+        # pelo prefixo literal de cada padrão.
+        self._regex_valor = [re.compile(padrao) for padrao in self.padroes_valor]
+        
+        # Palavras-chave: prioridade da categoria (ordem do dicionário) e se é impulsiva
+        info = {}
+        self._nomes_categorias = list(self.categorias)
+        for prioridade, palavras in enumerate(self.categorias.values()):
+            for palavra in palavras:
+                atual, impulsiva = info.get(palavra, (None, False))
+                info[palavra] = (prioridade if atual is None else min(atual, prioridade), impulsiva)
+        for palavra in self.palavras_impulsivas:
+            atual, _ = info.get(palavra, (None, False))
+            info[palavra] = (atual, True)
+        
+        # A regex devolve só a palavra mais longa que casa em cada posição; as
+        # palavras que são prefixo dela também casam ali, então o resultado de
+        # cada palavra já agrega o de todos os seus prefixos.
+        self._info_palavras = {}
+        for palavra in info:
+            prefixos = [info[outra] for outra in info if palavra.startswith(outra)]
+            prioridades = [p for p, _ in prefixos if p is not None]
+            self._info_palavras[palavra] = (
+                min(prioridades) if prioridades else None,
+                any(impulsiva for _, impulsiva in prefixos)
+            )
+        
+        self._regex_palavras = re.compile(self._regex_de_trie(list(info)))
+    
+    def _regex_de_trie(self, palavras):
+        """Monta uma regex com os prefixos comuns fatorados (casando sempre a palavra mais longa)"""
+        trie = {}
+        for palavra in palavras:
+            no = trie
+            for letra in palavra:
+                no = no.setdefault(letra, {})
+            no[''] = {}
+        
+        def montar(no):
+            termina = '' in no
+            ramos = [re.escape(letra) + montar(filho) for letra, filho in sorted(no.items()) if letra]
+            if not ramos:
+                return ''
+            corpo = ramos[0] if len(ramos) == 1 else '(?:' + '|'.join(ramos) + ')'
+            # Opcional guloso: prefere continuar a palavra, senão aceita a que termina aqui
+            if termina:
+                return '(?:' + corpo + ')?'
+            return corpo
+        
+        return montar(trie)
+    
+    def _analisar_palavras(self, texto):
+        """Uma passada pelo texto (já em minúsculas): retorna (categoria, eh_impulsivo)"""
+        melhor = None
+        impulsivo = False
+        
+        # Como finditer, mas recomeçando logo após o início de cada ocorrência
+        # para não perder palavras sobrepostas ('por impulso' / 'impulso')
+        match = self._regex_palavras.search(texto)
+        while match:
+            prioridade, eh_impulsiva = self._info_palavras[match.group()]
+            impulsivo = impulsivo or eh_impulsiva
+            if prioridade is not None and (melhor is None or prioridade < melhor):
+                melhor = prioridade
+            match = self._regex_palavras.search(texto, match.start() + 1)
+        
+        categoria = self._nomes_categorias[melhor] if melhor is not None else 'outros'
+        return categoria, impulsivo
     
     def extrair_valor(self, texto):
         """Extrai valor monetário do texto"""
         texto = texto.lower()
         
-        for padrao in self.padroes_valor:
-            match = re.search(padrao, texto)
+        for padrao in self._regex_valor:
+            match = padrao.search(texto)
             if match:
-                valor_str = match.group(1)
                 # Converte vírgula para ponto
-                valor_str = valor_str.replace(',', '.')
-                try:
-                    return float(valor_str)
-                except ValueError:
-                    continue
+                return float(match.group(1).replace(',', '.'))
         
         return None
     
     def identificar_categoria(self, texto):
         """Identifica a categoria do gasto baseado no texto"""
-        texto = texto.lower()
-        
-        # Verifica palavras-chave para cada categoria
-        for categoria, palavras in self.categorias.items():
-            for palavra in palavras:
-                if palavra in texto:
-                    return categoria
-        
-        # Se não encontrou categoria específica, retorna 'outros'
-        return 'outros'
+        # Primeira categoria (na ordem de self.categorias) com alguma palavra-chave
+        # no texto; se não encontrar, retorna 'outros'
+        categoria, _ = self._analisar_palavras(texto.lower())
+        return categoria
     
     def detectar_gasto_impulsivo(self, texto):
         """Detecta se o gasto pode ser impulsivo/desnecessário"""
-        texto = texto.lower()
-        
-        palavras_impulsivas = [
-            'impulso', 'vontade', 'desejo', 'capricho', 'besteira',
-            'desnecessario', 'bobagem', 'sem precisar', 'por impulso'
-        ]
-        
-        for palavra in palavras_impulsivas:
-            if palavra in texto:
-                return True
-        
-        return False
+        _, eh_impulsivo = self._analisar_palavras(texto.lower())
+        return eh_impulsivo
     
     def processar_mensagem(self, mensagem):
         """Processa mensagem do chat e extrai informações financeiras"""
@@ -76,8 +134,7 @@ class AnalisadorFinanceiro:
                 "resposta": "Não consegui identificar um valor na sua mensagem. Pode repetir com o valor? Ex: 'Gastei R$ 25 com lanche'"
             }
         
-        categoria = self.identificar_categoria(mensagem)
-        eh_impulsivo = self.detectar_gasto_impulsivo(mensagem)
+        categoria, eh_impulsivo = self._analisar_palavras(mensagem.lower())
         
         # Se detectou como impulsivo, muda categoria
         if eh_impulsivo:
@@ -131,9 +188,11 @@ class AnalisadorFinanceiro:
         if not gastos:
             return {"insights": ["Ainda não há gastos para analisar"]}
         
-        total = sum(float(g.get('valor', 0)) for g in gastos)
-        gastos_impulsivos = [g for g in gastos if g.get('eh_impulsivo', False)]
-        total_impulsivo = sum(float(g.get('valor', 0)) for g in gastos_impulsivos)
+        # NumPy só é importado quando há gastos para agregar (o chat não precisa dele)
+        from utils.agregacao import TabelaGastos
+        tabela = TabelaGastos(gastos)
+        total = tabela.total()
+        total_impulsivo = tabela.total_impulsivo()
         
         insights = []
         
@@ -142,12 +201,7 @@ class AnalisadorFinanceiro:
             insights.append(f"🚨 {percentual:.1f}% dos seus gastos foram impulsivos (R$ {total_impulsivo:.2f})")
         
         # Análise por categoria
-        categorias = {}
-        for gasto in gastos:
-            cat = gasto.get('categoria', 'outros')
-            if cat not in categorias:
-                categorias[cat] = 0
-            categorias[cat] += float(gasto.get('valor', 0))
+        categorias = tabela.por_categoria()
         
         categoria_maior = max(categorias.items(), key=lambda x: x[1])
         insights.append(f"📊 Sua maior categoria de gastos é {categoria_maior[0]} (R$ {categoria_maior[1]:.2f})")
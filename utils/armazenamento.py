@@ -0,0 +1,1093 @@
+import calendar
+import copy
+import errno
+import gzip
+import json
+import os
+import random
+import re
+import tempfile
+import threading
+import time
+import weakref
+from datetime import datetime, timedelta
+
+from utils.cache import assinatura_arquivos
+from utils.gasto import EPOCA, Gasto, para_centavos
+from utils.metricas import registro
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: sem lockf, o lock vale só entre as threads do processo
+    fcntl = None
+
+BYTES_LIDOS = registro.contador('walletcare_armazenamento_bytes_lidos_total',
+                                'Bytes lidos dos arquivos de dados')
+BYTES_ESCRITOS = registro.contador('walletcare_armazenamento_bytes_escritos_total',
+                                   'Bytes gravados nos arquivos de dados')
+
+CATEGORIAS_PADRAO = ["alimentacao", "jogos", "bebidas", "entretenimento", "outros", "nao_essencial"]
+
+_PADRAO_MES = re.compile(r'^\d{4}-\d{2}')
+_PADRAO_DIA = re.compile(r'^\d{4}-\d{2}-\d{2}')
+
+PARTICAO_SEM_DATA = 'sem-data'
+
+# JSON sem espaços: o formato em disco não é pensado para leitura humana
+SEPARADORES_JSON = (',', ':')
+
+# Ordem das colunas no snapshot de uma partição
+CAMPOS_SNAPSHOT = ('id', 'valor', 'categoria', 'descricao', 'eh_impulsivo', 'data', 'client_id')
+
+NIVEL_COMPRESSAO = 6
+
+# Memória de um Gasto decodificado (registro, descrição, client_id e a
+# referência na lista), medida com tracemalloc; o peso no cache não pode vir
+# do tamanho em disco, que com gzip é ~15x menor
+BYTES_POR_GASTO = 330
+
+
+def chave_mes(data):
+    """Retorna 'AAAA-MM' de uma data ISO, ou None se a data for inválida"""
+    if isinstance(data, str) and _PADRAO_MES.match(data):
+        return data[:7]
+    try:
+        return datetime.fromisoformat(data).strftime('%Y-%m')
+    except (TypeError, ValueError):
+        return None
+
+
+def chave_dia(data):
+    """Retorna 'AAAA-MM-DD' de uma data ISO, ou None se a data for inválida"""
+    if isinstance(data, str) and _PADRAO_DIA.match(data):
+        return data[:10]
+    try:
+        return datetime.fromisoformat(data).strftime('%Y-%m-%d')
+    except (TypeError, ValueError):
+        return None
+
+
+def normalizar_periodo(inicio=None, fim=None):
+    """Converte limites (date, datetime, 'AAAA-MM' ou 'AAAA-MM-DD') em dias ISO inclusivos"""
+    def para_texto(valor):
+        if valor is None:
+            return None
+        if hasattr(valor, 'strftime'):
+            return valor.strftime('%Y-%m-%d')
+        return str(valor)
+
+    inicio, fim = para_texto(inicio), para_texto(fim)
+    if inicio is not None and len(inicio) == 7:
+        inicio += '-01'
+    if fim is not None and len(fim) == 7:
+        # Comparação textual: '-31' cobre qualquer dia do mês
+        fim += '-31'
+    return inicio, fim
+
+
+def inicio_do_dia(dia, seguinte=False):
+    """Microssegundos desde a época no início de 'AAAA-MM-DD' (ou do dia seguinte).
+
+    Um dia além do fim do mês (ex.: o '-31' de normalizar_periodo) vale
+    como o primeiro dia do mês seguinte, como na comparação textual.
+    """
+    try:
+        ano, mes, numero = int(dia[:4]), int(dia[5:7]), int(dia[8:10])
+        ultimo = calendar.monthrange(ano, mes)[1]
+        if numero > ultimo:
+            data = datetime(ano, mes, ultimo) + timedelta(days=1)
+        else:
+            data = datetime(ano, mes, numero) + timedelta(days=1 if seguinte else 0)
+    except (ValueError, IndexError, OverflowError):
+        raise ValueError(f"dia inválido: {dia!r}")
+    return (data - EPOCA) // timedelta(microseconds=1)
+
+
+def somar_no_resumo(resumos, gasto):
+    """Acumula um gasto no resumo mensal (por mês e categoria)"""
+    mes = chave_mes(gasto.get('data'))
+    if mes is None:
+        return
+
+    resumo = resumos.setdefault(mes, {"total": 0, "quantidade": 0, "impulsivo": 0, "categorias": {}})
+    categoria = gasto.get('categoria', 'outros')
+    centavos = round(float(gasto.get('valor', 0)) * 100)
+
+    por_categoria = resumo['categorias'].setdefault(categoria, {"total": 0, "quantidade": 0})
+    por_categoria['total'] = somar_centavos(por_categoria['total'], centavos)
+    por_categoria['quantidade'] += 1
+
+    resumo['total'] = somar_centavos(resumo['total'], centavos)
+    resumo['quantidade'] += 1
+    if gasto.get('eh_impulsivo', False) or categoria == 'nao_essencial':
+        resumo['impulsivo'] = somar_centavos(resumo['impulsivo'], centavos)
+
+
+def somar_centavos(total, centavos):
+    """Soma em centavos inteiros: totais não acumulam erro de ponto flutuante"""
+    return (round(total * 100) + centavos) / 100
+
+
+def para_json(dados):
+    """JSON compacto (sem espaços nem escapes de acentos)"""
+    return json.dumps(dados, ensure_ascii=False, separators=SEPARADORES_JSON)
+
+
+def codificar_snapshot(gastos):
+    """Gastos (dicts) → snapshot colunar: os nomes dos campos aparecem uma vez só.
+
+    Cada linha traz os valores na ordem de CAMPOS_SNAPSHOT, com null para
+    campo ausente e sem os nulls do fim. Campos fora da lista (ou com null de
+    verdade) vão em um dict depois da última coluna.
+    """
+    linhas = []
+    for gasto in gastos:
+        linha = [gasto.get(campo) for campo in CAMPOS_SNAPSHOT]
+        extras = {chave: valor for chave, valor in gasto.items()
+                  if chave not in CAMPOS_SNAPSHOT or valor is None}
+        if extras:
+            linha.append(extras)
+        else:
+            while linha and linha[-1] is None:
+                linha.pop()
+        linhas.append(linha)
+    return {"campos": list(CAMPOS_SNAPSHOT), "gastos": linhas}
+
+
+def decodificar_snapshot(conteudo):
+    """Snapshot colunar (ou a lista de dicts dos formatos anteriores) → gastos (dicts)"""
+    if isinstance(conteudo, list):
+        return conteudo
+
+    campos = conteudo['campos']
+    gastos = []
+    for linha in conteudo['gastos']:
+        gasto = {campo: valor for campo, valor in zip(campos, linha) if valor is not None}
+        if len(linha) > len(campos):
+            gasto.update(linha[-1])
+        gastos.append(gasto)
+    return gastos
+
+
+def escrever_json_atomico(caminho, dados, **opcoes_json):
+    """Grava JSON (compacto, por padrão) em um arquivo temporário e o renomeia sobre o destino.
+
+    Leitores concorrentes veem sempre a versão anterior ou a nova completa,
+    nunca um arquivo pela metade.
+    """
+    opcoes_json.setdefault('ensure_ascii', False)
+    opcoes_json.setdefault('separators', SEPARADORES_JSON)
+    escrever_texto_atomico(caminho, json.dumps(dados, **opcoes_json))
+
+
+def escrever_texto_atomico(caminho, texto):
+    """Como escrever_json_atomico, para um texto já pronto (ex.: linhas JSON)"""
+    escrever_bytes_atomico(caminho, texto.encode('utf-8'))
+
+
+def escrever_bytes_atomico(caminho, conteudo):
+    """Como escrever_json_atomico, para um conteúdo binário (ex.: JSON comprimido)"""
+    diretorio = os.path.dirname(caminho) or '.'
+    fd, temporario = tempfile.mkstemp(dir=diretorio, prefix='.tmp-', suffix='.json')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(conteudo)
+            f.flush()
+            os.fsync(f.fileno())
+            BYTES_ESCRITOS.incrementar(os.fstat(f.fileno()).st_size)
+        os.replace(temporario, caminho)
+    except BaseException:
+        if os.path.exists(temporario):
+            os.remove(temporario)
+        raise
+
+
+class BloqueioDispositivo:
+    """Lock reentrante de um dispositivo, válido entre threads e entre processos.
+
+    Um RLock serializa as threads do processo; entre processos (vários
+    workers do servidor WSGI) vale um lock de registro POSIX (lockf) no
+    arquivo .lock do dispositivo, tomado só na aquisição mais externa da
+    thread. Diferente do flock, o lockf pertence ao processo e não passa
+    para processos filhos: um filho nunca segura o lock de um dispositivo
+    depois que o worker o liberou.
+    """
+
+    ARQUIVO = '.lock'
+
+    def __init__(self, diretorio):
+        self.caminho = os.path.join(diretorio, self.ARQUIVO)
+        self._lock = threading.RLock()
+        self._profundidade = 0
+        self._arquivo = None
+
+    def __enter__(self):
+        self._lock.acquire()
+        if self._profundidade == 0 and fcntl is not None:
+            try:
+                os.makedirs(os.path.dirname(self.caminho), exist_ok=True)
+                arquivo = open(self.caminho, 'ab')
+                try:
+                    self._travar(arquivo)
+                except BaseException:
+                    arquivo.close()
+                    raise
+            except BaseException:
+                self._lock.release()
+                raise
+            self._arquivo = arquivo
+        self._profundidade += 1
+        return self
+
+    @staticmethod
+    def _travar(arquivo):
+        espera = 0.001
+        while True:
+            try:
+                fcntl.lockf(arquivo.fileno(), fcntl.LOCK_EX)
+                return
+            except OSError as erro:
+                # O kernel procura ciclos por processo, não por thread: dois workers
+                # com threads esperando dispositivos que o outro segura recebem
+                # EDEADLK sem haver ciclo (uma thread nunca segura dois dispositivos)
+                if erro.errno != errno.EDEADLK:
+                    raise
+            time.sleep(espera * random.uniform(0.5, 1.5))
+            espera = min(espera * 2, 0.05)
+
+    def __exit__(self, *erro):
+        self._profundidade -= 1
+        if self._profundidade == 0 and self._arquivo is not None:
+            fcntl.lockf(self._arquivo.fileno(), fcntl.LOCK_UN)
+            self._arquivo.close()
+            self._arquivo = None
+        self._lock.release()
+
+
+# Um BloqueioDispositivo por arquivo .lock no processo: o lockf pertence ao
+# processo, então duas instâncias para o mesmo arquivo não se excluiriam e o
+# LOCK_UN de uma soltaria o lock que a outra ainda segura
+_bloqueios = weakref.WeakValueDictionary()
+_bloqueios_guarda = threading.Lock()
+
+
+def bloqueio_dispositivo(diretorio):
+    """BloqueioDispositivo do diretório, compartilhado por todos os armazenamentos do processo"""
+    caminho = os.path.abspath(diretorio)
+    with _bloqueios_guarda:
+        bloqueio = _bloqueios.get(caminho)
+        if bloqueio is None:
+            bloqueio = BloqueioDispositivo(caminho)
+            _bloqueios[caminho] = bloqueio
+        return bloqueio
+
+
+class ArmazenamentoGastos:
+    """Gastos de cada dispositivo, particionados por mês.
+
+    Em data_dir/<device_id>: indice.json (partições, categorias, contador de
+    IDs e versão), resumos.json (totais por mês e categoria),
+    alteracoes.jsonl (registro da sincronização), meses/AAAA-MM.json[.gz] e
+    AAAA-MM.jsonl (snapshot colunar e diário de inserções de cada mês) e
+    arquivo/AAAA.json.gz (meses arquivados). Escritas passam por bloqueio().
+    """
+
+    FORMATO = 3
+    ARQUIVO_LEGADO = 'financas.json'
+    ARQUIVO_SNAPSHOT_V1 = 'gastos.json'
+    ARQUIVO_DIARIO_V1 = 'gastos.jsonl'
+    ARQUIVO_INDICE = 'indice.json'
+    ARQUIVO_RESUMOS = 'resumos.json'
+    ARQUIVO_ALTERACOES = 'alteracoes.jsonl'
+    DIRETORIO_PARTICOES = 'meses'
+    DIRETORIO_ARQUIVO = 'arquivo'
+    LIMITE_DIARIO = 500
+    LIMITE_ALTERACOES = 256 * 1024
+
+    def __init__(self, data_dir, cache=None, comprimir_frios=True):
+        self.data_dir = data_dir
+        self.cache = cache
+        self.comprimir_frios = comprimir_frios
+        # Última versão do índice vista por este processo, por dispositivo
+        self._versoes = {}
+
+    def bloqueio(self, device_id):
+        """Lock de escrita do dispositivo (reentrante, entre threads e processos)"""
+        return bloqueio_dispositivo(os.path.join(self.data_dir, device_id))
+
+    # Caminhos e leitura/escrita de arquivos
+
+    def _caminho(self, device_id, nome):
+        return os.path.join(self.data_dir, device_id, nome)
+
+    def _caminhos_particao(self, device_id, mes):
+        base = os.path.join(self.data_dir, device_id, self.DIRETORIO_PARTICOES, mes)
+        return base + '.json', base + '.jsonl'
+
+    def _caminho_comprimido(self, device_id, mes):
+        return os.path.join(self.data_dir, device_id, self.DIRETORIO_PARTICOES, mes + '.json.gz')
+
+    def _caminho_arquivo(self, device_id, ano):
+        return os.path.join(self.data_dir, device_id, self.DIRETORIO_ARQUIVO, ano + '.json.gz')
+
+    def _ler_json(self, caminho):
+        with open(caminho, 'r', encoding='utf-8') as f:
+            BYTES_LIDOS.incrementar(os.fstat(f.fileno()).st_size)
+            return json.load(f)
+
+    def _ler_json_comprimido(self, caminho):
+        with open(caminho, 'rb') as f:
+            conteudo = f.read()
+        BYTES_LIDOS.incrementar(len(conteudo))
+        return json.loads(gzip.decompress(conteudo))
+
+    def _frio(self, mes):
+        """Mês já encerrado: o snapshot dele é gravado comprimido"""
+        return (self.comprimir_frios and mes != PARTICAO_SEM_DATA
+                and mes < datetime.now().strftime('%Y-%m'))
+
+    def _escrever_json(self, caminho, dados):
+        escrever_json_atomico(caminho, dados)
+
+    def _ler_diario(self, caminho):
+        """Lê os registros de um diário, ignorando uma última linha incompleta"""
+        if not os.path.exists(caminho):
+            return []
+
+        registros = []
+        with open(caminho, 'r', encoding='utf-8') as f:
+            BYTES_LIDOS.incrementar(os.fstat(f.fileno()).st_size)
+            for linha in f:
+                linha = linha.strip()
+                if not linha:
+                    continue
+                try:
+                    registros.append(json.loads(linha))
+                except json.JSONDecodeError:
+                    # Escrita interrompida no meio da linha: descarta o registro parcial
+                    break
+        return registros
+
+    def _obter_em_cache(self, chave, caminhos, carregar, tamanho=None):
+        """Lê via cache, validando pela assinatura dos arquivos de origem.
+
+        tamanho(valor) dá o peso da entrada em bytes; sem ele, vale o tamanho dos arquivos.
+        """
+        if self.cache is None:
+            return carregar()
+
+        # A assinatura é tirada antes da leitura: uma escrita concorrente
+        # faz a próxima consulta falhar em vez de servir dados antigos
+        assinatura = assinatura_arquivos(*caminhos)
+        valor = self.cache.obter(chave, assinatura)
+        if valor is None:
+            valor = carregar()
+            peso = tamanho(valor) if tamanho else sum(item[1] for item in assinatura if item)
+            self.cache.guardar(chave, valor, assinatura, peso)
+        return valor
+
+    def _invalidar(self, *chaves):
+        if self.cache is not None:
+            for chave in chaves:
+                self.cache.invalidar(chave)
+
+    # Índice
+
+    def _carregar_indice(self, device_id, copiar=True, do_disco=False):
+        """Índice do dispositivo; do_disco (nas escritas, sob o lock) ignora o cache"""
+        caminho = self._caminho(device_id, self.ARQUIVO_INDICE)
+        if not os.path.exists(caminho):
+            return self._reconstruir_indice(device_id)
+
+        if do_disco:
+            indice = self._ler_json(caminho)
+            self._conferir_versao(device_id, indice)
+        else:
+            indice = self._obter_em_cache((device_id, 'indice'), [caminho], lambda: self._ler_json(caminho))
+            if not copiar:
+                return indice
+            indice = copy.deepcopy(indice)
+
+        if 'proximo_id' not in indice:
+            indice['proximo_id'] = indice['total'] + 1
+        return indice
+
+    def _reconstruir_indice(self, device_id):
+        """Reconstrói o índice a partir das partições em disco"""
+        indice = {"formato": self.FORMATO, "categorias": list(CATEGORIAS_PADRAO),
+                  "total": 0, "proximo_id": 1, "versao": self._proxima_versao(0), "particoes": {}}
+
+        diretorio = os.path.join(self.data_dir, device_id, self.DIRETORIO_PARTICOES)
+        meses = set()
+        if os.path.isdir(diretorio):
+            for nome in os.listdir(diretorio):
+                if not nome.startswith('.'):
+                    meses.add(nome.split('.')[0])
+
+        for mes in sorted(meses):
+            gastos = self._carregar_particao(device_id, mes)
+            _, caminho_diario = self._caminhos_particao(device_id, mes)
+            indice['particoes'][mes] = {
+                "quantidade": len(gastos),
+                "registros_diario": len(self._ler_diario(caminho_diario))
+            }
+            indice['total'] += len(gastos)
+            maior_id = max((g.id for g in gastos if isinstance(g.id, int)), default=0)
+            indice['proximo_id'] = max(indice['proximo_id'], maior_id + 1)
+
+        diretorio_arquivo = os.path.join(self.data_dir, device_id, self.DIRETORIO_ARQUIVO)
+        if os.path.isdir(diretorio_arquivo):
+            indice['arquivados'] = {}
+            for nome in sorted(os.listdir(diretorio_arquivo)):
+                if nome.startswith('.'):
+                    continue
+                for mes, gastos in self._carregar_arquivo(device_id, nome.split('.')[0]).items():
+                    indice['arquivados'][mes] = {"quantidade": len(gastos)}
+                    indice['total'] += len(gastos)
+                    maior_id = max((g.id for g in gastos if isinstance(g.id, int)), default=0)
+                    indice['proximo_id'] = max(indice['proximo_id'], maior_id + 1)
+
+        return indice
+
+    def _conferir_versao(self, device_id, indice):
+        """Descarta o cache do dispositivo se outro processo gravou desde a última escrita daqui"""
+        versao = indice.get('versao', 0)
+        if self._versoes.get(device_id) != versao:
+            meses = indice.get('particoes', {})
+            anos = {mes[:4] for mes in indice.get('arquivados', {})}
+            self._invalidar((device_id, 'indice'), (device_id, 'resumos'),
+                            *((device_id, 'mes', mes) for mes in meses),
+                            *((device_id, 'arquivo', ano) for ano in anos))
+            self._versoes[device_id] = versao
+
+    def _salvar_indice(self, device_id, indice):
+        self._invalidar((device_id, 'indice'))
+        self._escrever_json(self._caminho(device_id, self.ARQUIVO_INDICE), indice)
+        self._versoes[device_id] = indice.get('versao', 0)
+
+    def _proxima_versao(self, atual):
+        return max(atual + 1, time.time_ns() // 1000)
+
+    def versao(self, device_id):
+        """Versão atual dos gastos do dispositivo (cresce a cada escrita; vem do relógio, nunca volta atrás)"""
+        return self._carregar_indice(device_id, copiar=False).get('versao', 0)
+
+    def _maior_id(self, gastos):
+        ids = [g['id'] for g in gastos if isinstance(g.get('id'), int)]
+        return max(ids, default=0)
+
+    def particoes(self, device_id):
+        """Meses ('AAAA-MM') com gastos registrados (vivos ou arquivados), em ordem cronológica"""
+        indice = self._carregar_indice(device_id, copiar=False)
+        return sorted(set(indice['particoes']) | set(indice.get('arquivados', {})))
+
+    # Inicialização e migração
+
+    def _formato_antigo(self, device_id):
+        return (os.path.exists(self._caminho(device_id, self.ARQUIVO_LEGADO))
+                or os.path.exists(self._caminho(device_id, self.ARQUIVO_SNAPSHOT_V1)))
+
+    def _inicializado(self, device_id):
+        return (os.path.exists(self._caminho(device_id, self.ARQUIVO_INDICE))
+                and not self._formato_antigo(device_id))
+
+    def inicializar(self, device_id):
+        """Cria os arquivos do dispositivo, migrando formatos antigos se existirem"""
+        if self._inicializado(device_id):
+            return
+
+        with self.bloqueio(device_id):
+            # Outra thread pode ter inicializado enquanto esperávamos o lock
+            if self._inicializado(device_id):
+                return
+
+            os.makedirs(os.path.join(self.data_dir, device_id), exist_ok=True)
+
+            if self._formato_antigo(device_id):
+                self.migrar(device_id)
+            else:
+                self.salvar({"gastos": [], "categorias": list(CATEGORIAS_PADRAO)}, device_id)
+
+    def migrar(self, device_id):
+        """Divide os dados antigos (financas.json ou gastos.json + diário) em partições mensais.
+
+        Os arquivos antigos só são removidos depois que partições e índice
+        foram gravados; uma migração interrompida é refeita do início.
+        """
+        with self.bloqueio(device_id):
+            legado = self._caminho(device_id, self.ARQUIVO_LEGADO)
+            snapshot_v1 = self._caminho(device_id, self.ARQUIVO_SNAPSHOT_V1)
+            diario_v1 = self._caminho(device_id, self.ARQUIVO_DIARIO_V1)
+
+            if os.path.exists(legado):
+                dados = self._ler_json(legado)
+            else:
+                dados = self._ler_json(snapshot_v1)
+                for registro in self._ler_diario(diario_v1):
+                    if registro.get('op') == 'adicionar':
+                        dados['gastos'].append(registro['gasto'])
+
+            dados.setdefault("gastos", [])
+            dados.setdefault("categorias", list(CATEGORIAS_PADRAO))
+
+            self.salvar(dados, device_id)
+
+            for caminho in (legado, snapshot_v1, diario_v1):
+                if os.path.exists(caminho):
+                    os.remove(caminho)
+
+    def precisa_migrar(self, device_id):
+        """O dispositivo ainda está em um formato antigo (financas.json ou gastos.json)"""
+        return self._formato_antigo(device_id)
+
+    def dispositivos(self):
+        """IDs dos dispositivos em data_dir (diretórios que começam com '.', como .relatorios, ficam de fora)"""
+        if not os.path.isdir(self.data_dir):
+            return []
+        return sorted(nome for nome in os.listdir(self.data_dir)
+                      if not nome.startswith('.') and os.path.isdir(os.path.join(self.data_dir, nome)))
+
+    def migrar_todos(self):
+        """Migra todos os dispositivos que ainda estão em formatos antigos"""
+        migrados = 0
+        for device_id in self.dispositivos():
+            if self._formato_antigo(device_id):
+                self.inicializar(device_id)
+                migrados += 1
+        return migrados
+
+    # Partições
+
+    def _carregar_particao(self, device_id, mes):
+        caminho_snapshot, caminho_diario = self._caminhos_particao(device_id, mes)
+        caminho_comprimido = self._caminho_comprimido(device_id, mes)
+
+        def ler():
+            # Em memória (e no cache) cada gasto é um registro compacto, não um dict
+            if os.path.exists(caminho_comprimido):
+                gastos = decodificar_snapshot(self._ler_json_comprimido(caminho_comprimido))
+            elif os.path.exists(caminho_snapshot):
+                gastos = decodificar_snapshot(self._ler_json(caminho_snapshot))
+            else:
+                gastos = []
+            # Uma compactação interrompida depois de gravar o snapshot e antes de
+            # remover o diário deixa os dois: registros já no snapshot são pulados
+            no_snapshot = {gasto.get('id') for gasto in gastos} - {None}
+            for registro in self._ler_diario(caminho_diario):
+                if registro.get('op') == 'adicionar' and registro['gasto'].get('id') not in no_snapshot:
+                    gastos.append(registro['gasto'])
+            return [Gasto.de_dict(gasto) for gasto in gastos]
+
+        return self._obter_em_cache((device_id, 'mes', mes),
+                                    [caminho_snapshot, caminho_comprimido, caminho_diario], ler,
+                                    tamanho=lambda gastos: len(gastos) * BYTES_POR_GASTO)
+
+    def _gravar_particao(self, device_id, mes, gastos):
+        """Reescreve o snapshot de uma partição (comprimido, se o mês já passou) e remove o diário dela"""
+        self._invalidar((device_id, 'mes', mes))
+        caminho_snapshot, caminho_diario = self._caminhos_particao(device_id, mes)
+        caminho_comprimido = self._caminho_comprimido(device_id, mes)
+        conteudo = para_json(codificar_snapshot(gastos)).encode('utf-8')
+
+        if self._frio(mes):
+            # mtime=0: o mesmo conteúdo sempre gera os mesmos bytes
+            escrever_bytes_atomico(caminho_comprimido, gzip.compress(conteudo, NIVEL_COMPRESSAO, mtime=0))
+            obsoleto = caminho_snapshot
+        else:
+            escrever_bytes_atomico(caminho_snapshot, conteudo)
+            obsoleto = caminho_comprimido
+        # O snapshot novo já está no lugar: o outro (e o diário) sobraria duplicado
+        for caminho in (obsoleto, caminho_diario):
+            if os.path.exists(caminho):
+                os.remove(caminho)
+
+    def _registros_do_mes(self, device_id, indice, mes):
+        """Gastos de um mês: os do arquivo anual (se o mês foi arquivado) mais os da partição viva.
+
+        Um gasto novo em mês arquivado recria a partição viva, que fica até o próximo arquivar().
+        """
+        if mes not in indice.get('arquivados', {}):
+            return self._carregar_particao(device_id, mes) if mes in indice['particoes'] else []
+        registros = list(self._carregar_arquivo(device_id, mes[:4]).get(mes, []))
+        if mes in indice['particoes']:
+            registros.extend(self._carregar_particao(device_id, mes))
+        return registros
+
+    def _remover_particao(self, device_id, mes):
+        self._invalidar((device_id, 'mes', mes))
+        for caminho in (*self._caminhos_particao(device_id, mes), self._caminho_comprimido(device_id, mes)):
+            if os.path.exists(caminho):
+                os.remove(caminho)
+
+    # Arquivo: meses antigos fora do conjunto vivo, um arquivo comprimido por ano
+
+    def _carregar_arquivo(self, device_id, ano):
+        """Gastos arquivados de um ano: {'AAAA-MM': [Gasto]}"""
+        caminho = self._caminho_arquivo(device_id, ano)
+
+        def ler():
+            if not os.path.exists(caminho):
+                return {}
+            meses = self._ler_json_comprimido(caminho)['meses']
+            return {mes: [Gasto.de_dict(gasto) for gasto in decodificar_snapshot(conteudo)]
+                    for mes, conteudo in meses.items()}
+
+        return self._obter_em_cache(
+            (device_id, 'arquivo', ano), [caminho], ler,
+            tamanho=lambda meses: sum(len(gastos) for gastos in meses.values()) * BYTES_POR_GASTO
+        )
+
+    def _gravar_arquivo(self, device_id, ano, por_mes):
+        """Reescreve o arquivo de um ano a partir de {'AAAA-MM': [dict]}"""
+        self._invalidar((device_id, 'arquivo', ano))
+        caminho = self._caminho_arquivo(device_id, ano)
+        os.makedirs(os.path.dirname(caminho), exist_ok=True)
+        conteudo = para_json({"meses": {mes: codificar_snapshot(por_mes[mes]) for mes in sorted(por_mes)}})
+        escrever_bytes_atomico(caminho, gzip.compress(conteudo.encode('utf-8'), NIVEL_COMPRESSAO, mtime=0))
+
+    def _remover_arquivos(self, device_id):
+        diretorio = os.path.join(self.data_dir, device_id, self.DIRETORIO_ARQUIVO)
+        if not os.path.isdir(diretorio):
+            return
+        for nome in os.listdir(diretorio):
+            if not nome.startswith('.'):
+                self._invalidar((device_id, 'arquivo', nome.split('.')[0]))
+                os.remove(os.path.join(diretorio, nome))
+
+    # API pública
+
+    def carregar_registros(self, device_id, inicio=None, fim=None):
+        """Gastos do dispositivo como registros Gasto, opcionalmente só de um período.
+
+        inicio/fim são inclusivos e aceitam date, datetime, 'AAAA-MM' ou
+        'AAAA-MM-DD'. Só as partições dos meses do período são lidas. Os
+        registros são compartilhados com o cache e não devem ser alterados.
+        """
+        indice = self._carregar_indice(device_id, copiar=False)
+        inicio, fim = normalizar_periodo(inicio, fim)
+        filtrar = inicio is not None or fim is not None
+
+        # Limites em microssegundos: [início do primeiro dia, início do dia seguinte ao último)
+        try:
+            limite_inicio = inicio_do_dia(inicio) if inicio else None
+            limite_fim = inicio_do_dia(fim, seguinte=True) if fim else None
+            por_timestamp = True
+        except ValueError:
+            por_timestamp = False
+
+        gastos = []
+        for mes in sorted(set(indice['particoes']) | set(indice.get('arquivados', {}))):
+            if filtrar:
+                if mes == PARTICAO_SEM_DATA:
+                    continue
+                if (inicio is not None and mes < inicio[:7]) or (fim is not None and mes > fim[:7]):
+                    continue
+
+            # Um mês arquivado só é lido (do arquivo do ano) quando o período o inclui
+            particao = self._registros_do_mes(device_id, indice, mes)
+            if not filtrar:
+                gastos.extend(particao)
+                continue
+
+            for gasto in particao:
+                if por_timestamp and gasto.timestamp is not None:
+                    if (limite_inicio is None or gasto.timestamp >= limite_inicio) and \
+                            (limite_fim is None or gasto.timestamp < limite_fim):
+                        gastos.append(gasto)
+                    continue
+                dia = chave_dia(gasto.data) or mes + '-01'
+                if (inicio is None or dia >= inicio) and (fim is None or dia <= fim):
+                    gastos.append(gasto)
+
+        return gastos
+
+    def carregar(self, device_id, inicio=None, fim=None):
+        """Carrega os gastos do dispositivo (como dicts), opcionalmente só de um período"""
+        gastos = [gasto.para_dict() for gasto in self.carregar_registros(device_id, inicio, fim)]
+        categorias = self._carregar_indice(device_id, copiar=False).get('categorias', CATEGORIAS_PADRAO)
+        # Dicts novos a cada chamada: quem chama pode alterá-los sem afetar o cache
+        return {"gastos": gastos, "categorias": list(categorias)}
+
+    def salvar(self, dados, device_id):
+        """Reescreve todas as partições do dispositivo a partir de dados['gastos']"""
+        with self.bloqueio(device_id):
+            os.makedirs(os.path.join(self.data_dir, device_id, self.DIRETORIO_PARTICOES), exist_ok=True)
+
+            # O contador de IDs sobrevive a resets para nunca repetir um ID
+            proximo_id = self._maior_id(dados['gastos']) + 1
+            versao = 0
+            particoes_antigas = []
+            if os.path.exists(self._caminho(device_id, self.ARQUIVO_INDICE)):
+                indice_antigo = self._carregar_indice(device_id, do_disco=True)
+                proximo_id = max(proximo_id, indice_antigo['proximo_id'])
+                versao = indice_antigo.get('versao', 0)
+                particoes_antigas = list(indice_antigo.get('particoes', {}))
+
+            # O registro é reiniciado antes da reescrita: se ela for interrompida,
+            # o horizonte já é mais novo que qualquer cliente e todos recebem tudo
+            versao = self._proxima_versao(versao)
+            self._reiniciar_alteracoes(device_id, versao)
+
+            por_mes = {}
+            for gasto in dados['gastos']:
+                por_mes.setdefault(chave_mes(gasto.get('data')) or PARTICAO_SEM_DATA, []).append(gasto)
+
+            for mes, gastos in por_mes.items():
+                self._gravar_particao(device_id, mes, gastos)
+
+            indice = {
+                "formato": self.FORMATO,
+                "categorias": dados.get('categorias', list(CATEGORIAS_PADRAO)),
+                "total": len(dados['gastos']),
+                "proximo_id": proximo_id,
+                "versao": versao,
+                "particoes": {
+                    mes: {"quantidade": len(gastos), "registros_diario": 0}
+                    for mes, gastos in por_mes.items()
+                }
+            }
+            self._salvar_indice(device_id, indice)
+
+            for mes in particoes_antigas:
+                if mes not in por_mes:
+                    self._remover_particao(device_id, mes)
+            # Os gastos arquivados vieram em dados['gastos'] e agora estão nas partições
+            self._remover_arquivos(device_id)
+
+            self._salvar_resumos(device_id, self._calcular_resumos(dados['gastos']))
+
+    def adicionar_gastos(self, gastos, device_id):
+        """Anexa novos gastos ao diário do mês de cada um, atribuindo IDs do contador persistente.
+
+        Um gasto cujo client_id já foi gravado não é gravado de novo: o dict
+        recebe o conteúdo do gasto existente. Retorna só os gastos novos. Um
+        diário que passa de LIMITE_DIARIO registros é compactado no snapshot.
+        """
+        with self.bloqueio(device_id):
+            indice = self._carregar_indice(device_id, do_disco=True)
+
+            linhas_por_mes = {}
+            novos = []
+            por_client_id = {}
+            for gasto in gastos:
+                mes = chave_mes(gasto.get('data')) or PARTICAO_SEM_DATA
+                client_id = gasto.get('client_id')
+                if client_id is not None:
+                    repetido = por_client_id.get(client_id) or self._gasto_do_cliente(device_id, indice, mes, client_id)
+                    if repetido is not None:
+                        gasto.clear()
+                        gasto.update(repetido)
+                        continue
+
+                # Valor em centavos desde a gravação: o que volta na leitura é o que foi confirmado
+                centavos = para_centavos(gasto.get('valor'))
+                if centavos is not None:
+                    gasto['valor'] = centavos / 100
+                gasto['id'] = indice['proximo_id']
+                indice['proximo_id'] += 1
+                linhas_por_mes.setdefault(mes, []).append(para_json({"op": "adicionar", "gasto": gasto}) + '\n')
+                novos.append(gasto)
+                if client_id is not None:
+                    por_client_id[client_id] = dict(gasto)
+
+            if not novos:
+                return novos
+
+            versao_anterior = indice.get('versao', 0)
+            indice['total'] += len(novos)
+            indice['versao'] = self._proxima_versao(versao_anterior)
+            for mes, linhas in linhas_por_mes.items():
+                particao = indice['particoes'].setdefault(mes, {"quantidade": 0, "registros_diario": 0})
+                particao['quantidade'] += len(linhas)
+                particao['registros_diario'] += len(linhas)
+
+            # Lido antes do anexo: se precisar ser reconstruído, não conta os novos gastos
+            resumos = self.carregar_resumos(device_id)
+            # Somados antes da primeira escrita: um valor inválido falha sem deixar nada gravado
+            for gasto in novos:
+                somar_no_resumo(resumos, gasto)
+
+            # O registro de alterações vem antes dos dados: uma queda no meio
+            # deixa no máximo IDs anotados que não existem, nunca um gasto
+            # gravado que a sincronização não enxerga
+            self._anexar_alteracao(device_id, versao_anterior, {
+                "versao": indice['versao'], "op": "adicionar",
+                "ids": [gasto['id'] for gasto in novos], "meses": sorted(linhas_por_mes)
+            })
+
+            # Reserva os IDs antes de anexar: uma queda no meio deixa no
+            # máximo um buraco na sequência, nunca um ID repetido
+            self._salvar_indice(device_id, indice)
+
+            for mes, linhas in linhas_por_mes.items():
+                self._invalidar((device_id, 'mes', mes))
+                _, caminho_diario = self._caminhos_particao(device_id, mes)
+                conteudo = ''.join(linhas).encode('utf-8')
+                with open(caminho_diario, 'ab') as f:
+                    f.write(conteudo)
+                    f.flush()
+                    os.fsync(f.fileno())
+                BYTES_ESCRITOS.incrementar(len(conteudo))
+
+            self._salvar_resumos(device_id, resumos)
+
+            for mes in linhas_por_mes:
+                if indice['particoes'][mes]['registros_diario'] >= self.LIMITE_DIARIO:
+                    self.compactar(device_id, mes)
+
+            return novos
+
+    def _gasto_do_cliente(self, device_id, indice, mes, client_id):
+        """Gasto já gravado com esse client_id no mês (como dict), ou None.
+
+        Um reenvio traz a mesma data do envio original, então basta olhar a
+        partição do mês dele.
+        """
+        for gasto in self._registros_do_mes(device_id, indice, mes):
+            if gasto.client_id == client_id:
+                return gasto.para_dict()
+        return None
+
+    def compactar(self, device_id, mes=None):
+        """Incorpora o diário ao snapshot de uma partição (ou de todas).
+
+        Compactar todas também regrava índice e resumos no formato atual.
+        """
+        with self.bloqueio(device_id):
+            indice = self._carregar_indice(device_id, do_disco=True)
+            meses = [mes] if mes is not None else list(indice['particoes'])
+
+            for mes in meses:
+                gastos = self._carregar_particao(device_id, mes)
+                self._gravar_particao(device_id, mes, [gasto.para_dict() for gasto in gastos])
+                indice['particoes'][mes] = {"quantidade": len(gastos), "registros_diario": 0}
+
+            if len(meses) == len(indice['particoes']):
+                indice['formato'] = self.FORMATO
+                self._salvar_resumos(device_id, self.carregar_resumos(device_id))
+            self._salvar_indice(device_id, indice)
+
+    def arquivar(self, device_id, meses_quentes):
+        """Tira do conjunto vivo os meses anteriores aos `meses_quentes` mais recentes (contando o atual).
+
+        Os gastos desses meses vão para o arquivo do ano deles e o mês passa
+        de particoes para arquivados no índice; resumos e versão não mudam,
+        porque os gastos são os mesmos. Retorna os meses arquivados.
+        """
+        if meses_quentes < 1:
+            raise ValueError("meses_quentes precisa ser pelo menos 1")
+
+        hoje = datetime.now()
+        ano, mes = divmod(hoje.year * 12 + hoje.month - 1 - (meses_quentes - 1), 12)
+        primeiro_quente = f'{ano:04d}-{mes + 1:02d}'
+
+        with self.bloqueio(device_id):
+            indice = self._carregar_indice(device_id, do_disco=True)
+            arquivados = indice.setdefault('arquivados', {})
+            # Cópias vivas que sobraram de um arquivamento interrompido
+            for mes in set(arquivados) - set(indice['particoes']):
+                self._remover_particao(device_id, mes)
+
+            meses = sorted(mes for mes in indice['particoes']
+                           if mes != PARTICAO_SEM_DATA and mes < primeiro_quente)
+            if not meses:
+                return []
+
+            por_ano = {}
+            for mes in meses:
+                por_ano.setdefault(mes[:4], []).append(mes)
+
+            # Arquivo antes do índice, índice antes de remover as partições: uma
+            # queda no meio deixa no máximo uma cópia sobrando, nunca um gasto perdido
+            for ano, meses_do_ano in por_ano.items():
+                # Só os meses que o índice dá como arquivados valem no arquivo existente
+                conteudo = {mes: [gasto.para_dict() for gasto in gastos]
+                            for mes, gastos in self._carregar_arquivo(device_id, ano).items()
+                            if mes in arquivados}
+                for mes in meses_do_ano:
+                    conteudo.setdefault(mes, []).extend(
+                        gasto.para_dict() for gasto in self._carregar_particao(device_id, mes))
+                self._gravar_arquivo(device_id, ano, conteudo)
+                for mes in meses_do_ano:
+                    arquivados[mes] = {"quantidade": len(conteudo[mes])}
+                    del indice['particoes'][mes]
+
+            self._salvar_indice(device_id, indice)
+            for mes in meses:
+                self._remover_particao(device_id, mes)
+            return meses
+
+    def verificar(self, device_id):
+        """Confere partições, índice e resumos do dispositivo; retorna a lista de problemas"""
+        problemas = []
+        with self.bloqueio(device_id):
+            indice = self._carregar_indice(device_id, do_disco=True)
+            particoes = indice.get('particoes', {})
+            arquivados = indice.get('arquivados', {})
+
+            diretorio = os.path.join(self.data_dir, device_id, self.DIRETORIO_PARTICOES)
+            em_disco = set()
+            if os.path.isdir(diretorio):
+                em_disco = {nome.split('.')[0] for nome in os.listdir(diretorio) if not nome.startswith('.')}
+            for mes in sorted(em_disco - set(particoes)):
+                problemas.append(f"partição {mes} fora do índice")
+
+            gastos = []
+            for mes in sorted(particoes):
+                try:
+                    registros = self._carregar_particao(device_id, mes)
+                except (OSError, ValueError, KeyError, TypeError) as erro:
+                    problemas.append(f"partição {mes} ilegível: {erro}")
+                    continue
+                if len(registros) != particoes[mes]['quantidade']:
+                    problemas.append(f"partição {mes}: {len(registros)} gastos, o índice diz "
+                                     f"{particoes[mes]['quantidade']}")
+                gastos.extend(registros)
+
+            for ano in sorted({mes[:4] for mes in arquivados}):
+                try:
+                    do_ano = self._carregar_arquivo(device_id, ano)
+                except (OSError, ValueError, KeyError, TypeError) as erro:
+                    problemas.append(f"arquivo {ano} ilegível: {erro}")
+                    continue
+                for mes in sorted(mes for mes in arquivados if mes[:4] == ano):
+                    registros = do_ano.get(mes, [])
+                    if len(registros) != arquivados[mes]['quantidade']:
+                        problemas.append(f"mês arquivado {mes}: {len(registros)} gastos, o índice diz "
+                                         f"{arquivados[mes]['quantidade']}")
+                    gastos.extend(registros)
+
+            ids = [gasto.id for gasto in gastos if gasto.id is not None]
+            if len(ids) != len(set(ids)):
+                problemas.append("IDs repetidos")
+            if any(isinstance(id_, int) and id_ >= indice['proximo_id'] for id_ in ids):
+                problemas.append("IDs acima do contador do índice")
+            if len(gastos) != indice.get('total'):
+                problemas.append(f"{len(gastos)} gastos, o índice diz {indice.get('total')}")
+
+            try:
+                recalculados = self._calcular_resumos([g.para_dict() for g in gastos])
+            except (ValueError, TypeError) as erro:
+                problemas.append(f"gastos com valor inválido: {erro}")
+            else:
+                if self.carregar_resumos(device_id) != recalculados:
+                    problemas.append("resumos mensais não batem com os gastos")
+        return problemas
+
+    # Registro de alterações e sincronização
+
+    def _ler_alteracoes(self, device_id):
+        """(horizonte, entradas) do registro; horizonte None se não houver registro"""
+        entradas = self._ler_diario(self._caminho(device_id, self.ARQUIVO_ALTERACOES))
+        if not entradas or entradas[0].get('op') != 'inicio':
+            return None, []
+        return entradas[0]['versao'], entradas[1:]
+
+    def _escrever_alteracoes(self, device_id, horizonte, entradas=()):
+        linhas = [{"op": "inicio", "versao": horizonte}, *entradas]
+        escrever_texto_atomico(self._caminho(device_id, self.ARQUIVO_ALTERACOES),
+                               ''.join(para_json(linha) + '\n' for linha in linhas))
+
+    def _reiniciar_alteracoes(self, device_id, versao):
+        self._escrever_alteracoes(device_id, versao)
+
+    def _anexar_alteracao(self, device_id, versao_anterior, alteracao):
+        caminho = self._caminho(device_id, self.ARQUIVO_ALTERACOES)
+        if not os.path.exists(caminho):
+            # Registro começando agora (dados antigos): vale a partir da versão anterior
+            self._reiniciar_alteracoes(device_id, versao_anterior)
+
+        conteudo = (para_json(alteracao) + '\n').encode('utf-8')
+        with open(caminho, 'ab') as f:
+            f.write(conteudo)
+            f.flush()
+            os.fsync(f.fileno())
+            tamanho = f.tell()
+        BYTES_ESCRITOS.incrementar(len(conteudo))
+
+        if tamanho > self.LIMITE_ALTERACOES:
+            # Descarta a metade mais antiga; o horizonte passa a ser a última versão descartada
+            _, entradas = self._ler_alteracoes(device_id)
+            metade = len(entradas) // 2
+            if metade:
+                self._escrever_alteracoes(device_id, entradas[metade - 1]['versao'], entradas[metade:])
+
+    def registrar_alteracao(self, device_id, op):
+        """Avança a versão por uma alteração fora dos gastos (ex.: 'config'), para a sincronização"""
+        with self.bloqueio(device_id):
+            indice = self._carregar_indice(device_id, do_disco=True)
+            versao_anterior = indice.get('versao', 0)
+            indice['versao'] = self._proxima_versao(versao_anterior)
+            self._anexar_alteracao(device_id, versao_anterior, {"versao": indice['versao'], "op": op})
+            self._salvar_indice(device_id, indice)
+
+    def alteracoes_desde(self, device_id, desde=None):
+        """O que mudou desde a versão `desde` (a devolvida pela última sincronização).
+
+        Retorna {versao, completo, gastos, operacoes}. Sem `desde`, com
+        `desde` anterior ao horizonte do registro (ou de outro histórico) ou
+        depois de uma reescrita, completo é True e gastos traz todos os
+        gastos; senão traz só os adicionados depois de `desde`. operacoes
+        lista as outras alterações do período (ex.: 'config').
+        """
+        # Sob o lock: o registro e os dados que ele descreve são lidos juntos
+        with self.bloqueio(device_id):
+            indice = self._carregar_indice(device_id, copiar=False)
+            versao = indice.get('versao', 0)
+            horizonte, entradas = self._ler_alteracoes(device_id)
+            if horizonte is None:
+                horizonte = versao
+
+            if desde is None or desde < horizonte or desde > versao:
+                gastos = [gasto.para_dict() for gasto in self.carregar_registros(device_id)]
+                return {"versao": versao, "completo": True, "gastos": gastos, "operacoes": []}
+
+            ids, meses, operacoes = set(), set(), []
+            for entrada in entradas:
+                if entrada['versao'] <= desde:
+                    continue
+                if entrada['op'] == 'adicionar':
+                    ids.update(entrada['ids'])
+                    meses.update(entrada['meses'])
+                elif entrada['op'] not in operacoes:
+                    operacoes.append(entrada['op'])
+
+            gastos = []
+            for mes in sorted(meses):
+                gastos.extend(gasto.para_dict() for gasto in self._registros_do_mes(device_id, indice, mes)
+                              if gasto.id in ids)
+            return {"versao": versao, "completo": False, "gastos": gastos, "operacoes": operacoes}
+
+    # Resumos mensais
+
+    def _calcular_resumos(self, gastos):
+        if not gastos:
+            return {}
+        # Importado só na reconstrução: inserções somam no resumo sem NumPy
+        from utils.agregacao import TabelaGastos
+        return TabelaGastos(gastos).resumos_mensais()
+
+    def _salvar_resumos(self, device_id, resumos):
+        self._invalidar((device_id, 'resumos'))
+        self._escrever_json(self._caminho(device_id, self.ARQUIVO_RESUMOS), resumos)
+
+    def carregar_resumos(self, device_id):
+        """Resumos mensais do dispositivo: {'AAAA-MM': {total, quantidade, impulsivo, categorias}}"""
+        caminho = self._caminho(device_id, self.ARQUIVO_RESUMOS)
+
+        if not os.path.exists(caminho):
+            # Resumo ausente (dados antigos): reconstrói a partir dos gastos
+            with self.bloqueio(device_id):
+                resumos = self._calcular_resumos(self.carregar(device_id)['gastos'])
+                self._salvar_resumos(device_id, resumos)
+            return resumos
+
+        return copy.deepcopy(self._obter_em_cache(
+            (device_id, 'resumos'), [caminho], lambda: self._ler_json(caminho)
+        ))
+
+    def resumo_mes(self, device_id, ano, mes):
+        """Resumo de um mês; vazio se não houver gastos no período"""
+        resumo = self.carregar_resumos(device_id).get(f'{ano:04d}-{mes:02d}')
+        return resumo or {"total": 0, "quantidade": 0, "impulsivo": 0, "categorias": {}}
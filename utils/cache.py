@@ -0,0 +1,99 @@
+import os
+import threading
+from collections import OrderedDict
+
+
+def assinatura_arquivos(*caminhos):
+    """Assinatura barata (mtime + tamanho + inode) de um conjunto de arquivos.
+
+    O inode muda a cada substituição atômica (os.replace): uma regravação por
+    outro processo no mesmo tique do relógio, com o mesmo tamanho, ainda muda
+    a assinatura.
+    """
+    assinatura = []
+    for caminho in caminhos:
+        try:
+            st = os.stat(caminho)
+            assinatura.append((st.st_mtime_ns, st.st_size, st.st_ino))
+        except FileNotFoundError:
+            assinatura.append(None)
+    return tuple(assinatura)
+
+
+class CacheLRU:
+    """Cache LRU thread-safe limitado por número de itens e por tamanho total.
+
+    Cada entrada guarda uma assinatura (ex.: mtime/tamanho dos arquivos de
+    origem); uma leitura com assinatura diferente conta como falta e descarta
+    a entrada. O tamanho de cada entrada é informado por quem insere.
+    """
+
+    def __init__(self, max_itens=1000, max_bytes=64 * 1024 * 1024):
+        self.max_itens = max_itens
+        self.max_bytes = max_bytes
+        self._itens = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.acertos = 0
+        self.faltas = 0
+        self.remocoes = 0
+
+    def obter(self, chave, assinatura=None):
+        """Retorna o valor em cache ou None se ausente/desatualizado"""
+        with self._lock:
+            entrada = self._itens.get(chave)
+            if entrada is None or entrada[0] != assinatura:
+                if entrada is not None:
+                    self._remover(chave)
+                self.faltas += 1
+                return None
+
+            self._itens.move_to_end(chave)
+            self.acertos += 1
+            return entrada[1]
+
+    def guardar(self, chave, valor, assinatura=None, tamanho=0):
+        """Insere um valor, removendo os menos usados se passar dos limites"""
+        if tamanho > self.max_bytes:
+            return
+
+        with self._lock:
+            if chave in self._itens:
+                self._remover(chave)
+
+            self._itens[chave] = (assinatura, valor, tamanho)
+            self._bytes += tamanho
+
+            while len(self._itens) > self.max_itens or self._bytes > self.max_bytes:
+                chave_antiga = next(iter(self._itens))
+                self._remover(chave_antiga)
+                self.remocoes += 1
+
+    def invalidar(self, chave):
+        with self._lock:
+            if chave in self._itens:
+                self._remover(chave)
+
+    def limpar(self):
+        with self._lock:
+            self._itens.clear()
+            self._bytes = 0
+
+    def _remover(self, chave):
+        _, _, tamanho = self._itens.pop(chave)
+        self._bytes -= tamanho
+
+    def estatisticas(self):
+        """Contadores para dimensionar o cache"""
+        with self._lock:
+            consultas = self.acertos + self.faltas
+            return {
+                "itens": len(self._itens),
+                "bytes": self._bytes,
+                "max_itens": self.max_itens,
+                "max_bytes": self.max_bytes,
+                "acertos": self.acertos,
+                "faltas": self.faltas,
+                "remocoes": self.remocoes,
+                "taxa_acerto": self.acertos / consultas if consultas else 0
+            }
@@ -0,0 +1,278 @@
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+from utils.armazenamento import escrever_bytes_atomico
+from utils.metricas import registro
+
+DURACAO_PDF = registro.histograma('walletcare_relatorio_pdf_segundos',
+                                  'Tempo de montagem do PDF no processo trabalhador')
+ESPERA_FILA = registro.histograma('walletcare_relatorio_fila_segundos',
+                                  'Tempo entre a submissão e a conclusão de um relatório')
+
+_gerador = None
+
+
+def _gerar_pdf(dados, config, periodo, incluir_detalhes):
+    """Executa no processo trabalhador: o ReportLab roda fora do GIL do servidor"""
+    global _gerador
+    if _gerador is None:
+        from utils.relatorio_pdf import GeradorRelatorio
+        _gerador = GeradorRelatorio()
+    # A duração volta junto com o PDF: as métricas vivem no processo do servidor
+    inicio = time.perf_counter()
+    pdf = _gerador.gerar_relatorio_completo(dados, config, periodo=periodo, incluir_detalhes=incluir_detalhes)
+    return pdf, time.perf_counter() - inicio
+
+
+_PADRAO_JOB_ID = re.compile(r'^[0-9a-f]{32}$')
+
+
+class FilaCheia(Exception):
+    """Há trabalhos demais aguardando na fila"""
+
+
+class FilaRelatorios:
+    """Fila de geração de relatórios PDF em um pool de processos limitado.
+
+    Pedidos com a mesma chave (dispositivo, versão dos dados, período...)
+    reaproveitam o mesmo trabalho enquanto ele estiver na fila, rodando ou
+    concluído e dentro da validade. Trabalhos concluídos expiram após
+    `validade` segundos.
+
+    Com `diretorio`, o status e o PDF de cada trabalho também são gravados
+    em disco: com vários processos servindo o app, o cliente pode consultar
+    e baixar o trabalho em um processo diferente do que o enfileirou.
+
+    O pool é criado por uma thread de requisição: no servidor, passe um
+    `contexto` sem fork (utils.frota.contexto_processos), como na frota.
+    """
+
+    def __init__(self, max_processos=2, max_pendentes=20, validade=600, diretorio=None, contexto=None):
+        self.max_processos = max_processos
+        self.contexto = contexto
+        self.max_pendentes = max_pendentes
+        self.validade = validade
+        self.diretorio = diretorio
+        self._executor = None
+        self._trabalhos = {}
+        self._por_chave = {}
+        self._lock = threading.Lock()
+        self._ultima_varredura = time.time()
+
+    def _obter_executor(self):
+        # Criado sob demanda: quem nunca gera relatório não sobe processos
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.max_processos, mp_context=self.contexto)
+        return self._executor
+
+    def _status(self, trabalho):
+        futuro = trabalho['futuro']
+        if futuro.done():
+            return 'erro' if futuro.cancelled() or futuro.exception() is not None else 'concluido'
+        return 'processando' if futuro.running() else 'na_fila'
+
+    def _expirar(self):
+        agora = time.time()
+        for job_id, trabalho in list(self._trabalhos.items()):
+            concluido_em = trabalho['concluido_em']
+            if concluido_em is not None and agora - concluido_em > self.validade:
+                del self._trabalhos[job_id]
+                if self._por_chave.get(trabalho['chave']) == job_id:
+                    del self._por_chave[trabalho['chave']]
+                self._remover_publicado(job_id)
+
+    # Trabalhos publicados em disco (visíveis aos outros processos)
+
+    def _caminhos(self, job_id):
+        base = os.path.join(self.diretorio, job_id)
+        return base + '.json', base + '.pdf'
+
+    def _publicar(self, trabalho, descricao, pdf=None):
+        if self.diretorio is None:
+            return
+        os.makedirs(self.diretorio, exist_ok=True)
+        caminho_status, caminho_pdf = self._caminhos(trabalho['id'])
+        if pdf is not None:
+            # O PDF vem antes do status: quem lê 'concluido' já encontra o arquivo
+            escrever_bytes_atomico(caminho_pdf, pdf)
+        descricao = {**descricao, "device_id": trabalho['device_id']}
+        escrever_bytes_atomico(caminho_status, json.dumps(descricao).encode('utf-8'))
+
+    def _ler_publicado(self, job_id, device_id):
+        """Status gravado por outro processo; None se não existir, expirou ou é de outro dispositivo"""
+        if self.diretorio is None or not _PADRAO_JOB_ID.match(job_id):
+            return None
+        try:
+            with open(self._caminhos(job_id)[0], 'r', encoding='utf-8') as f:
+                descricao = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        # Um trabalho pendente há mais que a validade ficou órfão (o processo dono terminou)
+        limite = descricao.get('expira_em', descricao['criado_em'] + self.validade)
+        if time.time() > limite:
+            self._remover_publicado(job_id)
+            return None
+        if descricao.pop('device_id') != device_id:
+            return None
+        return descricao
+
+    def _remover_publicado(self, job_id):
+        if self.diretorio is None:
+            return
+        for caminho in self._caminhos(job_id):
+            try:
+                os.remove(caminho)
+            except FileNotFoundError:
+                pass
+
+    def _varrer_publicados(self):
+        """Remove de tempos em tempos os arquivos expirados deixados por qualquer processo"""
+        agora = time.time()
+        if self.diretorio is None or agora - self._ultima_varredura < self.validade:
+            return
+        self._ultima_varredura = agora
+        try:
+            nomes = os.listdir(self.diretorio)
+        except FileNotFoundError:
+            return
+        for nome in nomes:
+            caminho = os.path.join(self.diretorio, nome)
+            try:
+                if agora - os.stat(caminho).st_mtime > 2 * self.validade:
+                    os.remove(caminho)
+            except FileNotFoundError:
+                pass
+
+    def _existente(self, chave):
+        job_id = self._por_chave.get(chave)
+        if job_id is None:
+            return None
+        trabalho = self._trabalhos[job_id]
+        # Um trabalho que falhou não bloqueia novas tentativas
+        return self._descrever(trabalho) if self._status(trabalho) != 'erro' else None
+
+    def existente(self, chave):
+        """Trabalho reaproveitável com a chave (na fila, rodando ou concluído), ou None.
+
+        Permite pular a leitura dos dados quando submeter devolveria o trabalho existente.
+        """
+        with self._lock:
+            self._expirar()
+            return self._existente(chave)
+
+    def submeter(self, chave, device_id, dados, config, periodo=None, incluir_detalhes=True):
+        """Enfileira um relatório (ou devolve o trabalho existente com a mesma chave)"""
+        with self._lock:
+            self._expirar()
+            self._varrer_publicados()
+
+            existente = self._existente(chave)
+            if existente is not None:
+                return existente
+
+            pendentes = sum(1 for t in self._trabalhos.values() if not t['futuro'].done())
+            if pendentes >= self.max_pendentes:
+                raise FilaCheia()
+
+            trabalho = {
+                "id": uuid.uuid4().hex,
+                "chave": chave,
+                "device_id": device_id,
+                "criado_em": time.time(),
+                "concluido_em": None
+            }
+            # Publicado antes de submeter: a conclusão (em outra thread) sempre grava por último
+            self._publicar(trabalho, {"job_id": trabalho['id'], "status": "na_fila",
+                                      "criado_em": trabalho['criado_em']})
+            trabalho['futuro'] = self._obter_executor().submit(
+                _gerar_pdf, dados, config, periodo, incluir_detalhes
+            )
+            trabalho['futuro'].add_done_callback(lambda futuro: self._concluir(trabalho, futuro))
+
+            self._trabalhos[trabalho['id']] = trabalho
+            self._por_chave[chave] = trabalho['id']
+            return self._descrever(trabalho)
+
+    def _concluir(self, trabalho, futuro):
+        trabalho['concluido_em'] = time.time()
+        ESPERA_FILA.observar(trabalho['concluido_em'] - trabalho['criado_em'])
+        pdf = None
+        if not futuro.cancelled() and futuro.exception() is None:
+            pdf, duracao = futuro.result()
+            DURACAO_PDF.observar(duracao)
+        try:
+            self._publicar(trabalho, self._descrever(trabalho), pdf)
+        except OSError:
+            # Só os outros processos deixam de ver o trabalho; este continua servindo
+            pass
+
+    def _descrever(self, trabalho):
+        status = self._status(trabalho)
+        descricao = {
+            "job_id": trabalho['id'],
+            "status": status,
+            "criado_em": trabalho['criado_em']
+        }
+        if status == 'erro':
+            futuro = trabalho['futuro']
+            descricao['erro'] = 'cancelado' if futuro.cancelled() else str(futuro.exception())
+        if trabalho['concluido_em'] is not None:
+            descricao['expira_em'] = trabalho['concluido_em'] + self.validade
+        return descricao
+
+    def consultar(self, job_id, device_id):
+        """Status do trabalho, ou None se não existir/expirou/for de outro dispositivo"""
+        with self._lock:
+            self._expirar()
+            trabalho = self._trabalhos.get(job_id)
+            if trabalho is None:
+                return self._ler_publicado(job_id, device_id)
+            if trabalho['device_id'] != device_id:
+                return None
+            return self._descrever(trabalho)
+
+    def resultado(self, job_id, device_id, espera=None):
+        """PDF (bytes) do trabalho concluído; None se ainda não terminou ou não existe.
+
+        Com `espera` (segundos), bloqueia até o trabalho terminar.
+        """
+        with self._lock:
+            trabalho = self._trabalhos.get(job_id)
+            if trabalho is None:
+                return self._resultado_publicado(job_id, device_id)
+            if trabalho['device_id'] != device_id:
+                return None
+            futuro = trabalho['futuro']
+
+        if espera is None and not futuro.done():
+            return None
+        return futuro.result(timeout=espera)[0]
+
+    def _resultado_publicado(self, job_id, device_id):
+        descricao = self._ler_publicado(job_id, device_id)
+        if descricao is None or descricao['status'] != 'concluido':
+            return None
+        try:
+            with open(self._caminhos(job_id)[1], 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def estatisticas(self):
+        with self._lock:
+            self._expirar()
+            contagem = {"na_fila": 0, "processando": 0, "concluido": 0, "erro": 0}
+            for trabalho in self._trabalhos.values():
+                contagem[self._status(trabalho)] += 1
+            return {**contagem, "max_processos": self.max_processos, "max_pendentes": self.max_pendentes}
+
+    def encerrar(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
@@ -0,0 +1,227 @@
+"""Agregados de todos os dispositivos: gasto por mês e categoria, impulsivos e dispositivos ativos.
+
+Uso:
+    python -m utils.frota [--data-dir data] [--processos N] [--inicio AAAA-MM] [--fim AAAA-MM] [--json]
+
+A parcial de cada dispositivo são os resumos mensais materializados
+(resumos.json), mantidos pelo armazenamento com a mesma regra de
+calcular_estatisticas: totais em centavos por categoria, e impulsivo
+inclui a categoria nao_essencial. Os dispositivos são lidos em um pool de
+processos e as parciais somadas em centavos. As parciais ficam em
+DATA_DIR/.frota/frota.json com a assinatura dos arquivos de origem: uma nova
+execução só relê os dispositivos que mudaram.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+from utils.armazenamento import ArmazenamentoGastos, escrever_json_atomico
+from utils.cache import assinatura_arquivos
+
+
+def assinar(data_dir, device_id):
+    """Assinatura (serializável em JSON) dos arquivos de que a parcial depende"""
+    caminhos = [os.path.join(data_dir, device_id, nome)
+                for nome in (ArmazenamentoGastos.ARQUIVO_RESUMOS, ArmazenamentoGastos.ARQUIVO_INDICE)]
+    return [list(item) if item else None for item in assinatura_arquivos(*caminhos)]
+
+
+def resumos_dispositivo(data_dir, device_id):
+    """Executa no processo trabalhador: (assinatura, resumos mensais) de um dispositivo.
+
+    Resumos None indicam um dispositivo ainda em formato antigo (não migrado).
+    """
+    armazenamento = ArmazenamentoGastos(data_dir)
+    # A assinatura é tirada antes da leitura: uma escrita no meio faz a próxima execução reler
+    assinatura = assinar(data_dir, device_id)
+    if armazenamento.precisa_migrar(device_id):
+        return assinatura, None
+    if assinatura[1] is None:
+        # Diretório sem gastos (só config, por exemplo)
+        return assinatura, {}
+    return assinatura, armazenamento.carregar_resumos(device_id)
+
+
+def combinar(resumos_por_dispositivo, inicio=None, fim=None):
+    """Soma as parciais ({device_id: resumos}) nos meses de inicio a fim (AAAA-MM, inclusivos)"""
+    meses = {}
+    ativos = set()
+    nao_migrados = []
+    for device_id, resumos in resumos_por_dispositivo.items():
+        if resumos is None:
+            nao_migrados.append(device_id)
+            continue
+        for mes, resumo in resumos.items():
+            if (inicio and mes < inicio) or (fim and mes > fim) or not resumo.get('quantidade'):
+                continue
+            ativos.add(device_id)
+            agregado = meses.setdefault(mes, {"total": 0, "quantidade": 0, "impulsivo": 0,
+                                              "categorias": {}, "dispositivos_ativos": 0})
+            # Em centavos inteiros até o fim: a soma não acumula erro de arredondamento
+            agregado['total'] += round(resumo['total'] * 100)
+            agregado['quantidade'] += resumo['quantidade']
+            agregado['impulsivo'] += round(resumo.get('impulsivo', 0) * 100)
+            agregado['dispositivos_ativos'] += 1
+            for categoria, valores in resumo.get('categorias', {}).items():
+                por_categoria = agregado['categorias'].setdefault(categoria, {"total": 0, "quantidade": 0})
+                por_categoria['total'] += round(valores['total'] * 100)
+                por_categoria['quantidade'] += valores['quantidade']
+
+    total = sum(agregado['total'] for agregado in meses.values())
+    impulsivo = sum(agregado['impulsivo'] for agregado in meses.values())
+    categorias = {}
+    for agregado in meses.values():
+        for categoria, valores in agregado['categorias'].items():
+            categorias[categoria] = categorias.get(categoria, 0) + valores['total']
+
+    return {
+        "meses": {mes: _em_reais(meses[mes]) for mes in sorted(meses)},
+        "total": total / 100,
+        "impulsivo": impulsivo / 100,
+        "participacao_impulsivo": _participacao(impulsivo, total),
+        "categorias": {categoria: centavos / 100
+                       for categoria, centavos in sorted(categorias.items(), key=lambda item: -item[1])},
+        "dispositivos": len(resumos_por_dispositivo),
+        "dispositivos_ativos": len(ativos),
+        "nao_migrados": sorted(nao_migrados)
+    }
+
+
+def _participacao(parte, total):
+    return round(parte / total, 4) if total else 0
+
+
+def _em_reais(agregado):
+    categorias = sorted(agregado['categorias'].items(), key=lambda item: -item[1]['total'])
+    return {
+        "total": agregado['total'] / 100,
+        "quantidade": agregado['quantidade'],
+        "impulsivo": agregado['impulsivo'] / 100,
+        "participacao_impulsivo": _participacao(agregado['impulsivo'], agregado['total']),
+        "dispositivos_ativos": agregado['dispositivos_ativos'],
+        "categorias": {categoria: {"total": valores['total'] / 100, "quantidade": valores['quantidade']}
+                       for categoria, valores in categorias}
+    }
+
+
+def contexto_processos():
+    """Contexto de multiprocessing sem fork: forkserver onde houver, senão spawn"""
+    metodo = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+    return multiprocessing.get_context(metodo)
+
+
+class AnaliseFrota:
+    """Agregados de todos os dispositivos de data_dir, com cache incremental das parciais.
+
+    Poucos dispositivos alterados (menos que MINIMO_PARA_POOL) são relidos no
+    próprio processo: subir o pool custaria mais que a leitura. Dentro do
+    servidor (multithread), passe contexto=contexto_processos(): um filho
+    criado por fork herdaria locks que outras threads seguram.
+    """
+
+    ARQUIVO_CACHE = 'frota.json'
+    MINIMO_PARA_POOL = 4
+
+    def __init__(self, data_dir, processos=None, diretorio_cache=None, contexto=None):
+        self.data_dir = data_dir
+        self.processos = processos or os.cpu_count() or 1
+        self.contexto = contexto
+        self.caminho_cache = os.path.join(diretorio_cache or os.path.join(data_dir, '.frota'), self.ARQUIVO_CACHE)
+        self.armazenamento = ArmazenamentoGastos(data_dir)
+        self._lock = threading.Lock()
+
+    def _ler_cache(self):
+        try:
+            with open(self.caminho_cache, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _gravar_cache(self, parciais):
+        os.makedirs(os.path.dirname(self.caminho_cache), exist_ok=True)
+        escrever_json_atomico(self.caminho_cache, parciais)
+
+    def atualizar(self):
+        """Relê só os dispositivos cujos arquivos mudaram; retorna (parciais, estatísticas da execução)"""
+        with self._lock:
+            inicio = time.perf_counter()
+            anteriores = self._ler_cache()
+
+            parciais = {}
+            alterados = []
+            for device_id in self.armazenamento.dispositivos():
+                anterior = anteriores.get(device_id)
+                if anterior is not None and anterior['assinatura'] == assinar(self.data_dir, device_id):
+                    parciais[device_id] = anterior
+                else:
+                    alterados.append(device_id)
+
+            ler = partial(resumos_dispositivo, self.data_dir)
+            if len(alterados) >= self.MINIMO_PARA_POOL and self.processos > 1:
+                processos = min(self.processos, len(alterados))
+                with ProcessPoolExecutor(max_workers=processos, mp_context=self.contexto) as executor:
+                    lidos = list(executor.map(ler, alterados, chunksize=max(1, len(alterados) // (processos * 4))))
+            else:
+                lidos = [ler(device_id) for device_id in alterados]
+
+            for device_id, (assinatura, resumos) in zip(alterados, lidos):
+                parciais[device_id] = {"assinatura": assinatura, "resumos": resumos}
+
+            # Dispositivos removidos também mudam o cache
+            if alterados or len(parciais) != len(anteriores):
+                self._gravar_cache(parciais)
+
+            return parciais, {
+                "relidos": len(alterados),
+                "reaproveitados": len(parciais) - len(alterados),
+                "segundos": round(time.perf_counter() - inicio, 3)
+            }
+
+    def calcular(self, inicio=None, fim=None):
+        """Agregados de inicio a fim (AAAA-MM, inclusivos), mais as estatísticas da execução"""
+        parciais, execucao = self.atualizar()
+        resultado = combinar({device_id: parcial['resumos'] for device_id, parcial in parciais.items()},
+                             inicio, fim)
+        resultado['execucao'] = execucao
+        return resultado
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--data-dir', default=os.environ.get('WALLETCARE_DATA_DIR', 'data'))
+    parser.add_argument('--processos', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--inicio', help="primeiro mês (AAAA-MM)")
+    parser.add_argument('--fim', help="último mês (AAAA-MM)")
+    parser.add_argument('--json', action='store_true', help="imprime o resultado completo em JSON")
+    args = parser.parse_args()
+
+    resultado = AnaliseFrota(args.data_dir, processos=args.processos).calcular(args.inicio, args.fim)
+    if args.json:
+        print(json.dumps(resultado, ensure_ascii=False, indent=2))
+        return 0
+
+    print(f"{'mês':<8} {'total':>14} {'gastos':>8} {'impulsivo':>10} {'ativos':>7}  principais categorias")
+    for mes, agregado in resultado['meses'].items():
+        principais = ', '.join(f"{categoria} {valores['total']:.2f}"
+                               for categoria, valores in list(agregado['categorias'].items())[:3])
+        print(f"{mes:<8} {agregado['total']:>14.2f} {agregado['quantidade']:>8} "
+              f"{agregado['participacao_impulsivo']:>9.1%} {agregado['dispositivos_ativos']:>7}  {principais}")
+
+    execucao = resultado['execucao']
+    print(f"\ntotal {resultado['total']:.2f}, impulsivo {resultado['participacao_impulsivo']:.1%}; "
+          f"{resultado['dispositivos_ativos']} de {resultado['dispositivos']} dispositivos ativos")
+    if resultado['nao_migrados']:
+        print(f"ainda em formato antigo (fora da soma): {', '.join(resultado['nao_migrados'])}")
+    print(f"{execucao['relidos']} dispositivos relidos, {execucao['reaproveitados']} do cache, "
+          f"{execucao['segundos']:.2f}s", file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
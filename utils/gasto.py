@@ -0,0 +1,170 @@
+"""Representação compacta de um gasto em memória.
+
+Um dict por gasto custa caro: a tabela de chaves, o float do valor, a data
+ISO como string e uma cópia da string da categoria em cada registro. Gasto
+usa __slots__ e guarda o valor em centavos (int), a data como microssegundos
+desde a época (int) e a categoria como código pequeno de uma tabela
+compartilhada pelo processo. Gasto.de_dict/para_dict fazem a conversão na
+fronteira: a API e os arquivos continuam vendo o mesmo JSON.
+"""
+import sys
+import threading
+from datetime import datetime, timedelta
+
+EPOCA = datetime(1970, 1, 1)
+_MICROSSEGUNDO = timedelta(microseconds=1)
+
+CAMPOS = ('valor', 'categoria', 'descricao', 'eh_impulsivo', 'data', 'id', 'client_id')
+
+# Tabela de categorias do processo: código → nome e nome → código (só cresce)
+_nomes_categorias = []
+_codigos_categorias = {}
+_lock_categorias = threading.Lock()
+
+
+def codigo_categoria(nome):
+    codigo = _codigos_categorias.get(nome)
+    if codigo is None:
+        with _lock_categorias:
+            codigo = _codigos_categorias.get(nome)
+            if codigo is None:
+                codigo = len(_nomes_categorias)
+                _nomes_categorias.append(sys.intern(nome) if isinstance(nome, str) else nome)
+                _codigos_categorias[nome] = codigo
+    return codigo
+
+
+def para_centavos(valor):
+    """Valor numérico → centavos (int); None se não for um número"""
+    if isinstance(valor, bool) or not isinstance(valor, (int, float)):
+        return None
+    return round(valor * 100)
+
+
+def para_timestamp(data):
+    """Data ISO sem fuso → microssegundos desde a época; None se não voltar idêntica"""
+    if not isinstance(data, str):
+        return None
+    try:
+        convertida = datetime.fromisoformat(data)
+    except ValueError:
+        return None
+    if convertida.tzinfo is not None:
+        return None
+    timestamp = (convertida - EPOCA) // _MICROSSEGUNDO
+    return timestamp if para_iso(timestamp) == data else None
+
+
+def para_iso(timestamp):
+    return (EPOCA + timedelta(microseconds=timestamp)).isoformat()
+
+
+class Gasto:
+    """Um gasto com __slots__; campos ausentes ficam None e não aparecem em para_dict.
+
+    Valores que não cabem na forma compacta (valor não numérico, data fora
+    do formato ISO, chaves extras) ficam em `extras` e voltam como vieram.
+    """
+
+    __slots__ = ('id', 'centavos', 'codigo_categoria', 'descricao', 'eh_impulsivo', 'timestamp',
+                 'client_id', 'extras')
+
+    def __init__(self, id=None, centavos=None, codigo_categoria=None, descricao=None,
+                 eh_impulsivo=None, timestamp=None, client_id=None, extras=None):
+        self.id = id
+        self.centavos = centavos
+        self.codigo_categoria = codigo_categoria
+        self.descricao = descricao
+        self.eh_impulsivo = eh_impulsivo
+        self.timestamp = timestamp
+        # ID gerado pelo cliente (sincronização offline): torna o reenvio idempotente
+        self.client_id = client_id
+        self.extras = extras
+
+    @classmethod
+    def de_dict(cls, gasto):
+        extras = None
+        for chave, valor in gasto.items():
+            if chave not in CAMPOS or valor is None or (chave == 'eh_impulsivo' and not isinstance(valor, bool)):
+                extras = extras or {}
+                extras[chave] = valor
+
+        centavos = None
+        if 'valor' in gasto:
+            centavos = para_centavos(gasto['valor'])
+            if centavos is None and gasto['valor'] is not None:
+                extras = extras or {}
+                extras['valor'] = gasto['valor']
+
+        timestamp = None
+        data = gasto.get('data')
+        if data is not None:
+            timestamp = para_timestamp(data)
+            if timestamp is None:
+                extras = extras or {}
+                extras['data'] = data
+
+        categoria = gasto.get('categoria')
+        impulsivo = gasto.get('eh_impulsivo')
+        return cls(
+            id=gasto.get('id'),
+            centavos=centavos,
+            codigo_categoria=None if categoria is None else codigo_categoria(categoria),
+            descricao=gasto.get('descricao'),
+            eh_impulsivo=impulsivo if isinstance(impulsivo, bool) else None,
+            timestamp=timestamp,
+            client_id=gasto.get('client_id'),
+            extras=extras
+        )
+
+    @property
+    def valor(self):
+        if self.centavos is None:
+            return self.extras.get('valor', 0) if self.extras else 0
+        return self.centavos / 100
+
+    @property
+    def categoria(self):
+        if self.codigo_categoria is None:
+            return 'outros'
+        return _nomes_categorias[self.codigo_categoria]
+
+    @property
+    def impulsivo(self):
+        if self.eh_impulsivo is not None:
+            return self.eh_impulsivo
+        return bool(self.extras.get('eh_impulsivo', False)) if self.extras else False
+
+    @property
+    def data(self):
+        """Data ISO como gravada (ou None)"""
+        if self.timestamp is not None:
+            return para_iso(self.timestamp)
+        return self.extras.get('data') if self.extras else None
+
+    def para_dict(self):
+        gasto = {}
+        if self.centavos is not None:
+            gasto['valor'] = self.centavos / 100
+        if self.codigo_categoria is not None:
+            gasto['categoria'] = _nomes_categorias[self.codigo_categoria]
+        if self.descricao is not None:
+            gasto['descricao'] = self.descricao
+        if self.eh_impulsivo is not None:
+            gasto['eh_impulsivo'] = self.eh_impulsivo
+        if self.timestamp is not None:
+            gasto['data'] = para_iso(self.timestamp)
+        if self.id is not None:
+            gasto['id'] = self.id
+        if self.client_id is not None:
+            gasto['client_id'] = self.client_id
+        if self.extras:
+            gasto.update(self.extras)
+        return gasto
+
+    def __reduce__(self):
+        # Os códigos de categoria são do processo: entre processos viaja o dict
+        return (Gasto.de_dict, (self.para_dict(),))
+
+    def __repr__(self):
+        return f"Gasto({self.para_dict()!r})"
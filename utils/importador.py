@@ -0,0 +1,260 @@
+"""Importação de extratos bancários (CSV e OFX) linha a linha.
+
+Uso pela linha de comando:
+    python -m utils.importador --device-id <id> extrato.csv [--data-dir data]
+"""
+import argparse
+import csv
+import hashlib
+import io
+import math
+import re
+import sys
+from datetime import datetime
+
+from utils.analisador import AnalisadorFinanceiro
+from utils.armazenamento import ArmazenamentoGastos, chave_dia
+
+COLUNAS_DATA = ('data', 'date', 'data lançamento', 'data lancamento', 'dt')
+COLUNAS_DESCRICAO = ('descrição', 'descricao', 'histórico', 'historico', 'description', 'memo', 'lançamento', 'lancamento')
+COLUNAS_VALOR = ('valor', 'value', 'amount', 'valor (r$)', 'quantia')
+
+FORMATOS_DATA = ('%d/%m/%Y', '%Y-%m-%d', '%d/%m/%y', '%d-%m-%Y', '%d.%m.%Y')
+
+_TAG_OFX = re.compile(r'<(/?)([A-Za-z0-9.]+)>([^<\r\n]*)')
+
+
+def converter_valor(texto):
+    """Converte '1.234,56', '-25,90', 'R$ 25.90' ou '(25,90)' em float"""
+    texto = texto.strip().replace('R$', '').replace(' ', '')
+    negativo = texto.startswith('(') and texto.endswith(')')
+    texto = texto.strip('()')
+
+    if ',' in texto and '.' in texto:
+        # O separador que aparece por último é o decimal
+        if texto.rfind(',') > texto.rfind('.'):
+            texto = texto.replace('.', '').replace(',', '.')
+        else:
+            texto = texto.replace(',', '')
+    elif ',' in texto:
+        texto = texto.replace(',', '.')
+    elif texto.count('.') > 1 or re.search(r'\.\d{3}$', texto):
+        # Só pontos com grupos de 3 dígitos: separador de milhar
+        texto = texto.replace('.', '')
+
+    valor = float(texto)
+    if not math.isfinite(valor):
+        # float() também aceita 'nan' e 'inf', que não são valores de extrato
+        raise ValueError(f"valor inválido: {texto!r}")
+    return -valor if negativo else valor
+
+
+def converter_data(texto):
+    """Converte as datas usuais de extrato em ISO 'AAAA-MM-DDTHH:MM:SS'"""
+    texto = texto.strip()
+    for formato in FORMATOS_DATA:
+        try:
+            return datetime.strptime(texto, formato).isoformat()
+        except ValueError:
+            continue
+    raise ValueError(f"data inválida: {texto!r}")
+
+
+def converter_data_ofx(texto):
+    """Converte DTPOSTED do OFX (AAAAMMDD[HHMMSS[.XXX]][fuso]) em ISO"""
+    digitos = re.match(r'\d+', texto.strip())
+    if not digitos or len(digitos.group()) < 8:
+        raise ValueError(f"data OFX inválida: {texto!r}")
+    numeros = digitos.group()
+    formato = '%Y%m%d%H%M%S' if len(numeros) >= 14 else '%Y%m%d'
+    return datetime.strptime(numeros[:14] if len(numeros) >= 14 else numeros[:8], formato).isoformat()
+
+
+def ler_csv(arquivo):
+    """Gera (data, valor, descricao) de um CSV, uma linha por vez.
+
+    O separador é detectado pelo cabeçalho e as colunas são encontradas pelo
+    nome (data/descrição/valor em português ou inglês). Uma linha sem todas
+    as colunas gera None (contada como erro por quem importa).
+    """
+    cabecalho = arquivo.readline()
+    if not cabecalho:
+        return
+    try:
+        dialeto = csv.Sniffer().sniff(cabecalho, delimiters=';,\t|')
+    except csv.Error:
+        dialeto = csv.excel
+
+    nomes = [nome.strip().lower() for nome in next(csv.reader([cabecalho], dialeto))]
+
+    def coluna(opcoes):
+        for indice, nome in enumerate(nomes):
+            if nome in opcoes:
+                return indice
+        raise ValueError(f"coluna não encontrada no cabeçalho: {'/'.join(opcoes[:2])}")
+
+    col_data, col_descricao, col_valor = coluna(COLUNAS_DATA), coluna(COLUNAS_DESCRICAO), coluna(COLUNAS_VALOR)
+    ultima_coluna = max(col_data, col_valor, col_descricao)
+
+    for linha in csv.reader(arquivo, dialeto):
+        if not linha or not any(campo.strip() for campo in linha):
+            continue
+        if len(linha) <= ultima_coluna:
+            yield None
+            continue
+        yield linha[col_data], linha[col_valor], linha[col_descricao]
+
+
+def ler_ofx(arquivo):
+    """Gera (data, valor, descricao) de cada <STMTTRN> de um OFX (SGML ou XML)"""
+    transacao = None
+    for linha in arquivo:
+        for fechamento, tag, conteudo in _TAG_OFX.findall(linha):
+            tag = tag.upper()
+            if tag == 'STMTTRN':
+                if fechamento:
+                    if transacao is not None:
+                        descricao = transacao.get('MEMO') or transacao.get('NAME', '')
+                        yield transacao.get('DTPOSTED', ''), transacao.get('TRNAMT', ''), descricao
+                    transacao = None
+                else:
+                    transacao = {}
+            elif transacao is not None and not fechamento:
+                transacao[tag] = conteudo.strip()
+
+
+class ImportadorExtrato:
+    """Importa extratos em lotes, categorizando cada linha e ignorando duplicatas.
+
+    Um gasto é considerado duplicado se já existir outro com o mesmo dia,
+    o mesmo valor em centavos e o mesmo hash de descrição. Só os lançamentos
+    de saída (valor negativo) viram gastos, a menos que incluir_positivos
+    seja usado (ex.: fatura de cartão, que lista as compras como positivas).
+    """
+
+    TAMANHO_LOTE = 500
+    INTERVALO_PROGRESSO = 5000
+
+    def __init__(self, armazenamento, analisador=None, tamanho_lote=None):
+        self.armazenamento = armazenamento
+        self.analisador = analisador or AnalisadorFinanceiro()
+        self.tamanho_lote = tamanho_lote or self.TAMANHO_LOTE
+
+    @staticmethod
+    def chave_duplicata(data, valor, descricao):
+        resumo = hashlib.blake2b(descricao.strip().lower().encode('utf-8'), digest_size=8).digest()
+        return (chave_dia(data), round(abs(float(valor)) * 100), resumo)
+
+    def _chaves_existentes(self, device_id):
+        chaves = set()
+        for gasto in self.armazenamento.carregar_registros(device_id):
+            try:
+                chaves.add(self.chave_duplicata(gasto.data, gasto.valor, gasto.descricao or ''))
+            except (TypeError, ValueError, AttributeError):
+                continue
+        return chaves
+
+    def importar(self, device_id, arquivo, formato, incluir_positivos=False, progresso=None):
+        """Importa um arquivo de texto já aberto; retorna as contagens finais"""
+        leitor = ler_ofx if formato == 'ofx' else ler_csv
+        conversor_data = converter_data_ofx if formato == 'ofx' else converter_data
+
+        self.armazenamento.inicializar(device_id)
+        existentes = self._chaves_existentes(device_id)
+
+        estatisticas = {"lidas": 0, "importadas": 0, "duplicadas": 0, "ignoradas": 0, "erros": 0}
+        lote = []
+
+        def gravar_lote():
+            if lote:
+                self.armazenamento.adicionar_gastos(lote, device_id)
+                estatisticas['importadas'] += len(lote)
+                lote.clear()
+
+        for lancamento in leitor(arquivo):
+            estatisticas['lidas'] += 1
+            if lancamento is None:
+                estatisticas['erros'] += 1
+                continue
+            data_texto, valor_texto, descricao = lancamento
+            try:
+                data = conversor_data(data_texto)
+                valor = converter_valor(valor_texto)
+            except ValueError:
+                estatisticas['erros'] += 1
+                continue
+
+            if valor == 0 or (valor > 0 and not incluir_positivos):
+                estatisticas['ignoradas'] += 1
+                continue
+
+            descricao = descricao.strip()
+            chave = self.chave_duplicata(data, valor, descricao)
+            if chave in existentes:
+                estatisticas['duplicadas'] += 1
+                continue
+            existentes.add(chave)
+
+            texto = descricao.lower()
+            categoria = self.analisador.identificar_categoria(texto)
+            eh_impulsivo = self.analisador.detectar_gasto_impulsivo(texto)
+            if eh_impulsivo:
+                categoria = 'nao_essencial'
+
+            lote.append({
+                "valor": abs(valor),
+                "categoria": categoria,
+                "descricao": descricao,
+                "eh_impulsivo": eh_impulsivo,
+                "data": data
+            })
+            if len(lote) >= self.tamanho_lote:
+                gravar_lote()
+
+            if progresso and estatisticas['lidas'] % self.INTERVALO_PROGRESSO == 0:
+                progresso(dict(estatisticas))
+
+        gravar_lote()
+        if progresso:
+            progresso(dict(estatisticas))
+        return estatisticas
+
+
+def detectar_formato(nome_arquivo):
+    return 'ofx' if nome_arquivo.lower().endswith(('.ofx', '.qfx')) else 'csv'
+
+
+def abrir_texto(binario, encoding='utf-8-sig'):
+    """Envolve um arquivo binário (ex.: upload) em leitura de texto sem carregá-lo inteiro"""
+    return io.TextIOWrapper(binario, encoding=encoding, errors='replace', newline='')
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Importa um extrato CSV/OFX para um dispositivo")
+    parser.add_argument('arquivo')
+    parser.add_argument('--device-id', required=True)
+    parser.add_argument('--data-dir', default='data')
+    parser.add_argument('--formato', choices=['csv', 'ofx'])
+    parser.add_argument('--encoding', default='utf-8-sig')
+    parser.add_argument('--incluir-positivos', action='store_true',
+                        help="importa também valores positivos (ex.: fatura de cartão)")
+    args = parser.parse_args()
+
+    formato = args.formato or detectar_formato(args.arquivo)
+    importador = ImportadorExtrato(ArmazenamentoGastos(args.data_dir))
+
+    def mostrar(estatisticas):
+        print(f"{estatisticas['lidas']} linhas lidas, {estatisticas['importadas']} importadas, "
+              f"{estatisticas['duplicadas']} duplicadas", file=sys.stderr)
+
+    with open(args.arquivo, 'rb') as binario:
+        estatisticas = importador.importar(
+            args.device_id, abrir_texto(binario, args.encoding), formato,
+            incluir_positivos=args.incluir_positivos, progresso=mostrar
+        )
+
+    print(estatisticas)
+
+
+if __name__ == '__main__':
+    main()
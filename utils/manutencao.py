@@ -0,0 +1,139 @@
+"""Manutenção do diretório de dados: migra, arquiva, compacta e verifica todos os dispositivos.
+
+Uso:
+    python -m utils.manutencao [--data-dir data] [--processos N] [--retencao-meses N] [--so-verificar]
+
+Cada dispositivo é processado em um processo do pool, sob o lock do
+dispositivo (o servidor pode continuar rodando):
+  - formatos antigos (financas.json, gastos.json) são migrados
+  - com --retencao-meses N (ou WALLETCARE_RETENCAO_MESES), os meses
+    anteriores aos N mais recentes saem do conjunto vivo para o arquivo
+    comprimido do ano; os resumos mensais continuam completos
+  - todas as partições são compactadas: diários incorporados ao snapshot
+    colunar e meses encerrados comprimidos com gzip; índice, resumos e
+    config são regravados em JSON compacto
+  - os gastos lidos depois da compactação são comparados aos de antes, e
+    índice e resumos são conferidos contra as partições
+
+No fim são mostrados os bytes de cada dispositivo antes e depois. O código
+de saída é 1 se algum dispositivo tiver problemas.
+"""
+import argparse
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+from utils.armazenamento import ArmazenamentoGastos, BloqueioDispositivo, escrever_json_atomico
+
+ARQUIVO_CONFIG = 'config.json'
+
+
+def tamanho_diretorio(diretorio):
+    """Bytes dos arquivos de dados do diretório (sem o arquivo de lock)"""
+    total = 0
+    for raiz, _, arquivos in os.walk(diretorio):
+        for nome in arquivos:
+            if nome != BloqueioDispositivo.ARQUIVO:
+                try:
+                    total += os.path.getsize(os.path.join(raiz, nome))
+                except FileNotFoundError:
+                    pass
+    return total
+
+
+def compactar_config(diretorio):
+    caminho = os.path.join(diretorio, ARQUIVO_CONFIG)
+    if not os.path.exists(caminho):
+        return
+    with open(caminho, 'r', encoding='utf-8') as f:
+        config = json.load(f)
+    escrever_json_atomico(caminho, config)
+
+
+def processar_dispositivo(data_dir, device_id, so_verificar=False, retencao_meses=0):
+    """Migra/arquiva/compacta/verifica um dispositivo; retorna um dict com bytes e problemas"""
+    armazenamento = ArmazenamentoGastos(data_dir)
+    diretorio = os.path.join(data_dir, device_id)
+    resultado = {"device_id": device_id, "bytes_antes": tamanho_diretorio(diretorio),
+                 "migrado": False, "arquivados": [], "problemas": []}
+
+    try:
+        with armazenamento.bloqueio(device_id):
+            if not so_verificar:
+                if armazenamento.precisa_migrar(device_id):
+                    armazenamento.inicializar(device_id)
+                    resultado['migrado'] = True
+
+                antes = armazenamento.carregar(device_id)['gastos']
+                if retencao_meses > 0:
+                    resultado['arquivados'] = armazenamento.arquivar(device_id, retencao_meses)
+                armazenamento.compactar(device_id)
+                compactar_config(diretorio)
+
+                # Instância nova: lê tudo do disco, no formato que acabou de ser gravado
+                depois = ArmazenamentoGastos(data_dir).carregar(device_id)['gastos']
+                if depois != antes:
+                    resultado['problemas'].append("gastos diferentes depois da compactação")
+
+            resultado['problemas'].extend(armazenamento.verificar(device_id))
+    except (OSError, ValueError, KeyError) as erro:
+        resultado['problemas'].append(f"falha: {erro!r}")
+
+    resultado['bytes_depois'] = tamanho_diretorio(diretorio)
+    return resultado
+
+
+def formatar_bytes(quantidade):
+    for unidade in ('B', 'KB', 'MB'):
+        if abs(quantidade) < 1024:
+            return f"{quantidade:.0f} {unidade}" if unidade == 'B' else f"{quantidade:.1f} {unidade}"
+        quantidade /= 1024
+    return f"{quantidade:.1f} GB"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--data-dir', default=os.environ.get('WALLETCARE_DATA_DIR', 'data'))
+    parser.add_argument('--processos', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--so-verificar', action='store_true',
+                        help="só confere os dados, sem migrar nem compactar")
+    parser.add_argument('--retencao-meses', type=int,
+                        default=int(os.environ.get('WALLETCARE_RETENCAO_MESES', '0')),
+                        help="meses mantidos no conjunto vivo (contando o atual); 0 não arquiva nada")
+    args = parser.parse_args()
+
+    dispositivos = ArmazenamentoGastos(args.data_dir).dispositivos()
+    if not dispositivos:
+        print(f"nenhum dispositivo em {args.data_dir}", file=sys.stderr)
+        return 0
+
+    tarefa = partial(processar_dispositivo, args.data_dir, so_verificar=args.so_verificar,
+                     retencao_meses=args.retencao_meses)
+    with ProcessPoolExecutor(max_workers=max(1, args.processos)) as executor:
+        resultados = list(executor.map(tarefa, dispositivos))
+
+    total_antes = total_depois = 0
+    com_problemas = 0
+    for resultado in resultados:
+        antes, depois = resultado['bytes_antes'], resultado['bytes_depois']
+        total_antes += antes
+        total_depois += depois
+        marcas = ' (migrado)' if resultado['migrado'] else ''
+        if resultado['arquivados']:
+            marcas += f" ({len(resultado['arquivados'])} meses arquivados)"
+        print(f"{resultado['device_id']:<40} {formatar_bytes(antes):>10} -> {formatar_bytes(depois):>10}{marcas}")
+        for problema in resultado['problemas']:
+            print(f"  problema: {problema}")
+        com_problemas += bool(resultado['problemas'])
+
+    economia = total_antes - total_depois
+    percentual = 100 * economia / total_antes if total_antes else 0
+    print(f"\n{len(resultados)} dispositivos: {formatar_bytes(total_antes)} -> {formatar_bytes(total_depois)} "
+          f"({formatar_bytes(economia)} a menos, {percentual:.1f}%); {com_problemas} com problemas")
+    return 1 if com_problemas else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,185 @@
+"""Métricas em memória (contadores e histogramas) no formato texto do Prometheus.
+
+Também acompanha, por thread, o tempo gasto em cada fase de uma requisição
+(carregar, calcular, serializar...), usado no log de requisições lentas.
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+BUCKETS_PADRAO = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _rotulos(nomes, valores):
+    if not nomes:
+        return ''
+    pares = ','.join(f'{nome}="{_escapar(valor)}"' for nome, valor in zip(nomes, valores))
+    return '{' + pares + '}'
+
+
+def _escapar(valor):
+    return str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Contador:
+    """Contador monotônico, opcionalmente separado por rótulos"""
+
+    tipo = 'counter'
+
+    def __init__(self, nome, ajuda, rotulos=()):
+        self.nome = nome
+        self.ajuda = ajuda
+        self.rotulos = tuple(rotulos)
+        self._valores = {}
+        self._lock = threading.Lock()
+
+    def incrementar(self, valor=1, *rotulos):
+        with self._lock:
+            self._valores[rotulos] = self._valores.get(rotulos, 0) + valor
+
+    def amostras(self):
+        with self._lock:
+            itens = sorted(self._valores.items())
+        for rotulos, valor in itens:
+            yield f"{self.nome}{_rotulos(self.rotulos, rotulos)} {valor}"
+
+
+class Histograma:
+    """Histograma cumulativo (buckets em segundos), opcionalmente separado por rótulos"""
+
+    tipo = 'histogram'
+
+    def __init__(self, nome, ajuda, rotulos=(), buckets=BUCKETS_PADRAO):
+        self.nome = nome
+        self.ajuda = ajuda
+        self.rotulos = tuple(rotulos)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observar(self, valor, *rotulos):
+        with self._lock:
+            serie = self._series.get(rotulos)
+            if serie is None:
+                serie = self._series[rotulos] = [[0] * len(self.buckets), 0, 0.0]
+            contagens = serie[0]
+            for indice, limite in enumerate(self.buckets):
+                if valor <= limite:
+                    contagens[indice] += 1
+                    break
+            serie[1] += 1
+            serie[2] += valor
+
+    def amostras(self):
+        with self._lock:
+            itens = sorted((rotulos, (list(s[0]), s[1], s[2])) for rotulos, s in self._series.items())
+        nomes_bucket = self.rotulos + ('le',)
+        for rotulos, (contagens, total, soma) in itens:
+            acumulado = 0
+            for limite, contagem in zip(self.buckets, contagens):
+                acumulado += contagem
+                yield f"{self.nome}_bucket{_rotulos(nomes_bucket, rotulos + (limite,))} {acumulado}"
+            yield f"{self.nome}_bucket{_rotulos(nomes_bucket, rotulos + ('+Inf',))} {total}"
+            yield f"{self.nome}_sum{_rotulos(self.rotulos, rotulos)} {soma}"
+            yield f"{self.nome}_count{_rotulos(self.rotulos, rotulos)} {total}"
+
+
+class Medidor:
+    """Valor instantâneo lido na hora da exportação (ex.: ocupação de um cache)"""
+
+    tipo = 'gauge'
+
+    def __init__(self, nome, ajuda, ler):
+        self.nome = nome
+        self.ajuda = ajuda
+        self.ler = ler
+
+    def amostras(self):
+        yield f"{self.nome} {self.ler()}"
+
+
+class RegistroMetricas:
+    def __init__(self):
+        self._metricas = {}
+        self._lock = threading.Lock()
+
+    def _registrar(self, metrica):
+        with self._lock:
+            # Registrar de novo o mesmo nome devolve a métrica existente
+            return self._metricas.setdefault(metrica.nome, metrica)
+
+    def contador(self, nome, ajuda, rotulos=()):
+        return self._registrar(Contador(nome, ajuda, rotulos))
+
+    def histograma(self, nome, ajuda, rotulos=(), buckets=BUCKETS_PADRAO):
+        return self._registrar(Histograma(nome, ajuda, rotulos, buckets))
+
+    def medidor(self, nome, ajuda, ler):
+        return self._registrar(Medidor(nome, ajuda, ler))
+
+    def exportar(self):
+        """Todas as métricas no formato de exposição texto do Prometheus"""
+        with self._lock:
+            metricas = sorted(self._metricas.values(), key=lambda m: m.nome)
+        linhas = []
+        for metrica in metricas:
+            linhas.append(f"# HELP {metrica.nome} {metrica.ajuda}")
+            linhas.append(f"# TYPE {metrica.nome} {metrica.tipo}")
+            linhas.extend(metrica.amostras())
+        return '\n'.join(linhas) + '\n'
+
+
+registro = RegistroMetricas()
+
+# Fases da requisição atual (tempo exclusivo: uma fase aninhada pausa a externa)
+_local = threading.local()
+
+
+def iniciar_fases():
+    _local.fases = {}
+    _local.pilha = []
+
+
+def encerrar_fases():
+    fases = getattr(_local, 'fases', None)
+    _local.fases = None
+    _local.pilha = None
+    return fases or {}
+
+
+@contextmanager
+def fase(nome):
+    """Soma a duração do bloco na fase `nome` da requisição atual (se houver)"""
+    pilha = getattr(_local, 'pilha', None)
+    if pilha is None:
+        yield
+        return
+
+    fases = _local.fases
+    agora = time.perf_counter()
+    if pilha:
+        externa = pilha[-1]
+        fases[externa[0]] = fases.get(externa[0], 0.0) + agora - externa[1]
+    pilha.append([nome, agora])
+    try:
+        yield
+    finally:
+        agora = time.perf_counter()
+        nome, inicio = pilha.pop()
+        fases[nome] = fases.get(nome, 0.0) + agora - inicio
+        if pilha:
+            pilha[-1][1] = agora
+
+
+@contextmanager
+def medir(histograma, *rotulos, fase_requisicao=None):
+    """Observa a duração do bloco no histograma e, opcionalmente, na fase da requisição"""
+    inicio = time.perf_counter()
+    try:
+        if fase_requisicao is None:
+            yield
+        else:
+            with fase(fase_requisicao):
+                yield
+    finally:
+        histograma.observar(time.perf_counter() - inicio, *rotulos)
@@ -6,11 +6,15 @@ from reportlab.lib import colors
 from reportlab.graphics.shapes import Drawing
 from reportlab.graphics.charts.piecharts import Pie
 from reportlab.graphics.charts.linecharts import HorizontalLineChart
-import os
+import io
 from datetime import datetime
-import tempfile
+from utils.agregacao import TabelaGastos
+from utils.armazenamento import chave_dia
 
 class GeradorRelatorio:
+    LINHAS_POR_TABELA = 40
+    CABECALHO_TABELA = ['Data', 'Descrição', 'Categoria', 'Valor']
+    
     def __init__(self):
         self.styles = getSampleStyleSheet()
         self.titulo_style = ParagraphStyle(
@@ -21,6 +25,21 @@ class GeradorRelatorio:
             textColor=colors.HexColor('#2E7D32')
         )
         
+        # Estilo da tabela de gastos (compartilhado por todos os blocos)
+        self.estilo_tabela_gastos = TableStyle([
+            ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#4CAF50')),
+            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+            ('FONTSIZE', (0, 0), (-1, 0), 12),
+            ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+            ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
+            ('GRID', (0, 0), (-1, -1), 1, colors.black),
+            ('FONTNAME', (0, 1), (-1, -1), 'Helvetica'),
+            ('FONTSIZE', (0, 1), (-1, -1), 10),
+            ('ALIGN', (3, 1), (3, -1), 'RIGHT'),  # Alinha valores à direita
+        ])
+        
     def criar_grafico_pizza(self, dados_categoria):
         """Cria gráfico de pizza para gastos por categoria"""
         if not dados_categoria:
@@ -59,66 +78,56 @@ class GeradorRelatorio:
         drawing.add(pie)
         return drawing
     
-    def criar_tabela_gastos(self, gastos):
-        """Cria tabela com todos os gastos"""
-        if not gastos:
-            return Table([["Nenhum gasto registrado"]])
+    def formatar_data(self, data):
+        """'AAAA-MM-DD...' -> 'DD/MM/AAAA' sem reinterpretar a data inteira"""
+        dia = chave_dia(data)
+        if dia is None:
+            return ''
+        return f"{dia[8:10]}/{dia[5:7]}/{dia[0:4]}"
+    
+    def criar_tabelas_gastos(self, gastos):
+        """Cria a tabela de gastos dividida em blocos de LINHAS_POR_TABELA linhas.
         
-        # Cabeçalho da tabela
-        dados_tabela = [['Data', 'Descrição', 'Categoria', 'Valor']]
+        Cada bloco é uma Table pequena com cabeçalho repetido, então o custo
+        de layout por página fica limitado mesmo com milhares de gastos.
+        """
+        if not gastos:
+            return [Table([["Nenhum gasto registrado"]])]
         
-        # Ordena gastos por data (mais recente primeiro)
+        # Ordena gastos por data (mais recente primeiro); datas ISO ordenam como texto
         gastos_ordenados = sorted(gastos, key=lambda x: x.get('data', ''), reverse=True)
         
-        for gasto in gastos_ordenados:
-            data = datetime.fromisoformat(gasto.get('data', '')).strftime('%d/%m/%Y')
-            descricao = gasto.get('descricao', '')[:50] + ('...' if len(gasto.get('descricao', '')) > 50 else '')
-            categoria = gasto.get('categoria', 'outros').replace('_', ' ').title()
-            valor = f"R$ {float(gasto.get('valor', 0)):.2f}"
+        tabelas = []
+        for inicio in range(0, len(gastos_ordenados), self.LINHAS_POR_TABELA):
+            dados_tabela = [self.CABECALHO_TABELA]
             
-            dados_tabela.append([data, descricao, categoria, valor])
-        
-        tabela = Table(dados_tabela, colWidths=[1.2*inch, 3*inch, 1.5*inch, 1*inch])
-        
-        # Estilo da tabela
-        estilo_tabela = TableStyle([
-            ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#4CAF50')),
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, 0), 12),
-            ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-            ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-            ('GRID', (0, 0), (-1, -1), 1, colors.black),
-            ('FONTNAME', (0, 1), (-1, -1), 'Helvetica'),
-            ('FONTSIZE', (0, 1), (-1, -1), 10),
-            ('ALIGN', (3, 1), (3, -1), 'RIGHT'),  # Alinha valores à direita
-        ])
+            for gasto in gastos_ordenados[inicio:inicio + self.LINHAS_POR_TABELA]:
+                data = self.formatar_data(gasto.get('data', ''))
+                descricao = gasto.get('descricao', '')
+                if len(descricao) > 50:
+                    descricao = descricao[:50] + '...'
+                categoria = gasto.get('categoria', 'outros').replace('_', ' ').title()
+                valor = f"R$ {float(gasto.get('valor', 0)):.2f}"
+                
+                dados_tabela.append([data, descricao, categoria, valor])
+            
+            tabela = Table(dados_tabela, colWidths=[1.2*inch, 3*inch, 1.5*inch, 1*inch], repeatRows=1)
+            tabela.setStyle(self.estilo_tabela_gastos)
+            tabelas.append(tabela)
         
-        tabela.setStyle(estilo_tabela)
-        return tabela
+        return tabelas
     
     def calcular_estatisticas(self, gastos, config):
         """Calcula estatísticas dos gastos"""
         if not gastos:
             return {}
         
-        total_gastos = sum(float(g.get('valor', 0)) for g in gastos)
+        tabela = TabelaGastos(gastos)
+        total_gastos = tabela.total()
         
         # Gastos por categoria
-        categorias = {}
-        gastos_impulsivos = 0
-        
-        for gasto in gastos:
-            categoria = gasto.get('categoria', 'outros')
-            valor = float(gasto.get('valor', 0))
-            
-            if categoria not in categorias:
-                categorias[categoria] = 0
-            categorias[categoria] += valor
-            
-            if gasto.get('eh_impulsivo', False) or categoria == 'nao_essencial':
-                gastos_impulsivos += valor
+        categorias = tabela.por_categoria()
+        gastos_impulsivos = tabela.total_impulsivo(incluir_nao_essencial=True)
         
         renda = config.get('renda_mensal', 0)
         economia_potencial = gastos_impulsivos
@@ -134,16 +143,19 @@ class GeradorRelatorio:
             'num_gastos': len(gastos)
         }
     
-    def gerar_relatorio_completo(self, dados, config):
-        """Gera relatório completo em PDF"""
-        # Cria arquivo temporário
-        arquivo_temp = tempfile.NamedTemporaryFile(delete=False, suffix='.pdf')
-        nome_arquivo = arquivo_temp.name
-        arquivo_temp.close()
+    def gerar_relatorio_completo(self, dados, config, periodo=None, incluir_detalhes=True):
+        """Gera relatório completo em PDF e retorna o conteúdo (bytes)
+        
+        periodo é só o rótulo exibido (ex.: 'Outubro/2026'); os gastos já
+        devem vir filtrados. Com incluir_detalhes=False a tabela de gastos é
+        omitida e o relatório traz só resumo, gráfico e insights.
+        """
+        # O PDF é montado em memória: nenhum arquivo temporário fica para trás
+        buffer = io.BytesIO()
         
         # Cria documento PDF
         doc = SimpleDocTemplate(
-            nome_arquivo,
+            buffer,
             pagesize=A4,
             rightMargin=72,
             leftMargin=72,
@@ -165,6 +177,8 @@ class GeradorRelatorio:
             self.styles['Normal']
         )
         elementos.append(data_relatorio)
+        if periodo:
+            elementos.append(Paragraph(f"<b>Período:</b> {periodo}", self.styles['Normal']))
         elementos.append(Spacer(1, 20))
         
         # Calcula estatísticas
@@ -210,13 +224,13 @@ class GeradorRelatorio:
                     elementos.append(Spacer(1, 30))
         
         # Tabela detalhada de gastos
-        gastos_titulo = Paragraph("<b>Detalhamento de Gastos</b>", self.styles['Heading2'])
-        elementos.append(gastos_titulo)
-        elementos.append(Spacer(1, 12))
-        
-        tabela_gastos = self.criar_tabela_gastos(dados['gastos'])
-        elementos.append(tabela_gastos)
-        elementos.append(Spacer(1, 30))
+        if incluir_detalhes:
+            gastos_titulo = Paragraph("<b>Detalhamento de Gastos</b>", self.styles['Heading2'])
+            elementos.append(gastos_titulo)
+            elementos.append(Spacer(1, 12))
+            
+            elementos.extend(self.criar_tabelas_gastos(dados['gastos']))
+            elementos.append(Spacer(1, 30))
         
         # Insights e recomendações
         insights_titulo = Paragraph("<b>Insights e Recomendações</b>", self.styles['Heading2'])
@@ -267,4 +281,4 @@ class GeradorRelatorio:
         # Constrói o PDF
         doc.build(elementos)
         
-        return nome_arquivo
+        return buffer.getvalue()
@@ -0,0 +1,19 @@
+"""Ponto de entrada WSGI para produção.
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+O armazenamento usa lockf por dispositivo, então vários workers podem
+gravar nos mesmos dados; cada worker confere a versão dos dados antes de
+escrever e revalida o próprio cache pela assinatura dos arquivos.
+
+O app carrega o analisador e o NumPy só no primeiro uso (início rápido no
+desenvolvimento). Aqui eles são carregados já na importação: com
+preload_app, o processo mestre os importa uma vez e os workers herdam.
+"""
+import utils.agregacao  # noqa: F401  (NumPy)
+from app import app, inicializar_dados, obter_analisador
+
+inicializar_dados()
+obter_analisador()
+
+application = app